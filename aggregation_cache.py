@@ -0,0 +1,146 @@
+"""
+Cache Redis des résultats d'agrégations MongoDB
+
+Les tableaux de bord et rapports relancent sans cesse les mêmes pipelines
+(analyses par région, top livreurs). AggregationCache stocke leur résultat
+dans Redis (JSON étendu, TTL) sous une clé dérivée du pipeline:
+    cache:agg:{collection}:v{version}:{sha1(pipeline, params)}
+
+Invalidation par version: chaque collection a un compteur
+cache:version:{collection}, incrémenté (bump) après chaque écriture
+(import, synchronisation, rafraîchissement des agrégats). La version fait
+partie de la clé: les résultats antérieurs ne sont plus jamais lus et
+expirent d'eux-mêmes. Un résultat calculé pendant une écriture est rangé
+sous l'ancienne version, donc jamais servi comme à jour.
+
+Single-flight: sur une clé froide, un seul worker calcule le pipeline
+(verrou SET NX PX); les autres attendent son résultat au plus wait_timeout
+secondes, puis calculent eux-mêmes. Si Redis est indisponible, les
+pipelines sont exécutés directement.
+"""
+
+import hashlib
+import time
+import uuid
+from bson import json_util
+from redis.exceptions import RedisError
+from utils import *
+from redis_scripts import ScriptRegistry, CACHE_SCRIPTS
+
+
+DEFAULT_TTL = 300
+
+# Durée de vie du verrou de calcul: un worker disparu ne bloque pas les autres au-delà
+DEFAULT_LOCK_TTL_MS = 30000
+
+# Attente maximale du résultat d'un autre worker (secondes)
+DEFAULT_WAIT_TIMEOUT = 10
+
+_POLL_INTERVAL = 0.05
+
+
+class AggregationCache:
+    """Résultats d'agrégations en cache Redis, invalidés par version de collection"""
+    
+    def __init__(self, redis_conn, ttl=DEFAULT_TTL, lock_ttl_ms=DEFAULT_LOCK_TTL_MS,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.r = redis_conn
+        self.scripts = ScriptRegistry(redis_conn, CACHE_SCRIPTS)
+        self.ttl = ttl
+        self.lock_ttl_ms = lock_ttl_ms
+        self.wait_timeout = wait_timeout
+        # hits: lus en cache, misses: calculés ici, waits: calculés par un
+        # autre worker pendant l'attente, fallbacks: calculés sans cache
+        self.hits = self.misses = self.waits = self.fallbacks = 0
+    
+    # =====================================================================
+    # Versions
+    # =====================================================================
+    
+    @staticmethod
+    def version_key(collection_name):
+        return f"cache:version:{collection_name}"
+    
+    def version(self, collection_name):
+        """Version courante des résultats d'une collection (0 si jamais écrite)"""
+        return int(self.r.get(self.version_key(collection_name)) or 0)
+    
+    def bump(self, collection_name):
+        """
+        Invalider les résultats en cache d'une collection (après écriture)
+        Retourne la nouvelle version, None si Redis est indisponible
+        """
+        try:
+            return self.r.incr(self.version_key(collection_name))
+        except RedisError as e:
+            print_warning(f"Version du cache de {collection_name} non incrémentée: {e}")
+            return None
+    
+    # =====================================================================
+    # Lectures
+    # =====================================================================
+    
+    def key(self, collection_name, pipeline, params=None, version=None):
+        """Clé du résultat d'un pipeline (ordre des champs significatif, comme pour $sort)"""
+        if version is None:
+            version = self.version(collection_name)
+        digest = hashlib.sha1(json_util.dumps([pipeline, params]).encode('utf-8')).hexdigest()
+        return f"cache:agg:{collection_name}:v{version}:{digest}"
+    
+    def aggregate(self, collection, pipeline, params=None, ttl=None):
+        """
+        Résultat de collection.aggregate(pipeline) sous forme de liste, lu en
+        cache ou calculé par un seul worker puis rangé pour ttl secondes
+        params: paramètres hors pipeline qui influent sur le résultat
+        """
+        try:
+            key = self.key(collection.name, pipeline, params)
+            cached = self.r.get(key)
+            if cached is not None:
+                self.hits += 1
+                return json_util.loads(cached)
+            return self._fill(collection, pipeline, key, ttl or self.ttl)
+        except RedisError:
+            self.fallbacks += 1
+            return list(collection.aggregate(pipeline))
+    
+    def _fill(self, collection, pipeline, key, ttl):
+        """Calculer une clé froide sous verrou, ou attendre le worker qui la calcule"""
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            if self.r.set(lock_key, token, nx=True, px=self.lock_ttl_ms):
+                try:
+                    # Remplie entre notre lecture et la prise du verrou
+                    cached = self.r.get(key)
+                    if cached is not None:
+                        self.waits += 1
+                        return json_util.loads(cached)
+                    result = list(collection.aggregate(pipeline))
+                    self.r.set(key, json_util.dumps(result), ex=ttl)
+                    self.misses += 1
+                    return result
+                finally:
+                    self.scripts.call('release_lock', [lock_key], [token])
+            
+            time.sleep(_POLL_INTERVAL)
+            cached = self.r.get(key)
+            if cached is not None:
+                self.waits += 1
+                return json_util.loads(cached)
+            if time.monotonic() > deadline:
+                # Calcul trop long ou worker disparu (son verrou expirera)
+                self.fallbacks += 1
+                return list(collection.aggregate(pipeline))
+    
+    def stats(self):
+        """Compteurs du cache (hit_rate: part des lectures non recalculées ici)"""
+        lookups = self.hits + self.misses + self.waits + self.fallbacks
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'waits': self.waits,
+            'fallbacks': self.fallbacks,
+            'hit_rate': round((self.hits + self.waits) / lookups, 3) if lookups else None,
+        }
@@ -0,0 +1,107 @@
+"""
+Cluster Redis local pour tester le mode cluster (partie1_cluster.py)
+
+Lance N processus redis-server en mode cluster sur localhost (ports
+7000, 7001, ...), les assemble avec redis-cli --cluster create, exécute la
+démonstration du mode cluster puis arrête les processus.
+
+Prérequis: redis-server et redis-cli (Redis 7) dans le PATH.
+
+Usage:
+    python cluster_local.py            # 3 primaires, démo, arrêt
+    python cluster_local.py --keep     # laisser tourner le cluster (Ctrl+C)
+"""
+
+import argparse
+import shutil
+import subprocess
+import tempfile
+import time
+from utils import *
+
+
+def start_local_cluster(base_port=7000, nodes=3):
+    """Démarrer nodes processus redis-server et créer le cluster"""
+    for binary in ('redis-server', 'redis-cli'):
+        if not shutil.which(binary):
+            raise RuntimeError(f"{binary} introuvable dans le PATH")
+    
+    workdir = tempfile.mkdtemp(prefix='redis-cluster-')
+    ports = [base_port + i for i in range(nodes)]
+    processes = []
+    
+    for port in ports:
+        processes.append(subprocess.Popen(
+            [
+                'redis-server',
+                '--port', str(port),
+                '--cluster-enabled', 'yes',
+                '--cluster-config-file', f"nodes-{port}.conf",
+                '--cluster-node-timeout', '5000',
+                '--appendonly', 'no',
+                '--save', '',
+                '--dir', workdir,
+            ],
+            stdout=subprocess.DEVNULL,
+        ))
+    
+    # Attendre que chaque nœud réponde
+    for port in ports:
+        for _ in range(50):
+            if subprocess.run(['redis-cli', '-p', str(port), 'ping'], capture_output=True).returncode == 0:
+                break
+            time.sleep(0.1)
+    
+    subprocess.run(
+        ['redis-cli', '--cluster', 'create', *[f"127.0.0.1:{port}" for port in ports],
+         '--cluster-replicas', '0', '--cluster-yes'],
+        check=True, stdout=subprocess.DEVNULL,
+    )
+    
+    # Attendre que tous les slots soient couverts
+    for _ in range(100):
+        info = subprocess.run(
+            ['redis-cli', '-p', str(ports[0]), 'cluster', 'info'],
+            capture_output=True, text=True,
+        ).stdout
+        if 'cluster_state:ok' in info:
+            break
+        time.sleep(0.1)
+    
+    print_success(f"Cluster local prêt: {', '.join(f'127.0.0.1:{port}' for port in ports)}")
+    return processes, workdir
+
+
+def stop_local_cluster(processes, workdir):
+    """Arrêter les nœuds et supprimer leurs fichiers"""
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print_success("Cluster local arrêté")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster Redis local de test")
+    parser.add_argument('--nodes', type=int, default=3)
+    parser.add_argument('--base-port', type=int, default=7000)
+    parser.add_argument('--keep', action='store_true', help="laisser tourner le cluster")
+    args = parser.parse_args()
+    
+    processes, workdir = start_local_cluster(args.base_port, args.nodes)
+    os.environ['REDIS_CLUSTER_NODES'] = ','.join(
+        f"localhost:{args.base_port + i}" for i in range(args.nodes)
+    )
+    try:
+        if args.keep:
+            print_info("Ctrl+C pour arrêter le cluster")
+            while True:
+                time.sleep(1)
+        else:
+            from partie1_cluster import run_partie1_cluster
+            run_partie1_cluster()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_local_cluster(processes, workdir)
@@ -0,0 +1,168 @@
+"""
+Migration vers le stockage compact (partie1_compact.py)
+
+Convertit une base au schéma historique:
+- order:{id} + assignment:{id}          → champ de orders:b:{n}
+- driver:{id} + driver:{id}:stats       → champ de drivers:b:{n}
+par paquets SCAN (non bloquant), puis supprime les anciennes clés (UNLINK,
+libération en arrière-plan). Les sets, index et classements sont communs
+aux deux schémas et ne sont pas modifiés.
+
+La migration doit être lancée application arrêtée: une écriture sur une
+ancienne clé pendant la copie serait perdue.
+
+Les parties 3 et 4 lisent toujours le schéma historique des livreurs.
+
+Usage:
+    python compact_migration.py                 # migrer, rapport avant/après
+    python compact_migration.py --dry-run       # rapport mémoire seulement
+    python compact_migration.py --keep-legacy   # copier sans supprimer
+    python compact_migration.py --demo 10000    # charger N commandes (schéma
+                                                # historique) puis migrer
+"""
+
+import argparse
+from utils import *
+from data_generator import DataGenerator
+from partie1_compact import check_listpack_config
+from redis_keys import CompactKeySchema
+import redis_batch
+
+
+STATS_FIELDS = ['deliveries_in_progress', 'deliveries_completed', 'total_revenue']
+
+
+def memory_snapshot(r):
+    """Mémoire utilisée, nombre de clés, de commandes et de livreurs"""
+    orders = sum(
+        r.scard(f"orders:status:{status}") for status in DataGenerator.ORDER_STATUSES
+    )
+    return {
+        'used_memory': r.info('memory')['used_memory'],
+        'keys': r.dbsize(),
+        'orders': orders,
+        'drivers': r.scard('drivers:all'),
+    }
+
+
+def migrate_orders(r, batch_size=1000, keep_legacy=False):
+    """Copier les commandes dans orders:b:{n}, retourne le nombre migré"""
+    keys = CompactKeySchema()
+    migrated = 0
+    
+    for chunk in iter_chunks(r.scan_iter(match='order:*', count=batch_size), batch_size):
+        order_ids = [key.split(':', 1)[1] for key in chunk]
+        orders = redis_batch.fetch_orders(r, order_ids)
+        assignments = redis_batch.fetch_assignments(r, order_ids)
+        
+        buckets = {}
+        for order_id, order in orders.items():
+            if not order:
+                continue
+            if assignments.get(order_id):
+                order['driver_id'] = assignments[order_id]
+            buckets.setdefault(keys.order_bucket(order_id), {})[order_id] = (
+                keys.pack(keys.ORDER_FIELDS, order)
+            )
+            migrated += 1
+        
+        pipe = r.pipeline(transaction=False)
+        for bucket, records in buckets.items():
+            pipe.hset(bucket, mapping=records)
+        if not keep_legacy:
+            pipe.unlink(*chunk, *[f"assignment:{order_id}" for order_id in order_ids])
+        pipe.execute()
+    
+    return migrated
+
+
+def migrate_drivers(r, batch_size=1000, keep_legacy=False):
+    """Copier profils et stats des livreurs dans drivers:b:{n}"""
+    keys = CompactKeySchema()
+    migrated = 0
+    
+    profiles = (key for key in r.scan_iter(match='driver:*', count=batch_size) if key.count(':') == 1)
+    for chunk in iter_chunks(profiles, batch_size):
+        driver_ids = [key.split(':', 1)[1] for key in chunk]
+        drivers = redis_batch.fetch_drivers(r, driver_ids, stats_fields=STATS_FIELDS)
+        
+        buckets = {}
+        for driver_id, driver in drivers.items():
+            buckets.setdefault(keys.driver_bucket(driver_id), {})[driver_id] = (
+                keys.pack(keys.DRIVER_FIELDS, driver)
+            )
+            migrated += 1
+        
+        pipe = r.pipeline(transaction=False)
+        for bucket, records in buckets.items():
+            pipe.hset(bucket, mapping=records)
+        if not keep_legacy:
+            pipe.unlink(*chunk, *[f"driver:{driver_id}:stats" for driver_id in driver_ids])
+        pipe.execute()
+    
+    return migrated
+
+
+def print_memory_report(before, after):
+    """Rapport mémoire avant/après migration"""
+    print_subheader("Rapport mémoire")
+    rows = [
+        ['Mémoire utilisée', format_bytes(before['used_memory']), format_bytes(after['used_memory'])],
+        ['Clés', before['keys'], after['keys']],
+    ]
+    for label, count_field in (('Octets / commande', 'orders'), ('Octets / livreur', 'drivers')):
+        if before[count_field]:
+            rows.append([
+                label,
+                before['used_memory'] // before[count_field],
+                after['used_memory'] // after[count_field],
+            ])
+    print_table(['', 'Avant', 'Après'], rows)
+    
+    saved = before['used_memory'] - after['used_memory']
+    if before['used_memory']:
+        print_info(f"Gain: {format_bytes(saved)} ({saved / before['used_memory']:.0%})")
+
+
+def run_migration(r, batch_size=1000, keep_legacy=False, dry_run=False):
+    """Migrer vers le stockage compact et afficher le rapport avant/après"""
+    print_header("MIGRATION VERS LE STOCKAGE COMPACT")
+    
+    for name, current, minimum in check_listpack_config(r, apply=True):
+        print_warning(f"{name} = {current} (< {minimum}): les paquets ne resteront pas en listpack")
+    
+    before = memory_snapshot(r)
+    if dry_run:
+        print_memory_report(before, before)
+        return before, before
+    
+    drivers = migrate_drivers(r, batch_size, keep_legacy)
+    orders = migrate_orders(r, batch_size, keep_legacy)
+    print_success(f"{drivers} livreurs et {orders} commandes migrés")
+    
+    after = memory_snapshot(r)
+    print_memory_report(before, after)
+    return before, after
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migration vers le stockage compact")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--keep-legacy', action='store_true', help="ne pas supprimer les anciennes clés")
+    parser.add_argument('--dry-run', action='store_true', help="rapport mémoire sans migration")
+    parser.add_argument('--demo', type=int, metavar='N', help="vider Redis et charger N commandes d'abord")
+    args = parser.parse_args()
+    
+    r = get_redis_connection()
+    if not r:
+        print_error("Impossible de se connecter à Redis. Assurez-vous que Docker est lancé.")
+        raise SystemExit(1)
+    
+    if args.demo:
+        from partie1_redis_temps_reel import RedisDeliverySystem
+        clear_redis(r)
+        legacy = RedisDeliverySystem(r)
+        legacy.bulk_load_drivers(DataGenerator.generate_drivers(max(args.demo // 20, 1)))
+        legacy.ingest_orders(DataGenerator.iter_orders(args.demo))
+    
+    run_migration(r, args.batch_size, args.keep_legacy, args.dry_run)
@@ -2,6 +2,7 @@
 Générateur de données de test pour le système de livraisons
 """
 import random
+from itertools import islice
 from datetime import datetime, timedelta
 from faker import Faker
 
@@ -80,7 +81,11 @@ class DataGenerator:
     @staticmethod
     def generate_orders(count=100):
         """Générer des commandes"""
-        orders = []
+        return list(DataGenerator.iter_orders(count))
+    
+    @staticmethod
+    def iter_orders(count=100):
+        """Générer des commandes une à une (pour l'ingestion en flux)"""
         all_locations = list(DataGenerator.PARIS_LOCATIONS.keys()) + list(DataGenerator.BANLIEUE_LOCATIONS.keys())
         
         base_time = datetime.now() - timedelta(hours=3)
@@ -89,7 +94,7 @@ class DataGenerator:
             order_id = f"c{i+1}"
             created_at = base_time + timedelta(minutes=random.randint(0, 180))
             
-            order = {
+            yield {
                 'id': order_id,
                 'client': f"Client {fake.last_name()}",
                 'destination': random.choice(all_locations),
@@ -97,17 +102,20 @@ class DataGenerator:
                 'created_at': created_at.isoformat(),
                 'status': random.choice(DataGenerator.ORDER_STATUSES),
             }
-            orders.append(order)
-        return orders
     
     @staticmethod
     def generate_deliveries(drivers, orders, count=200):
         """Générer un historique de livraisons pour MongoDB"""
-        deliveries = []
-        
-        for i in range(min(count, len(orders))):
+        return list(DataGenerator.iter_deliveries(drivers, orders, count))
+    
+    @staticmethod
+    def iter_deliveries(drivers, orders, count=200):
+        """
+        Générer les livraisons une à une (import en flux)
+        orders peut être un générateur (ex: iter_orders)
+        """
+        for order in islice(orders, count):
             driver = random.choice(drivers)
-            order = orders[i % len(orders)]
             
             # Coordonnées de destination
             all_locations = {**DataGenerator.PARIS_LOCATIONS, **DataGenerator.BANLIEUE_LOCATIONS}
@@ -139,7 +147,7 @@ class DataGenerator:
                 "Je recommande",
             ]
             
-            delivery = {
+            yield {
                 'command_id': order['id'],
                 'client': order['client'],
                 'driver_id': driver['id'],
@@ -155,9 +163,6 @@ class DataGenerator:
                 'destination': destination,
                 'destination_coords': dest_coords,
             }
-            deliveries.append(delivery)
-        
-        return deliveries
     
     @staticmethod
     def get_initial_drivers():
@@ -0,0 +1,219 @@
+"""
+Agrégats matérialisés de l'historique des livraisons (MongoDB)
+
+Les analyses par région et par livreur ne regroupent plus toute la
+collection deliveries: elles lisent delivery_rollups, un document par
+(jour, région, livreur):
+    {_id: {day, region, driver_id}, day, region, driver_id, driver_name,
+     count, sum_amount, sum_duration, sum_rating, refreshed_at}
+Les moyennes se déduisent des sommes (sum_duration / count), donc les
+agrégats se recombinent sans perte par région, par livreur ou par période.
+
+refresh() recalcule entièrement les jours touchés ($group puis $merge):
+rejouer un rafraîchissement est sans effet, et les agrégats d'un jour dont
+les livraisons ont disparu sont supprimés. Sans borne, il repart du
+dernier jour traité (rollup_state) moins lookback_days, pour rattraper les
+livraisons synchronisées en retard.
+
+Avec un cache (aggregation_cache.AggregationCache), les lectures sont
+servies par Redis et chaque rafraîchissement incrémente la version de
+delivery_rollups, ce qui invalide les résultats en cache.
+
+Nécessite MongoDB >= 4.2 ($merge) et l'index idx_delivery_time.
+"""
+
+from datetime import datetime, timedelta
+from bson import ObjectId
+
+
+ROLLUPS_COLLECTION = 'delivery_rollups'
+STATE_COLLECTION = 'rollup_state'
+
+# $group de contrôle sur la collection brute (check_consistency)
+RAW_REGION_PIPELINE = [
+    {'$group': {'_id': '$region', 'count': {'$sum': 1}, 'amount': {'$sum': '$amount'}}},
+]
+
+# Écarts d'arrondi tolérés sur les sommes de montants (flottants)
+_AMOUNT_TOLERANCE = 1e-6
+
+
+class DeliveryRollups:
+    """Agrégats quotidiens par région et par livreur, rafraîchis par $merge"""
+    
+    def __init__(self, db, lookback_days=1, cache=None):
+        self.deliveries = db['deliveries']
+        self.rollups = db[ROLLUPS_COLLECTION]
+        self.state = db[STATE_COLLECTION]
+        self.lookback_days = lookback_days
+        self.cache = cache
+    
+    def ensure_indexes(self):
+        """Index des fenêtres de rafraîchissement (jours) et de leur source"""
+        self.rollups.create_index('day', name='idx_day')
+        self.deliveries.create_index('delivery_time', name='idx_delivery_time')
+    
+    # =====================================================================
+    # Rafraîchissement
+    # =====================================================================
+    
+    @staticmethod
+    def _day_start(moment):
+        return datetime(moment.year, moment.month, moment.day)
+    
+    def window_pipeline(self, start, end, stamp):
+        """$match de la fenêtre [start, end) et $group par (jour, région, livreur)"""
+        window = {}
+        if start is not None:
+            window['$gte'] = start
+        if end is not None:
+            window['$lt'] = end
+        return [
+            {'$match': {'delivery_time': window} if window else {}},
+            {
+                '$group': {
+                    '_id': {
+                        'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$delivery_time'}},
+                        'region': '$region',
+                        'driver_id': '$driver_id',
+                    },
+                    'driver_name': {'$last': '$driver_name'},
+                    'count': {'$sum': 1},
+                    'sum_amount': {'$sum': '$amount'},
+                    'sum_duration': {'$sum': '$duration_minutes'},
+                    'sum_rating': {'$sum': '$rating'},
+                }
+            },
+            {
+                '$addFields': {
+                    'day': '$_id.day',
+                    'region': '$_id.region',
+                    'driver_id': '$_id.driver_id',
+                    'refreshed_at': stamp,
+                }
+            },
+        ]
+    
+    def refresh(self, since=None, until=None):
+        """
+        Recalculer les agrégats des jours de [since, until]
+        - since=None: depuis le dernier jour traité moins lookback_days
+          (tout l'historique au premier appel, voir rebuild)
+        - until=None: jusqu'aux livraisons les plus récentes
+        Retourne le nombre de documents d'agrégats écrits
+        """
+        if since is None:
+            state = self.state.find_one({'_id': 'deliveries'})
+            if state:
+                since = state['watermark'] - timedelta(days=self.lookback_days)
+        start = self._day_start(since) if since is not None else None
+        end = self._day_start(until) + timedelta(days=1) if until is not None else None
+        
+        # Les documents recalculés portent ce tampon: ceux des mêmes jours
+        # qui ne l'ont pas reçu (plus de livraisons) sont obsolètes
+        stamp = ObjectId()
+        pipeline = self.window_pipeline(start, end, stamp)
+        pipeline.append({
+            '$merge': {
+                'into': self.rollups.name,
+                'on': '_id',
+                'whenMatched': 'replace',
+                'whenNotMatched': 'insert',
+            }
+        })
+        self.deliveries.aggregate(pipeline)
+        
+        days = {}
+        if start is not None:
+            days['$gte'] = start.strftime('%Y-%m-%d')
+        if end is not None:
+            days['$lt'] = end.strftime('%Y-%m-%d')
+        stale = {'refreshed_at': {'$lt': stamp}}
+        if days:
+            stale['day'] = days
+        self.rollups.delete_many(stale)
+        if self.cache is not None:
+            self.cache.bump(self.rollups.name)
+        
+        latest = self.deliveries.find_one(
+            {'delivery_time': {'$ne': None}}, {'delivery_time': 1}, sort=[('delivery_time', -1)]
+        )
+        if latest:
+            self.state.update_one(
+                {'_id': 'deliveries'}, {'$max': {'watermark': latest['delivery_time']}}, upsert=True
+            )
+        return self.rollups.count_documents({'refreshed_at': stamp})
+    
+    def rebuild(self):
+        """Recalculer tous les agrégats (après un import complet)"""
+        self.state.delete_one({'_id': 'deliveries'})
+        return self.refresh()
+    
+    # =====================================================================
+    # Lectures
+    # =====================================================================
+    
+    def totals_pipeline(self, group_id, extra=None, limit=None):
+        """Pipeline de recombinaison des agrégats par group_id (revenu décroissant)"""
+        group = {
+            '_id': group_id,
+            'nombre_livraisons': {'$sum': '$count'},
+            'revenu_total': {'$sum': '$sum_amount'},
+            'sum_duration': {'$sum': '$sum_duration'},
+            'sum_rating': {'$sum': '$sum_rating'},
+        }
+        group.update(extra or {})
+        pipeline = [
+            {'$group': group},
+            {
+                '$addFields': {
+                    'duree_moyenne': {'$divide': ['$sum_duration', '$nombre_livraisons']},
+                    'rating_moyen': {'$divide': ['$sum_rating', '$nombre_livraisons']},
+                }
+            },
+            {'$sort': {'revenu_total': -1}},
+        ]
+        if limit:
+            pipeline.append({'$limit': limit})
+        return pipeline
+    
+    def _aggregate(self, pipeline):
+        if self.cache is None:
+            return list(self.rollups.aggregate(pipeline))
+        return self.cache.aggregate(self.rollups, pipeline)
+    
+    def region_totals(self):
+        """Livraisons, revenu, durée et rating moyens par région (revenu décroissant)"""
+        return self._aggregate(self.totals_pipeline('$region'))
+    
+    def driver_totals(self, limit=None):
+        """Mêmes indicateurs par livreur, limités aux limit meilleurs revenus"""
+        return self._aggregate(
+            self.totals_pipeline('$driver_id', {'driver_name': {'$last': '$driver_name'}}, limit)
+        )
+    
+    def check_consistency(self):
+        """
+        Comparer les agrégats par région à un $group sur la collection brute
+        (coûteux: à lancer ponctuellement). Retourne la liste des écarts
+        [{'region', 'raw': (livraisons, montant), 'rollup': (livraisons, montant)}]
+        """
+        raw = {
+            doc['_id']: (doc['count'], doc['amount'])
+            for doc in self.deliveries.aggregate(RAW_REGION_PIPELINE)
+        }
+        rolled = {
+            # Lecture directe: le cache pourrait masquer un écart
+            doc['_id']: (doc['nombre_livraisons'], doc['revenu_total'])
+            for doc in self.rollups.aggregate(self.totals_pipeline('$region'))
+        }
+        
+        mismatches = []
+        for region in sorted(set(raw) | set(rolled), key=str):
+            raw_count, raw_amount = raw.get(region, (0, 0))
+            count, amount = rolled.get(region, (0, 0))
+            if raw_count != count or abs(raw_amount - amount) > _AMOUNT_TOLERANCE:
+                mismatches.append({
+                    'region': region, 'raw': (raw_count, raw_amount), 'rollup': (count, amount),
+                })
+        return mismatches
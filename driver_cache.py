@@ -0,0 +1,302 @@
+"""
+Cache local des profils livreurs (nom, région, rating)
+
+Les profils changent rarement mais sont relus à chaque affichage ou
+affectation. DriverProfileCache les garde en mémoire du processus (LRU
+borné à max_size livreurs, compteurs hits/misses) et les invalide quand
+Redis signale une modification:
+- mode 'tracking': CLIENT TRACKING BCAST sur le préfixe des profils
+  (driver: ou drivers:b: en stockage compact), les invalidations sont
+  redirigées vers une connexion abonnée à __redis__:invalidate
+- mode 'pubsub' (repli si CLIENT TRACKING est indisponible, Redis < 6):
+  les écritures de profils publient les IDs modifiés sur
+  PROFILE_INVALIDATION_CHANNEL (voir RedisDeliverySystem.bulk_load_drivers)
+Les stats (livraisons en cours, revenu) changent à chaque transition et
+ne sont jamais mises en cache. Les écritures de stats (driver:{id}:stats)
+tombent sous le préfixe suivi mais n'invalident aucun profil.
+
+Stockage compact: profil et stats partagent l'enregistrement du livreur
+dans drivers:b:{n}, donc chaque affectation ou livraison invalide les
+profils en cache de tout le paquet. Le cache y sert surtout les lectures
+groupées entre deux transitions; séparer profils et stats demanderait un
+autre format de paquet (voir redis_keys.CompactKeySchema).
+
+Tant que la connexion d'invalidation n'est pas établie (ou après une
+coupure, pendant laquelle des invalidations ont pu être perdues), le cache
+est vidé et les lectures vont directement à Redis.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from redis.exceptions import ConnectionError, ResponseError, TimeoutError
+from redis_keys import KeySchema
+import redis_batch
+
+
+# Champs du hash driver:{id} mis en cache
+PROFILE_FIELDS = ('name', 'region', 'rating')
+
+DEFAULT_MAX_SIZE = 10000
+
+# Canal des invalidations redirigées par CLIENT TRACKING (RESP2)
+TRACKING_CHANNEL = '__redis__:invalidate'
+
+# Canal de repli: IDs de livreurs séparés par des virgules
+PROFILE_INVALIDATION_CHANNEL = 'drivers:profiles:invalidate'
+
+# Intervalle de vérification de la connexion de suivi (secondes)
+_TRACKING_PING_INTERVAL = 5
+
+
+class DriverProfileCache:
+    """Cache LRU des profils livreurs invalidé par Redis"""
+    
+    def __init__(self, redis_conn, max_size=DEFAULT_MAX_SIZE, keys=None):
+        self.r = redis_conn
+        self.keys = keys or KeySchema()
+        self.max_size = max_size
+        self.mode = 'désactivé'
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Incrémenté à chaque invalidation: une lecture Redis concurrente
+        # d'une invalidation n'est pas mise en cache (valeur possiblement périmée)
+        self._epoch = 0
+        self._active = False
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    # =====================================================================
+    # Lectures
+    # =====================================================================
+    
+    def get_many(self, driver_ids, fields=PROFILE_FIELDS):
+        """
+        Profils de plusieurs livreurs, les absents du cache lus en un
+        aller-retour (redis_batch.fetch_drivers)
+        Retourne {driver_id: {champ: valeur}} limité à fields
+        """
+        driver_ids = list(driver_ids)
+        profiles = {}
+        missing = []
+        with self._lock:
+            for driver_id in driver_ids:
+                entry = self._entries.get(driver_id) if self._active else None
+                if entry is None:
+                    missing.append(driver_id)
+                else:
+                    self._entries.move_to_end(driver_id)
+                    profiles[driver_id] = entry
+            self.hits += len(driver_ids) - len(missing)
+            self.misses += len(missing)
+            epoch = self._epoch
+        
+        if missing:
+            fetched = redis_batch.fetch_drivers(self.r, missing, PROFILE_FIELDS, keys=self.keys)
+            with self._lock:
+                if self._active and self._epoch == epoch:
+                    for driver_id, profile in fetched.items():
+                        # Livreur inexistant: pas d'entrée (il peut être créé plus tard)
+                        if profile:
+                            self._store(driver_id, profile)
+            profiles.update(fetched)
+        
+        return {
+            driver_id: {f: profiles[driver_id][f] for f in fields if f in profiles[driver_id]}
+            for driver_id in driver_ids
+        }
+    
+    def get(self, driver_id, field):
+        """Un champ du profil d'un livreur (None s'il n'existe pas)"""
+        return self.get_many([driver_id], [field])[driver_id].get(field)
+    
+    def _store(self, driver_id, profile):
+        self._entries[driver_id] = {f: profile[f] for f in PROFILE_FIELDS if f in profile}
+        self._entries.move_to_end(driver_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+    
+    def stats(self):
+        """Compteurs du cache (hit_rate: part des lectures servies localement)"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'mode': self.mode,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
+    
+    # =====================================================================
+    # Invalidation
+    # =====================================================================
+    
+    def invalidate(self, driver_ids, publish=False):
+        """
+        Retirer des profils du cache local
+        publish=True prévient aussi les autres processus (mode 'pubsub');
+        à appeler après toute écriture de profils
+        """
+        driver_ids = list(driver_ids)
+        if not driver_ids:
+            # Clé suivie sans profil (stats, index): ne pas annuler les
+            # lectures en cours, le cache ne se remplirait plus sous charge
+            return
+        with self._lock:
+            self._epoch += 1
+            for driver_id in driver_ids:
+                if self._entries.pop(driver_id, None) is not None:
+                    self.invalidations += 1
+        if publish:
+            self.r.publish(PROFILE_INVALIDATION_CHANNEL, ','.join(driver_ids))
+    
+    def clear(self):
+        """Vider le cache (les compteurs sont conservés)"""
+        with self._lock:
+            self._epoch += 1
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+    
+    def _tracked_prefix(self):
+        return 'drivers:b:' if self.keys.compact else 'driver:'
+    
+    def _ids_of_key(self, key):
+        """IDs de livreurs concernés par la modification d'une clé suivie"""
+        if self.keys.compact:
+            # Un paquet drivers:b:{n} regroupe plusieurs livreurs
+            with self._lock:
+                return [d for d in self._entries if self.keys.driver_bucket(d) == key]
+        # driver:{id}:stats et driver:{id}:regions ne contiennent pas le profil
+        prefix, _, driver_id = key.partition(':')
+        if prefix == 'driver' and driver_id and ':' not in driver_id:
+            return [driver_id]
+        return []
+    
+    def _on_message(self, message):
+        kind, channel, data = message[0], message[1], message[2]
+        if kind != 'message':
+            return
+        if channel == PROFILE_INVALIDATION_CHANNEL:
+            self.invalidate(data.split(','))
+        elif data is None:
+            # FLUSHDB / FLUSHALL
+            self.clear()
+        else:
+            self.invalidate([d for key in data for d in self._ids_of_key(key)])
+    
+    # =====================================================================
+    # Connexion d'invalidation (thread de fond)
+    # =====================================================================
+    
+    def start(self, timeout=2):
+        """
+        Lancer l'écoute des invalidations, attendre au plus timeout secondes
+        qu'elle soit active. Retourne True si le cache est actif
+        """
+        if not hasattr(self.r, 'connection_pool'):
+            # Redis Cluster: le suivi d'un nœud ne couvre pas les autres
+            return False
+        if not (self._thread and self._thread.is_alive()):
+            self._stop.clear()
+            self._ready.clear()
+            self._thread = threading.Thread(target=self._listen, name='driver-profile-cache', daemon=True)
+            self._thread.start()
+        self._ready.wait(timeout)
+        return self._active
+    
+    def close(self, timeout=None):
+        """Arrêter l'écoute (le cache repasse en lecture directe)"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def _connect(self):
+        """Connexion dédiée, hors du pool (elle reste ouverte tant que le cache vit)"""
+        pool = self.r.connection_pool
+        connection = pool.connection_class(**pool.connection_kwargs)
+        connection.connect()
+        return connection
+    
+    def _enable_tracking(self, client_id):
+        """
+        CLIENT TRACKING BCAST redirigé vers client_id sur une seconde connexion
+        Retourne cette connexion, ou None si le suivi est indisponible
+        """
+        tracker = self._connect()
+        try:
+            tracker.send_command(
+                'CLIENT', 'TRACKING', 'ON', 'REDIRECT', client_id,
+                'BCAST', 'PREFIX', self._tracked_prefix(),
+            )
+            tracker.read_response()
+        except ResponseError:
+            tracker.disconnect()
+            return None
+        return tracker
+    
+    def _set_active(self, mode):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._active = mode is not None
+            self.mode = mode or 'désactivé'
+        self._ready.set()
+    
+    def _listen(self):
+        while not self._stop.is_set():
+            listener = tracker = None
+            try:
+                listener = self._connect()
+                listener.send_command('CLIENT', 'ID')
+                client_id = listener.read_response()
+                listener.send_command('SUBSCRIBE', TRACKING_CHANNEL, PROFILE_INVALIDATION_CHANNEL)
+                for _ in range(2):
+                    listener.read_response()
+                
+                tracker = self._enable_tracking(client_id)
+                self._set_active('tracking' if tracker else 'pubsub')
+                last_ping = time.monotonic()
+                
+                while not self._stop.is_set():
+                    if listener.can_read(timeout=0.5):
+                        self._on_message(listener.read_response())
+                    if tracker and time.monotonic() - last_ping > _TRACKING_PING_INTERVAL:
+                        # Connexion de suivi fermée = plus aucune invalidation
+                        tracker.send_command('PING')
+                        tracker.read_response()
+                        last_ping = time.monotonic()
+            except (ConnectionError, TimeoutError, OSError):
+                # Invalidations possiblement perdues: cache vidé et désactivé
+                # jusqu'à la reconnexion
+                self._set_active(None)
+                self._stop.wait(1)
+            finally:
+                for connection in (listener, tracker):
+                    if connection is not None:
+                        connection.disconnect()
+        self._set_active(None)
+
+
+# Un cache par pool de connexions et par schéma (historique / compact)
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_driver_profile_cache(redis_conn, keys=None, max_size=DEFAULT_MAX_SIZE):
+    """Cache des profils partagé par le processus, démarré à la première demande"""
+    keys = keys or KeySchema()
+    pool = getattr(redis_conn, 'connection_pool', redis_conn)
+    with _caches_lock:
+        cache = _caches.get((id(pool), keys.compact))
+        if cache is None:
+            cache = DriverProfileCache(redis_conn, max_size, keys)
+            _caches[(id(pool), keys.compact)] = cache
+    cache.start()
+    return cache
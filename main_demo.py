@@ -14,6 +14,7 @@ try:
     from partie2_mongodb_historique import run_partie2
     from partie3_avancees import run_partie3
     from partie4_geospatial import run_partie4
+    from redis_memory_report import run_memory_report
 except ImportError as e:
     print_error(f"Erreur d'import: {e}")
     print_info("Assurez-vous que tous les fichiers sont présents")
@@ -45,6 +46,7 @@ def display_menu():
     print("4. Partie 4 - Geo-spatial (localisation temps réel)")
     print("5. Exécuter TOUTES les parties")
     print("6. Tester les connexions")
+    print("7. Rapport mémoire Redis")
     print("0. Quitter")
     print()
 
@@ -54,11 +56,16 @@ def test_connections():
     print_header("TEST DES CONNEXIONS")
     
     # Test Redis
-    r = get_redis_connection()
+    r = get_redis_connection(check=True)
     if r:
         print_success("Redis: OK")
         info = r.info('server')
         print_info(f"  Version: {info.get('redis_version', 'N/A')}")
+        stats = get_redis_pool_stats()
+        print_info(
+            f"  Pool: {stats['in_use']} utilisées / {stats['created']} ouvertes "
+            f"/ {stats['max_connections']} max ({stats['utilization']:.0%})"
+        )
     else:
         print_error("Redis: ÉCHEC")
         print_info("  Assurez-vous que Docker est lancé: docker-compose up -d")
@@ -184,6 +191,13 @@ def main():
             run_all_parts()
         elif choice == '6':
             test_connections()
+        elif choice == '7':
+            try:
+                run_memory_report('redis_memory_report.json')
+            except Exception as e:
+                print_error(f"Erreur: {e}")
+                import traceback
+                traceback.print_exc()
         else:
             print_warning("Choix invalide. Veuillez réessayer.")
         
@@ -0,0 +1,138 @@
+"""
+Archivage des commandes livrées (politique de rétention Redis)
+
+Une commande livrée n'a plus sa place dans l'état temps réel une fois
+persistée dans MongoDB (sync_from_redis ou journal des transitions). Par
+paquets, dans l'ordre de création (index orders:created:livrée),
+l'archiveur:
+- vérifie dans MongoDB quelles commandes ont été synchronisées depuis Redis
+  (champ synced_at, posé par MongoDeliveryHistory._upsert_deliveries) et
+  livrées depuis plus de retention_minutes; un document importé de même
+  command_id ne suffit pas
+- les retire du set orders:status:livrée et des index created_at et
+  delivered_at
+- supprime leurs clés (UNLINK: libération en arrière-plan côté Redis) ou,
+  si ttl_seconds est fourni, leur pose un TTL (lecteurs tardifs)
+Les commandes pas encore persistées sont laissées en place et seront
+archivées à un passage suivant.
+
+La mémoire Redis reste ainsi proportionnelle aux commandes vivantes.
+Les index created_at manquants se reconstruisent avec rebuild_created_index.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from utils import *
+from redis_keys import KeySchema
+
+
+class OrderArchiver:
+    """Archiveur des commandes livrées, ponctuel (archive) ou en tâche de fond (start)"""
+    
+    def __init__(self, redis_conn, deliveries, keys=None, batch_size=500,
+                 retention_minutes=0, ttl_seconds=None):
+        self.r = redis_conn
+        self.deliveries = deliveries
+        self.keys = keys or KeySchema()
+        self.batch_size = batch_size
+        self.retention_minutes = retention_minutes
+        self.ttl_seconds = ttl_seconds
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def _persisted(self, order_ids):
+        """Commandes synchronisées dans MongoDB et livrées avant la fenêtre de rétention"""
+        cutoff = datetime.now() - timedelta(minutes=self.retention_minutes)
+        cursor = self.deliveries.find(
+            {
+                'command_id': {'$in': order_ids},
+                'synced_at': {'$exists': True},
+                'delivery_time': {'$lte': cutoff},
+            },
+            {'command_id': 1, '_id': 0},
+        )
+        return {doc['command_id'] for doc in cursor}
+    
+    def _queue_removal(self, pipe, shard, order_ids):
+        """Mettre en file le retrait des sets/index et la suppression des clés"""
+        pipe.srem(self.keys.status_set('livrée', shard), *order_ids)
+        pipe.zrem(self.keys.created_index('livrée', shard), *order_ids)
+        pipe.zrem(self.keys.delivered_index(shard), *order_ids)
+        
+        if self.keys.compact:
+            # Enregistrements dans des hashes partagés: pas de TTL par champ
+            by_bucket = {}
+            for order_id in order_ids:
+                by_bucket.setdefault(self.keys.order_bucket(order_id), []).append(order_id)
+            for bucket, ids in by_bucket.items():
+                pipe.hdel(bucket, *ids)
+            return
+        
+        order_keys = [self.keys.order(order_id) for order_id in order_ids]
+        order_keys += [self.keys.assignment(order_id) for order_id in order_ids]
+        if self.ttl_seconds is None:
+            # UNLINK par clé: en mode cluster les clés sont sur des slots différents
+            for key in order_keys:
+                pipe.unlink(key)
+        else:
+            for key in order_keys:
+                pipe.expire(key, self.ttl_seconds)
+    
+    def archive(self, max_batches=None):
+        """
+        Archiver les commandes livrées persistées, shard par shard
+        Retourne {'archived': n, 'skipped': m} (skipped: pas encore persistées)
+        """
+        archived = skipped = batches = 0
+        
+        for shard in self.keys.shards():
+            index_key = self.keys.created_index('livrée', shard)
+            start = 0
+            while max_batches is None or batches < max_batches:
+                order_ids = self.r.zrange(index_key, start, start + self.batch_size - 1)
+                if not order_ids:
+                    break
+                batches += 1
+                
+                persisted = self._persisted(order_ids)
+                if persisted:
+                    pipe = self.r.pipeline(transaction=False)
+                    self._queue_removal(pipe, shard, [o for o in order_ids if o in persisted])
+                    pipe.execute()
+                
+                # Les commandes ignorées restent en tête de l'index: les sauter
+                archived += len(persisted)
+                skipped += len(order_ids) - len(persisted)
+                start += len(order_ids) - len(persisted)
+        
+        return {'archived': archived, 'skipped': skipped}
+    
+    def start(self, interval=60):
+        """Lancer l'archivage toutes les interval secondes dans un thread de fond"""
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name='order-archiver', daemon=True
+        )
+        self._thread.start()
+        return self._thread
+    
+    def stop(self, timeout=None):
+        """Arrêter le thread de fond (après le passage en cours)"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                result = self.archive()
+                if result['archived']:
+                    print_info(
+                        f"Archivage: {result['archived']} commandes livrées retirées de Redis "
+                        f"({result['skipped']} en attente de persistance)"
+                    )
+            except Exception as e:
+                print_error(f"Erreur lors de l'archivage: {e}")
+            self._stop.wait(interval)
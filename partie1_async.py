@@ -0,0 +1,268 @@
+"""
+PARTIE 1 (variante asyncio) : État temps réel avec redis.asyncio
+
+Même schéma de clés et mêmes scripts Lua que RedisDeliverySystem, mais
+toutes les opérations sont des coroutines: un service de dispatch asyncio
+peut lancer des milliers d'affectations concurrentes sur un seul pool de
+connexions, sans passer par des threads.
+
+Les méthodes n'affichent rien (usage en service): elles retournent les
+résultats au lieu de les imprimer.
+"""
+
+import asyncio
+import time
+from utils import *
+from data_generator import DataGenerator
+from partie1_redis_temps_reel import RedisDeliverySystem
+from redis_scripts import AsyncScriptRegistry
+from driver_cache import PROFILE_INVALIDATION_CHANNEL
+from redis.exceptions import ResponseError
+
+
+class AsyncRedisDeliverySystem:
+    """Système de livraisons temps réel sur redis.asyncio"""
+    
+    def __init__(self, redis_conn):
+        self.r = redis_conn
+        self.scripts = AsyncScriptRegistry(redis_conn)
+    
+    async def load_scripts(self):
+        """Précharger les scripts Lua (à appeler une fois au démarrage)"""
+        return await self.scripts.load()
+    
+    # =====================================================================
+    # Initialisation
+    # =====================================================================
+    
+    async def initialize_drivers(self, drivers, chunk_size=1000):
+        """Charger les livreurs par paquets pipelinés, retourne le nombre chargé"""
+        total = 0
+        for chunk in iter_chunks(drivers, chunk_size):
+            pipe = self.r.pipeline(transaction=False)
+            RedisDeliverySystem._queue_drivers_chunk(pipe, chunk)
+            await pipe.execute()
+            # Profils réécrits: invalider les caches des autres processus
+            await self.r.publish(PROFILE_INVALIDATION_CHANNEL, ','.join(d['id'] for d in chunk))
+            total += len(chunk)
+        return total
+    
+    async def initialize_orders(self, orders, chunk_size=1000, concurrency=4):
+        """
+        Ingérer un flux de commandes par paquets pipelinés, au plus
+        concurrency paquets en vol à la fois
+        Un paquet en échec arrête l'envoi des suivants; l'erreur est levée
+        une fois les paquets en vol terminés
+        Retourne (nombre de commandes écrites, latences par paquet en secondes)
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+        failed = asyncio.Event()
+        tasks = []
+        latencies = []
+        total = 0
+        
+        async def write_chunk(chunk):
+            nonlocal total
+            try:
+                start = time.perf_counter()
+                pipe = self.r.pipeline(transaction=False)
+                RedisDeliverySystem._queue_orders_chunk(pipe, chunk)
+                await pipe.execute()
+                latencies.append(time.perf_counter() - start)
+                total += len(chunk)
+            except Exception:
+                failed.set()
+                raise
+            finally:
+                semaphore.release()
+        
+        for chunk in iter_chunks(orders, chunk_size):
+            # Le sémaphore borne le nombre de paquets en mémoire
+            await semaphore.acquire()
+            if failed.is_set():
+                semaphore.release()
+                break
+            tasks.append(asyncio.create_task(write_chunk(chunk)))
+        
+        # Attendre tous les paquets en vol avant de signaler le premier échec
+        for outcome in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(outcome, BaseException):
+                raise outcome
+        return total, latencies
+    
+    # =====================================================================
+    # Cycle de vie des commandes
+    # =====================================================================
+    
+    async def assign_order_atomic(self, order_id, driver_id):
+        """Affecter atomiquement une commande, retourne 'OK' ou la raison du refus"""
+        try:
+            return await self.scripts.call('assign_order', keys=[order_id, driver_id])
+        except ResponseError as e:
+            return str(e)
+    
+    async def assign_orders_bulk(self, pairs, chunk_size=500):
+        """Affecter plusieurs couples (commande, livreur), résultat par couple"""
+        results = []
+        for chunk in iter_chunks(pairs, chunk_size):
+            args = [value for pair in chunk for value in pair]
+            outcomes = await self.scripts.call('assign_orders_bulk', args=args)
+            results.extend(
+                (order_id, driver_id, outcome)
+                for (order_id, driver_id), outcome in zip(chunk, outcomes)
+            )
+        return results
+    
+    async def complete_delivery(self, order_id):
+        """Compléter une livraison en un appel, retourne 'OK' ou la raison du refus"""
+        try:
+            await self.scripts.call('complete_delivery', keys=[order_id])
+            return 'OK'
+        except ResponseError as e:
+            return str(e)
+    
+    async def complete_deliveries_bulk(self, order_ids, chunk_size=500):
+        """Compléter plusieurs livraisons, résultat par commande"""
+        results = []
+        for chunk in iter_chunks(order_ids, chunk_size):
+            outcomes = await self.scripts.call('complete_deliveries_bulk', args=chunk)
+            results.extend(zip(chunk, outcomes))
+        return results
+    
+    async def claim_next_orders(self, count=1):
+        """Réserver les count commandes les plus urgentes de la file (ZPOPMIN)"""
+        return await self.r.zpopmin('orders:queue', count)
+    
+    async def wait_next_order(self, timeout=5):
+        """Attendre la prochaine commande (BZPOPMIN), (order_id, score) ou None"""
+        popped = await self.r.bzpopmin('orders:queue', timeout)
+        if not popped:
+            return None
+        _, order_id, score = popped
+        return order_id, score
+    
+    # =====================================================================
+    # Requêtes de statut et dashboard
+    # =====================================================================
+    
+    async def count_orders_by_status(self):
+        """Nombre de commandes par statut (SCARD pipelinés)"""
+        pipe = self.r.pipeline(transaction=False)
+        for status in DataGenerator.ORDER_STATUSES:
+            pipe.scard(f"orders:status:{status}")
+        return dict(zip(DataGenerator.ORDER_STATUSES, await pipe.execute()))
+    
+    async def page_orders_by_status(self, status, after=None, limit=100):
+        """Pagination par clé, même jeton que RedisDeliverySystem.page_orders_by_status"""
+        index_key = f"orders:created:{status}"
+        start = 0
+        
+        if after:
+            score, last_id = after.split(':', 1)
+            rank = await self.r.zrank(index_key, last_id)
+            if rank is not None:
+                start = rank + 1
+            else:
+                start = await self.r.zcount(index_key, '-inf', f"({score}")
+                ties = await self.r.zrangebyscore(index_key, score, score)
+                start += sum(1 for order_id in ties if order_id <= last_id)
+        
+        page = await self.r.zrange(index_key, start, start + limit - 1, withscores=True)
+        token = None
+        if len(page) == limit:
+            last_id, score = page[-1]
+            token = f"{score!r}:{last_id}"
+        return [order_id for order_id, _ in page], token
+    
+    async def get_dashboard(self, max_active=20, top=2):
+        """
+        Données du dashboard en deux allers-retours, indépendamment de la
+        taille de la flotte:
+        {'status_counts', 'active_drivers', 'top_drivers'}
+        """
+        pipe = self.r.pipeline(transaction=False)
+        for status in DataGenerator.ORDER_STATUSES:
+            pipe.scard(f"orders:status:{status}")
+        pipe.zrevrangebyscore('drivers:in_progress', '+inf', 1, start=0, num=max_active, withscores=True)
+        pipe.zrevrange('drivers:ratings', 0, top - 1, withscores=True)
+        *counts, leaderboard, top_drivers = await pipe.execute()
+        
+        # Noms et stats des livreurs affichés, dans un seul pipeline
+        driver_ids = list(dict.fromkeys([d for d, _ in leaderboard] + [d for d, _ in top_drivers]))
+        pipe = self.r.pipeline(transaction=False)
+        for driver_id in driver_ids:
+            pipe.hmget(f"driver:{driver_id}", ['name', 'region'])
+            pipe.hmget(f"driver:{driver_id}:stats", ['deliveries_completed', 'total_revenue'])
+        replies = await pipe.execute()
+        infos = {
+            driver_id: replies[2 * i] + replies[2 * i + 1]
+            for i, driver_id in enumerate(driver_ids)
+        }
+        
+        return {
+            'status_counts': dict(zip(DataGenerator.ORDER_STATUSES, counts)),
+            'active_drivers': [
+                {'id': driver_id, 'name': infos[driver_id][0], 'in_progress': int(count)}
+                for driver_id, count in leaderboard
+            ],
+            'top_drivers': [
+                {
+                    'id': driver_id,
+                    'name': infos[driver_id][0],
+                    'region': infos[driver_id][1],
+                    'rating': rating,
+                    'completed': int(infos[driver_id][2] or 0),
+                    'revenue': float(infos[driver_id][3] or 0),
+                }
+                for driver_id, rating in top_drivers
+            ],
+        }
+
+
+async def run_partie1_async():
+    """Démonstration: affectations concurrentes depuis des coroutines"""
+    
+    print_header("PARTIE 1 (ASYNCIO) : DISPATCH CONCURRENT")
+    
+    r = await get_async_redis_connection()
+    if not r:
+        print_error("Impossible de se connecter à Redis. Assurez-vous que Docker est lancé.")
+        return
+    
+    await r.flushdb()
+    system = AsyncRedisDeliverySystem(r)
+    await system.load_scripts()
+    
+    drivers = DataGenerator.get_initial_drivers()
+    await system.initialize_drivers(drivers)
+    count, latencies = await system.initialize_orders(DataGenerator.iter_orders(2000))
+    print_success(f"{count} commandes ingérées en {len(latencies)} paquets")
+    
+    # Une coroutine de dispatch par commande en attente, toutes concurrentes
+    pending, _ = await system.page_orders_by_status('en_attente', limit=200)
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        system.assign_order_atomic(order_id, drivers[i % len(drivers)]['id'])
+        for i, order_id in enumerate(pending)
+    ))
+    elapsed = time.perf_counter() - start
+    print_success(f"{results.count('OK')}/{len(results)} affectations concurrentes en {elapsed:.3f}s")
+    
+    dashboard = await system.get_dashboard()
+    print_table(
+        ['Statut', 'Nombre'],
+        [[status.upper(), n] for status, n in dashboard['status_counts'].items()],
+        "Commandes par statut"
+    )
+    print_table(
+        ['ID', 'Nom', 'En cours'],
+        [[d['id'], d['name'], d['in_progress']] for d in dashboard['active_drivers']],
+        "Livraisons en cours par livreur"
+    )
+    
+    await r.aclose()
+    print_success("\n✓ Démonstration asyncio terminée!")
+
+
+if __name__ == "__main__":
+    asyncio.run(run_partie1_async())
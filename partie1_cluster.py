@@ -0,0 +1,397 @@
+"""
+PARTIE 1 (mode cluster) : État temps réel sur Redis Cluster
+
+ClusterDeliverySystem reprend l'API de RedisDeliverySystem avec le schéma
+de clés ClusterKeySchema (voir redis_keys):
+- chaque commande et les sets/index de statut de son shard partagent un
+  hash tag: les transitions de statut restent atomiques (un script par shard)
+- les lectures par statut interrogent tous les shards et fusionnent
+- les compteurs livreurs (driver:{id}:stats, drivers:in_progress) sont sur
+  d'autres slots: ils sont mis à jour dans un pipeline juste après la
+  transition de la commande, qui reste la source de vérité
+
+Cluster local de test: python cluster_local.py
+"""
+
+import heapq
+import time
+from datetime import datetime
+from utils import *
+from data_generator import DataGenerator
+from partie1_redis_temps_reel import RedisDeliverySystem
+from redis_keys import ClusterKeySchema
+from driver_cache import get_driver_profile_cache
+from redis_scripts import ScriptRegistry, CLUSTER_SCRIPTS
+
+
+class ClusterDeliverySystem(RedisDeliverySystem):
+    """Système de livraisons temps réel sur Redis Cluster (statuts shardés)"""
+    
+    def __init__(self, redis_conn, shards=16):
+        self.r = redis_conn
+        self.keys = ClusterKeySchema(shards)
+        self.profiles = get_driver_profile_cache(redis_conn, self.keys)
+        self.scripts = ScriptRegistry(redis_conn, CLUSTER_SCRIPTS)
+        self.scripts.load()
+    
+    # =====================================================================
+    # Écritures
+    # =====================================================================
+    
+    def _write_orders_chunk(self, chunk):
+        """Écrire un paquet de commandes, un SADD/ZADD par (shard, statut)"""
+        start = time.perf_counter()
+        pipe = self.r.pipeline(transaction=False)
+        ids_by_set = {}
+        created_by_index = {}
+        queues = {}
+        
+        for order in chunk:
+            shard = self.keys.shard_of(order['id'])
+            pipe.hset(self.keys.order(order['id']), mapping={
+                'id': order['id'],
+                'client': order['client'],
+                'destination': order['destination'],
+                'amount': order['amount'],
+                'created_at': order['created_at'],
+                'status': order['status'],
+            })
+            ids_by_set.setdefault(self.keys.status_set(order['status'], shard), []).append(order['id'])
+            created_by_index.setdefault(self.keys.created_index(order['status'], shard), {})[order['id']] = (
+                datetime.fromisoformat(order['created_at']).timestamp()
+            )
+            if order['status'] == 'en_attente':
+                queues.setdefault(self.keys.pending_queue(shard), {})[order['id']] = (
+                    self.dispatch_score(order)
+                )
+            else:
+                queues.get(self.keys.pending_queue(shard), {}).pop(order['id'], None)
+                pipe.zrem(self.keys.pending_queue(shard), order['id'])
+        
+        for status_key, order_ids in ids_by_set.items():
+            pipe.sadd(status_key, *order_ids)
+        for index_key, scores in created_by_index.items():
+            pipe.zadd(index_key, scores)
+        for queue_key, scores in queues.items():
+            pipe.zadd(queue_key, scores)
+        
+        pipe.execute()
+        return len(chunk), time.perf_counter() - start
+    
+    def _shard_keys(self, shard, from_status, to_status):
+        """
+        KEYS communes des scripts cluster: sets et index source/destination,
+        file, flux et index des livraisons du shard
+        """
+        return [
+            self.keys.status_set(from_status, shard),
+            self.keys.status_set(to_status, shard),
+            self.keys.created_index(from_status, shard),
+            self.keys.created_index(to_status, shard),
+            self.keys.pending_queue(shard),
+            self.keys.event_stream(shard),
+            self.keys.delivered_index(shard),
+        ]
+    
+    def _group_by_shard(self, order_ids):
+        """Positions des commandes groupées par shard"""
+        groups = {}
+        for index, order_id in enumerate(order_ids):
+            groups.setdefault(self.keys.shard_of(order_id), []).append(index)
+        return groups
+    
+    def _assign_pairs(self, pairs):
+        """Affecter une liste de couples, un appel Lua par shard, résultat par couple"""
+        outcomes = [None] * len(pairs)
+        
+        for shard, indexes in self._group_by_shard([o for o, _ in pairs]).items():
+            keys = self._shard_keys(shard, 'en_attente', 'assignée')
+            args = []
+            for i in indexes:
+                order_id, driver_id = pairs[i]
+                keys += [self.keys.order(order_id), self.keys.assignment(order_id)]
+                args += [order_id, driver_id]
+            for i, outcome in zip(indexes, self.scripts.call('assign_orders', keys, args)):
+                outcomes[i] = outcome
+        
+        # Compteurs livreurs (autres slots), en un seul pipeline
+        pipe = self.r.pipeline(transaction=False)
+        for (order_id, driver_id), outcome in zip(pairs, outcomes):
+            if outcome == 'OK':
+                pipe.hincrby(f"driver:{driver_id}:stats", 'deliveries_in_progress', 1)
+                pipe.zincrby('drivers:in_progress', 1, driver_id)
+        pipe.execute()
+        
+        return outcomes
+    
+    def _complete_orders(self, order_ids):
+        """Compléter une liste de commandes, un appel Lua par shard"""
+        outcomes = [None] * len(order_ids)
+        
+        for shard, indexes in self._group_by_shard(order_ids).items():
+            keys = self._shard_keys(shard, 'assignée', 'livrée')
+            args = []
+            for i in indexes:
+                keys += [self.keys.order(order_ids[i]), self.keys.assignment(order_ids[i])]
+                args.append(order_ids[i])
+            for i, outcome in zip(indexes, self.scripts.call('complete_deliveries', keys, args)):
+                outcomes[i] = outcome
+        
+        # Compteurs livreurs: les livreurs retombés à 0 quittent le classement
+        pipe = self.r.pipeline(transaction=False)
+        for outcome in outcomes:
+            if outcome[0] == 'OK':
+                _, driver_id, amount = outcome
+                stats_key = f"driver:{driver_id}:stats"
+                pipe.hincrby(stats_key, 'deliveries_in_progress', -1)
+                pipe.hincrby(stats_key, 'deliveries_completed', 1)
+                pipe.hincrbyfloat(stats_key, 'total_revenue', amount)
+                pipe.zincrby('drivers:in_progress', -1, driver_id)
+        pipe.zremrangebyscore('drivers:in_progress', '-inf', 0)
+        pipe.execute()
+        
+        return outcomes
+    
+    def assign_order_atomic(self, order_id, driver_id):
+        """Affecter une commande (transition atomique sur le shard de la commande)"""
+        print_subheader(f"TRAVAIL 3 : Affectation atomique de {order_id} à {driver_id}")
+        
+        outcome = self._assign_pairs([(order_id, driver_id)])[0]
+        if outcome == 'OK':
+            print_success(f"Commande {order_id} assignée à {driver_id} de manière atomique")
+            return True
+        print_error(f"Erreur lors de l'affectation: {outcome}")
+        return False
+    
+    def assign_orders_bulk(self, pairs, chunk_size=500):
+        """Affecter plusieurs couples (commande, livreur), un appel Lua par shard"""
+        results = []
+        for chunk in iter_chunks(pairs, chunk_size):
+            outcomes = self._assign_pairs(chunk)
+            results.extend(
+                (order_id, driver_id, outcome)
+                for (order_id, driver_id), outcome in zip(chunk, outcomes)
+            )
+        
+        assigned = sum(1 for _, _, outcome in results if outcome == 'OK')
+        print_success(f"{assigned}/{len(results)} commandes assignées en lot")
+        for order_id, driver_id, outcome in results:
+            if outcome != 'OK':
+                print_warning(f"{order_id} → {driver_id}: {outcome}")
+        
+        return results
+    
+    def complete_delivery(self, order_id):
+        """Compléter une livraison (transition atomique sur le shard de la commande)"""
+        print_subheader(f"TRAVAIL 5 : Complétion de la livraison {order_id}")
+        
+        outcome = self._complete_orders([order_id])[0]
+        if outcome[0] != 'OK':
+            print_error(f"Erreur lors de la complétion: {outcome[0]}")
+            return False
+        
+        _, driver_id, amount = outcome
+        driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+        print_success(f"Livraison {order_id} complétée par {driver_id} ({driver_name})")
+        print_info(f"Montant ajouté au revenu: {float(amount)}€")
+        return True
+    
+    def complete_deliveries_bulk(self, order_ids, chunk_size=500):
+        """Compléter plusieurs livraisons, un appel Lua par shard"""
+        results = []
+        for chunk in iter_chunks(order_ids, chunk_size):
+            outcomes = self._complete_orders(chunk)
+            results.extend((order_id, outcome[0]) for order_id, outcome in zip(chunk, outcomes))
+        
+        completed = sum(1 for _, outcome in results if outcome == 'OK')
+        print_success(f"{completed}/{len(results)} livraisons complétées en lot")
+        for order_id, outcome in results:
+            if outcome != 'OK':
+                print_warning(f"{order_id}: {outcome}")
+        
+        return results
+    
+    # =====================================================================
+    # File de dispatch shardée
+    # =====================================================================
+    
+    def claim_next_orders(self, count=1):
+        """
+        Réserver les count commandes les plus urgentes tous shards confondus:
+        lecture des têtes de file de chaque shard, choix global, puis ZPOPMIN
+        sur chaque shard retenu (l'ordre est exact au sein d'un shard)
+        """
+        shards = self.keys.shards()
+        pipe = self.r.pipeline(transaction=False)
+        for shard in shards:
+            pipe.zrange(self.keys.pending_queue(shard), 0, count - 1, withscores=True)
+        heads = [
+            (score, shard)
+            for shard, reply in zip(shards, pipe.execute())
+            for _, score in reply
+        ]
+        
+        per_shard = {}
+        for _, shard in heapq.nsmallest(count, heads):
+            per_shard[shard] = per_shard.get(shard, 0) + 1
+        
+        pipe = self.r.pipeline(transaction=False)
+        for shard, n in per_shard.items():
+            pipe.zpopmin(self.keys.pending_queue(shard), n)
+        claimed = [item for reply in pipe.execute() for item in reply]
+        return sorted(claimed, key=lambda item: item[1])
+    
+    def wait_next_order(self, timeout=5, poll_interval=0.1):
+        """
+        Attendre la prochaine commande: BZPOPMIN multi-clés est interdit
+        entre slots, on interroge donc les shards périodiquement
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            claimed = self.claim_next_orders(1)
+            if claimed:
+                return claimed[0]
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+    
+    def requeue_orders(self, claimed):
+        """Remettre des commandes réservées dans la file de leur shard"""
+        by_queue = {}
+        for order_id, score in claimed:
+            by_queue.setdefault(self.keys.pending_queue(self.keys.shard_of(order_id)), {})[order_id] = score
+        
+        pipe = self.r.pipeline(transaction=False)
+        for queue_key, scores in by_queue.items():
+            pipe.zadd(queue_key, scores)
+        pipe.execute()
+    
+    # =====================================================================
+    # Lectures fusionnées sur tous les shards
+    # =====================================================================
+    
+    def count_orders_by_status(self):
+        """Nombre de commandes par statut, somme des SCARD de chaque shard"""
+        statuses = DataGenerator.ORDER_STATUSES
+        shards = self.keys.shards()
+        pipe = self.r.pipeline(transaction=False)
+        for status in statuses:
+            for shard in shards:
+                pipe.scard(self.keys.status_set(status, shard))
+        counts = pipe.execute()
+        return {
+            status: sum(counts[i * len(shards):(i + 1) * len(shards)])
+            for i, status in enumerate(statuses)
+        }
+    
+    def get_orders_by_status(self, status):
+        """Union des sets de statut de tous les shards (petits volumes)"""
+        pipe = self.r.pipeline(transaction=False)
+        for shard in self.keys.shards():
+            pipe.smembers(self.keys.status_set(status, shard))
+        return set().union(*pipe.execute())
+    
+    def scan_orders_by_status(self, status, cursor=0, count=100):
+        """
+        SSCAN shard par shard; le curseur de continuation est 'shard:curseur'
+        et vaut 0 quand tous les shards ont été parcourus
+        """
+        shards = self.keys.shards()
+        shard_index, shard_cursor = 0, 0
+        if cursor:
+            shard_index, shard_cursor = (int(part) for part in str(cursor).split(':'))
+        
+        next_cursor, order_ids = self.r.sscan(
+            self.keys.status_set(status, shards[shard_index]), shard_cursor, count=count
+        )
+        if int(next_cursor):
+            return order_ids, f"{shard_index}:{next_cursor}"
+        if shard_index + 1 < len(shards):
+            return order_ids, f"{shard_index + 1}:0"
+        return order_ids, 0
+    
+    def iter_orders_by_status(self, status, count=100):
+        """Itérer en flux sur les commandes d'un statut, shard par shard"""
+        for shard in self.keys.shards():
+            yield from self.r.sscan_iter(self.keys.status_set(status, shard), count=count)
+    
+    def page_orders_by_status(self, status, after=None, limit=100):
+        """
+        Pagination par clé fusionnée: chaque shard fournit ses limit
+        premières commandes après le jeton, puis fusion par (created_at, id)
+        """
+        score, last_id = None, None
+        if after:
+            score, last_id = after.split(':', 1)
+        
+        pipe = self.r.pipeline(transaction=False)
+        for shard in self.keys.shards():
+            index_key = self.keys.created_index(status, shard)
+            if score is None:
+                pipe.zrange(index_key, 0, limit - 1, withscores=True)
+            else:
+                pipe.zrangebyscore(index_key, score, score, withscores=True)
+                pipe.zrangebyscore(index_key, f"({score}", '+inf', start=0, num=limit, withscores=True)
+        replies = pipe.execute()
+        
+        candidates = []
+        if score is None:
+            for reply in replies:
+                candidates.extend((s, order_id) for order_id, s in reply)
+        else:
+            for ties, following in zip(replies[::2], replies[1::2]):
+                candidates.extend((s, order_id) for order_id, s in ties if order_id > last_id)
+                candidates.extend((s, order_id) for order_id, s in following)
+        
+        page = heapq.nsmallest(limit, candidates)
+        token = None
+        if len(page) == limit:
+            last_score, last_order = page[-1]
+            token = f"{last_score!r}:{last_order}"
+        return [order_id for _, order_id in page], token
+    
+    def rebuild_created_index(self, status, count=1000):
+        """Construire les index created_at de tous les shards d'un statut"""
+        total = 0
+        for chunk in iter_chunks(self.iter_orders_by_status(status, count), count):
+            orders = self.fetch_orders(chunk, ['created_at'])
+            pipe = self.r.pipeline(transaction=False)
+            for order_id, info in orders.items():
+                if info.get('created_at'):
+                    index_key = self.keys.created_index(status, self.keys.shard_of(order_id))
+                    pipe.zadd(index_key, {order_id: datetime.fromisoformat(info['created_at']).timestamp()})
+                    total += 1
+            pipe.execute()
+        return total
+
+
+def run_partie1_cluster():
+    """Démonstration du cycle de vie sur Redis Cluster"""
+    
+    print_header("PARTIE 1 (CLUSTER) : ÉTAT TEMPS RÉEL SUR REDIS CLUSTER")
+    
+    r = get_redis_cluster_connection()
+    if not r:
+        print_error("Impossible de se connecter au cluster. Lancez: python cluster_local.py")
+        return
+    
+    r.flushdb(target_nodes=r.PRIMARIES)
+    system = ClusterDeliverySystem(r)
+    
+    system.initialize_drivers(DataGenerator.get_initial_drivers() + DataGenerator.generate_drivers(20))
+    system.initialize_orders(DataGenerator.get_initial_orders() + DataGenerator.generate_orders(30))
+    
+    system.assign_order_atomic('c1', 'd3')
+    system.assign_orders_bulk([('c2', 'd1'), ('c3', 'd2'), ('c4', 'd4')])
+    system.dispatch_next(['d5', 'd6'])
+    system.display_orders_status()
+    
+    system.complete_delivery('c1')
+    system.complete_deliveries_bulk(['c2', 'c3'])
+    system.display_dashboard()
+    
+    print_success("\n✓ Démonstration cluster terminée avec succès!")
+
+
+if __name__ == "__main__":
+    run_partie1_cluster()
@@ -0,0 +1,140 @@
+"""
+PARTIE 1 (mode compact) : État temps réel en stockage compact
+
+CompactDeliverySystem reprend l'API de RedisDeliverySystem avec le schéma
+CompactKeySchema (voir redis_keys): au lieu d'un hash par commande, d'une
+chaîne assignment:{id} par commande et de deux hashes par livreur, les
+enregistrements sont encodés dans des hashes par paquets de
+COMPACT_BUCKET_SIZE (orders:b:{n}, drivers:b:{n}). Tant qu'ils restent en
+encodage listpack, ces paquets coûtent quelques octets par enregistrement
+au lieu de la centaine d'octets d'en-tête d'une clé Redis.
+
+Les sets de statut, index created_at, file de dispatch, classements et
+journal des transitions sont inchangés. Les scripts Lua (COMPACT_SCRIPTS)
+ont les mêmes signatures que les scripts historiques.
+
+Migration d'une base existante: python compact_migration.py
+"""
+
+from redis.exceptions import ResponseError
+from utils import *
+from data_generator import DataGenerator
+from partie1_redis_temps_reel import RedisDeliverySystem
+from redis_keys import CompactKeySchema, COMPACT_BUCKET_SIZE
+from driver_cache import get_driver_profile_cache
+from redis_scripts import ScriptRegistry, COMPACT_SCRIPTS
+
+
+# Réglages Redis minimaux pour que les paquets restent encodés en listpack
+LISTPACK_SETTINGS = {
+    'hash-max-listpack-entries': COMPACT_BUCKET_SIZE,
+    'hash-max-listpack-value': 128,
+}
+
+
+def check_listpack_config(redis_conn, apply=False):
+    """
+    Comparer la configuration Redis à LISTPACK_SETTINGS
+    apply=True tente un CONFIG SET des réglages insuffisants.
+    Retourne [(réglage, valeur actuelle, minimum)] des réglages insuffisants
+    (liste vide si CONFIG est désactivée, ex: Redis managé)
+    """
+    insufficient = []
+    for name, minimum in LISTPACK_SETTINGS.items():
+        try:
+            current = int(redis_conn.config_get(name).get(name) or 0)
+            if current >= minimum:
+                continue
+            if apply:
+                redis_conn.config_set(name, minimum)
+                continue
+        except ResponseError:
+            return insufficient
+        insufficient.append((name, current, minimum))
+    return insufficient
+
+
+class CompactDeliverySystem(RedisDeliverySystem):
+    """Système de livraisons temps réel en stockage compact (hashes par paquets)"""
+    
+    def __init__(self, redis_conn):
+        self.r = redis_conn
+        self.keys = CompactKeySchema()
+        self.profiles = get_driver_profile_cache(redis_conn, self.keys)
+        self.scripts = ScriptRegistry(redis_conn, COMPACT_SCRIPTS)
+        self.scripts.load()
+        
+        for name, current, minimum in check_listpack_config(redis_conn):
+            print_warning(f"{name} = {current} (< {minimum}): les paquets ne resteront pas en listpack")
+    
+    @classmethod
+    def _queue_drivers_chunk(cls, pipe, chunk):
+        """Un HSET par paquet de livreurs (profil et stats initiales encodés)"""
+        keys = CompactKeySchema()
+        buckets = {}
+        for driver in chunk:
+            record = dict(driver, deliveries_in_progress=0, deliveries_completed=0, total_revenue=0)
+            buckets.setdefault(keys.driver_bucket(driver['id']), {})[driver['id']] = (
+                keys.pack(keys.DRIVER_FIELDS, record)
+            )
+        
+        for bucket, records in buckets.items():
+            pipe.hset(bucket, mapping=records)
+        cls._queue_driver_indexes(pipe, chunk)
+    
+    @classmethod
+    def _queue_orders_chunk(cls, pipe, chunk):
+        """Un HSET par paquet de commandes, puis les sets/index habituels"""
+        keys = CompactKeySchema()
+        buckets = {}
+        for order in chunk:
+            buckets.setdefault(keys.order_bucket(order['id']), {})[order['id']] = (
+                keys.pack(keys.ORDER_FIELDS, order)
+            )
+        
+        for bucket, records in buckets.items():
+            pipe.hset(bucket, mapping=records)
+        cls._queue_order_indexes(pipe, chunk)
+    
+    def bucket_encodings(self, sample=20):
+        """Encodage d'un échantillon de paquets: {'listpack': n, 'hashtable': m}"""
+        encodings = {}
+        for pattern in ('orders:b:*', 'drivers:b:*'):
+            for index, bucket in enumerate(self.r.scan_iter(match=pattern, count=100)):
+                if index >= sample:
+                    break
+                encoding = self.r.object('encoding', bucket)
+                encodings[encoding] = encodings.get(encoding, 0) + 1
+        return encodings
+
+
+def run_partie1_compact():
+    """Démonstration du cycle de vie en stockage compact"""
+    
+    print_header("PARTIE 1 (COMPACT) : STOCKAGE COMPACT PAR PAQUETS")
+    
+    r = get_redis_connection()
+    if not r:
+        print_error("Impossible de se connecter à Redis. Assurez-vous que Docker est lancé.")
+        return
+    
+    clear_redis(r)
+    system = CompactDeliverySystem(r)
+    
+    system.initialize_drivers(DataGenerator.get_initial_drivers() + DataGenerator.generate_drivers(20))
+    system.initialize_orders(DataGenerator.get_initial_orders() + DataGenerator.generate_orders(30))
+    
+    system.assign_order_atomic('c1', 'd3')
+    system.assign_orders_bulk([('c2', 'd1'), ('c3', 'd2'), ('c4', 'd4')])
+    system.display_orders_status()
+    
+    system.complete_delivery('c1')
+    system.complete_deliveries_bulk(['c2', 'c3'])
+    system.display_dashboard()
+    
+    print_info(f"Encodage des paquets: {system.bucket_encodings()}")
+    print_success("\n✓ Démonstration du stockage compact terminée avec succès!")
+
+
+if __name__ == "__main__":
+    run_partie1_compact()
@@ -11,15 +11,33 @@ Ce script implémente tous les travaux de la Partie 1:
 """
 
 import json
+import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from utils import *
 from data_generator import DataGenerator
+from redis_scripts import ScriptRegistry
+from redis_keys import KeySchema
+from driver_cache import get_driver_profile_cache, PROFILE_FIELDS
+import redis_batch
 
 
 class RedisDeliverySystem:
     """Système de gestion de livraisons temps réel avec Redis"""
     
+    # File de dispatch: score = created_at + SLA_WEIGHT * SLA (en secondes).
+    # SLA_WEIGHT = 0 donne une file strictement FIFO (plus ancienne d'abord);
+    # plus il est élevé, plus les commandes à SLA court passent devant.
+    DEFAULT_SLA_MINUTES = 45
+    SLA_WEIGHT = 1.0
+    
     def __init__(self, redis_conn):
         self.r = redis_conn
+        self.keys = KeySchema()
+        self.profiles = get_driver_profile_cache(redis_conn, self.keys)
+        # Scripts Lua du cycle de vie chargés une fois, appelés par EVALSHA
+        self.scripts = ScriptRegistry(redis_conn)
+        self.scripts.load()
     
     # =====================================================================
     # TRAVAIL 1 : Initialiser les livreurs
@@ -31,35 +49,65 @@ class RedisDeliverySystem:
         - driver:{id} : Hash contenant toutes les infos du livreur
         - drivers:ratings : Sorted Set pour accès rapide par rating
         - drivers:all : Set contenant tous les IDs de livreurs
+        - drivers:in_progress : Sorted Set des livreurs ayant des livraisons
+          en cours (score = nombre), tenu à jour par les scripts Lua
         """
         print_subheader("TRAVAIL 1 : Initialisation des livreurs")
         
-        for driver in drivers:
-            driver_key = f"driver:{driver['id']}"
-            
-            # Stocker toutes les infos dans un hash
-            self.r.hset(driver_key, mapping={
+        count = self.bulk_load_drivers(drivers)
+        print_success(f"{count} livreurs initialisés")
+    
+    def bulk_load_drivers(self, drivers, chunk_size=1000):
+        """
+        Charger en masse les livreurs depuis n'importe quel itérable
+        (liste ou générateur):
+        - un pipeline non transactionnel par paquet de chunk_size livreurs
+        - un seul ZADD et un seul SADD variadiques par paquet
+        - seul le paquet courant est en mémoire, quelle que soit la flotte
+        Retourne le nombre de livreurs chargés
+        """
+        start = time.perf_counter()
+        total = 0
+        
+        for chunk in iter_chunks(drivers, chunk_size):
+            pipe = self.r.pipeline(transaction=False)
+            self._queue_drivers_chunk(pipe, chunk)
+            pipe.execute()
+            # Profils réécrits: invalider les caches locaux (repli pub/sub)
+            self.profiles.invalidate([driver['id'] for driver in chunk], publish=True)
+            total += len(chunk)
+        
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        print_info(f"Chargement: {total} livreurs en {elapsed:.2f}s ({rate:.0f} livreurs/s)")
+        
+        return total
+    
+    @classmethod
+    def _queue_drivers_chunk(cls, pipe, chunk):
+        """Mettre en file dans pipe les écritures d'un paquet de livreurs"""
+        for driver in chunk:
+            # Hash des infos et statistiques initiales du livreur
+            pipe.hset(f"driver:{driver['id']}", mapping={
                 'id': driver['id'],
                 'name': driver['name'],
                 'region': driver['region'],
                 'rating': driver['rating'],
             })
-            
-            # Ajouter au sorted set par rating (pour requêtes rapides)
-            self.r.zadd('drivers:ratings', {driver['id']: driver['rating']})
-            
-            # Ajouter à la liste de tous les livreurs
-            self.r.sadd('drivers:all', driver['id'])
-            
-            # Initialiser les statistiques du livreur
-            stats_key = f"driver:{driver['id']}:stats"
-            self.r.hset(stats_key, mapping={
+            pipe.hset(f"driver:{driver['id']}:stats", mapping={
                 'deliveries_in_progress': 0,
                 'deliveries_completed': 0,
                 'total_revenue': 0,
             })
-        
-        print_success(f"{len(drivers)} livreurs initialisés")
+        cls._queue_driver_indexes(pipe, chunk)
+    
+    @staticmethod
+    def _queue_driver_indexes(pipe, chunk):
+        """Index des livreurs d'un paquet: un seul ZADD / SADD / ZREM"""
+        ratings = {driver['id']: driver['rating'] for driver in chunk}
+        pipe.zadd('drivers:ratings', ratings)
+        pipe.sadd('drivers:all', *ratings)
+        pipe.zrem('drivers:in_progress', *ratings)
     
     def get_driver_rating(self, driver_id):
         """Accéder rapidement au rating d'un livreur"""
@@ -70,8 +118,8 @@ class RedisDeliverySystem:
         driver_ids = self.r.smembers('drivers:all')
         drivers_data = []
         
-        for driver_id in driver_ids:
-            driver_info = self.r.hgetall(f"driver:{driver_id}")
+        drivers = self.fetch_drivers(driver_ids, ['name', 'region', 'rating'])
+        for driver_id, driver_info in drivers.items():
             drivers_data.append([
                 driver_id,
                 driver_info.get('name', 'N/A'),
@@ -87,6 +135,38 @@ class RedisDeliverySystem:
         top_drivers = self.r.zrangebyscore('drivers:ratings', min_rating, '+inf', withscores=True)
         return [(driver_id, rating) for driver_id, rating in top_drivers]
     
+    def rebuild_in_progress_leaderboard(self):
+        """
+        Reconstruire drivers:in_progress depuis les hashes de stats
+        (migration d'une base existante, ou réparation après incident)
+        """
+        driver_ids = list(self.r.smembers('drivers:all'))
+        stats = self.fetch_drivers(driver_ids, ['id'], ['deliveries_in_progress'])
+        in_progress = {
+            driver_id: int(info['deliveries_in_progress'])
+            for driver_id, info in stats.items()
+            if int(info.get('deliveries_in_progress') or 0) > 0
+        }
+        
+        pipe = self.r.pipeline()
+        pipe.delete('drivers:in_progress')
+        if in_progress:
+            pipe.zadd('drivers:in_progress', in_progress)
+        pipe.execute()
+        return len(in_progress)
+    
+    def fetch_drivers(self, driver_ids, fields=None, stats_fields=None):
+        """
+        Lire plusieurs livreurs (et leurs stats) en un aller-retour
+        Les lectures des seuls champs du profil passent par le cache local
+        """
+        if stats_fields is None and fields is not None and set(fields) <= set(PROFILE_FIELDS):
+            return self.profiles.get_many(driver_ids, fields)
+        return redis_batch.fetch_drivers(self.r, driver_ids, fields, stats_fields, self.keys)
+    
+    def _driver_name(self, driver_id):
+        return self.fetch_drivers([driver_id], ['name'])[driver_id].get('name')
+    
     # =====================================================================
     # TRAVAIL 2 : Gérer les commandes en cours
     # =====================================================================
@@ -96,14 +176,88 @@ class RedisDeliverySystem:
         Initialiser les commandes dans Redis:
         - order:{id} : Hash contenant toutes les infos de la commande
         - orders:status:{status} : Set des IDs par statut
+        - orders:created:{status} : Sorted Set des IDs par statut, score =
+          created_at (pagination ordonnée)
+        - orders:queue : file de dispatch des commandes en attente, score =
+          échéance SLA (voir dispatch_score)
+        - orders:events : journal des affectations / livraisons (Stream,
+          alimenté par les scripts Lua, voir redis_events)
         """
         print_subheader("TRAVAIL 2 : Initialisation des commandes")
         
-        for order in orders:
-            order_key = f"order:{order['id']}"
+        count = self.ingest_orders(orders)
+        print_success(f"{count} commandes initialisées")
+    
+    def ingest_orders(self, orders, chunk_size=1000, workers=1):
+        """
+        Ingérer un flux de commandes (liste ou générateur):
+        - paquets de chunk_size commandes, un pipeline non transactionnel chacun
+        - un seul SADD par statut et par paquet
+        - avec workers > 1, les paquets sont écrits en parallèle par un pool
+          de threads partageant le pool de connexions du client Redis
+        Le nombre de paquets en vol est borné pour garder une mémoire constante.
+        Retourne le nombre de commandes ingérées
+        """
+        start = time.perf_counter()
+        total = 0
+        latencies = []
+        
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            in_flight = set()
+            
+            for chunk in iter_chunks(orders, chunk_size):
+                if len(in_flight) >= max(1, workers) * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        count, latency = future.result()
+                        total += count
+                        latencies.append(latency)
+                in_flight.add(executor.submit(self._write_orders_chunk, chunk))
             
-            # Stocker toutes les infos dans un hash
-            self.r.hset(order_key, mapping={
+            for future in in_flight:
+                count, latency = future.result()
+                total += count
+                latencies.append(latency)
+        
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        print_info(f"Ingestion: {total} commandes en {elapsed:.2f}s ({rate:.0f} commandes/s)")
+        if latencies:
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print_info(
+                f"Latence par paquet ({len(latencies)} paquets): "
+                f"moy {sum(latencies) / len(latencies) * 1000:.1f}ms, "
+                f"p95 {p95 * 1000:.1f}ms, max {latencies[-1] * 1000:.1f}ms"
+            )
+        
+        return total
+    
+    def _write_orders_chunk(self, chunk):
+        """Écrire un paquet de commandes en un aller-retour, retourne (nombre, latence)"""
+        start = time.perf_counter()
+        pipe = self.r.pipeline(transaction=False)
+        self._queue_orders_chunk(pipe, chunk)
+        pipe.execute()
+        return len(chunk), time.perf_counter() - start
+    
+    @classmethod
+    def dispatch_score(cls, order):
+        """
+        Priorité d'une commande en attente (plus petit = plus urgent):
+        created_at + SLA_WEIGHT * sla_minutes de la commande (ou SLA par défaut).
+        Le vieillissement est implicite: une commande ancienne finit toujours
+        par passer devant les nouvelles.
+        """
+        created = datetime.fromisoformat(order['created_at']).timestamp()
+        sla_minutes = float(order.get('sla_minutes') or cls.DEFAULT_SLA_MINUTES)
+        return created + cls.SLA_WEIGHT * sla_minutes * 60
+    
+    @classmethod
+    def _queue_orders_chunk(cls, pipe, chunk):
+        """Mettre en file dans pipe les écritures d'un paquet de commandes"""
+        for order in chunk:
+            pipe.hset(f"order:{order['id']}", mapping={
                 'id': order['id'],
                 'client': order['client'],
                 'destination': order['destination'],
@@ -111,17 +265,167 @@ class RedisDeliverySystem:
                 'created_at': order['created_at'],
                 'status': order['status'],
             })
-            
-            # Ajouter au set du statut correspondant
-            status_key = f"orders:status:{order['status']}"
-            self.r.sadd(status_key, order['id'])
-        
-        print_success(f"{len(orders)} commandes initialisées")
+        cls._queue_order_indexes(pipe, chunk)
+    
+    @classmethod
+    def _queue_order_indexes(cls, pipe, chunk):
+        """Sets et index de statut, file de dispatch d'un paquet de commandes"""
+        ids_by_status = {}
+        created_by_status = {}
+        queue = {}
+        not_pending = []
+        
+        for order in chunk:
+            ids_by_status.setdefault(order['status'], []).append(order['id'])
+            created_by_status.setdefault(order['status'], {})[order['id']] = (
+                datetime.fromisoformat(order['created_at']).timestamp()
+            )
+            if order['status'] == 'en_attente':
+                queue[order['id']] = cls.dispatch_score(order)
+            else:
+                queue.pop(order['id'], None)
+                not_pending.append(order['id'])
+        
+        # Un seul SADD et un seul ZADD par statut
+        for status, order_ids in ids_by_status.items():
+            pipe.sadd(f"orders:status:{status}", *order_ids)
+            pipe.zadd(f"orders:created:{status}", created_by_status[status])
+        # Une commande réécrite avec un autre statut quitte la file
+        if not_pending:
+            pipe.zrem('orders:queue', *not_pending)
+        if queue:
+            pipe.zadd('orders:queue', queue)
     
     def get_orders_by_status(self, status):
-        """Récupérer toutes les commandes d'un statut donné"""
+        """
+        Récupérer toutes les commandes d'un statut donné
+        (SMEMBERS: réservé aux petits volumes, préférer scan_orders_by_status
+        ou page_orders_by_status)
+        """
         return self.r.smembers(f"orders:status:{status}")
     
+    def scan_orders_by_status(self, status, cursor=0, count=100):
+        """
+        Parcourir les commandes d'un statut par SSCAN, sans bloquer Redis
+        Retourne (ids, curseur suivant); le parcours est terminé quand le
+        curseur suivant vaut 0. L'ordre n'est pas garanti.
+        """
+        next_cursor, order_ids = self.r.sscan(f"orders:status:{status}", int(cursor), count=count)
+        return order_ids, int(next_cursor)
+    
+    def iter_orders_by_status(self, status, count=100):
+        """Itérer en flux sur toutes les commandes d'un statut (SSCAN)"""
+        return self.r.sscan_iter(f"orders:status:{status}", count=count)
+    
+    def page_orders_by_status(self, status, after=None, limit=100):
+        """
+        Pagination par clé (keyset) des commandes d'un statut, des plus
+        anciennes aux plus récentes, via l'index orders:created:{status}
+        - after: jeton de continuation renvoyé par la page précédente
+        Retourne (ids, jeton suivant), le jeton valant None en fin de liste
+        Chaque page coûte O(log N + limit), quelle que soit sa position.
+        """
+        index_key = f"orders:created:{status}"
+        start = 0
+        
+        if after:
+            score, last_id = after.split(':', 1)
+            rank = self.r.zrank(index_key, last_id)
+            if rank is not None:
+                start = rank + 1
+            else:
+                # La commande a changé de statut depuis: repartir de son score
+                start = self.r.zcount(index_key, '-inf', f"({score}")
+                ties = self.r.zrangebyscore(index_key, score, score)
+                start += sum(1 for order_id in ties if order_id <= last_id)
+        
+        page = self.r.zrange(index_key, start, start + limit - 1, withscores=True)
+        order_ids = [order_id for order_id, _ in page]
+        
+        token = None
+        if len(page) == limit:
+            last_id, score = page[-1]
+            token = f"{score!r}:{last_id}"
+        return order_ids, token
+    
+    def rebuild_created_index(self, status, count=1000):
+        """
+        Construire orders:created:{status} depuis orders:status:{status}
+        (migration d'une base existante), par paquets SSCAN
+        """
+        total = 0
+        for chunk in iter_chunks(self.iter_orders_by_status(status, count), count):
+            orders = self.fetch_orders(chunk, ['created_at'])
+            scores = {
+                order_id: datetime.fromisoformat(info['created_at']).timestamp()
+                for order_id, info in orders.items() if info.get('created_at')
+            }
+            if scores:
+                self.r.zadd(f"orders:created:{status}", scores)
+            total += len(scores)
+        return total
+    
+    def fetch_orders(self, order_ids, fields=None):
+        """Lire plusieurs commandes en un aller-retour"""
+        return redis_batch.fetch_orders(self.r, order_ids, fields, self.keys)
+    
+    def count_orders_by_status(self):
+        """Nombre de commandes par statut (SCARD en O(1), pipelinés)"""
+        pipe = self.r.pipeline(transaction=False)
+        for status in DataGenerator.ORDER_STATUSES:
+            pipe.scard(f"orders:status:{status}")
+        return dict(zip(DataGenerator.ORDER_STATUSES, pipe.execute()))
+    
+    def claim_next_orders(self, count=1):
+        """
+        Réserver atomiquement les count commandes les plus urgentes (ZPOPMIN)
+        Deux dispatchers ne peuvent pas réserver la même commande.
+        Retourne [(order_id, score)]; une commande réservée mais non affectée
+        doit être remise dans la file avec requeue_orders.
+        """
+        return self.r.zpopmin(self.keys.pending_queue(), count)
+    
+    def wait_next_order(self, timeout=5):
+        """
+        Attendre jusqu'à timeout secondes la prochaine commande (BZPOPMIN)
+        Retourne (order_id, score) ou None
+        """
+        popped = self.r.bzpopmin(self.keys.pending_queue(), timeout)
+        if not popped:
+            return None
+        _, order_id, score = popped
+        return order_id, score
+    
+    def requeue_orders(self, claimed):
+        """Remettre dans la file des commandes réservées [(order_id, score)]"""
+        if claimed:
+            self.r.zadd(self.keys.pending_queue(), dict(claimed))
+    
+    def dispatch_next(self, driver_ids):
+        """
+        Affecter les commandes les plus urgentes aux livreurs donnés
+        (une commande par livreur); les commandes refusées sont remises en file
+        """
+        claimed = self.claim_next_orders(len(driver_ids))
+        if not claimed:
+            print_info("Aucune commande en attente dans la file de dispatch")
+            return []
+        
+        scores = dict(claimed)
+        pairs = [(order_id, driver_id) for (order_id, _), driver_id in zip(claimed, driver_ids)]
+        results = self.assign_orders_bulk(pairs)
+        
+        # Seules les commandes refusées encore en attente reviennent dans la file
+        refused = [order_id for order_id, _, outcome in results if outcome != 'OK']
+        if refused:
+            orders = self.fetch_orders(refused, ['status'])
+            self.requeue_orders([
+                (order_id, scores[order_id])
+                for order_id, order in orders.items()
+                if order.get('status') == 'en_attente'
+            ])
+        return results
+    
     # =====================================================================
     # TRAVAIL 3 : Affecter une commande à un livreur (ATOMIQUE)
     # =====================================================================
@@ -136,84 +440,86 @@ class RedisDeliverySystem:
         """
         print_subheader(f"TRAVAIL 3 : Affectation atomique de {order_id} à {driver_id}")
         
-        # Script Lua pour garantir l'atomicité
-        lua_script = """
-        local order_id = KEYS[1]
-        local driver_id = KEYS[2]
-        local order_key = 'order:' .. order_id
-        local driver_stats_key = 'driver:' .. driver_id .. ':stats'
-        
-        -- Vérifier que la commande existe et est en attente
-        local current_status = redis.call('HGET', order_key, 'status')
-        if not current_status then
-            return {err = 'Commande inexistante'}
-        end
-        if current_status ~= 'en_attente' then
-            return {err = 'Commande déjà assignée ou livrée'}
-        end
-        
-        -- 1. Mettre à jour le statut de la commande
-        redis.call('HSET', order_key, 'status', 'assignée')
-        redis.call('HSET', order_key, 'driver_id', driver_id)
-        
-        -- 2. Déplacer la commande entre les sets de statut
-        redis.call('SMOVE', 'orders:status:en_attente', 'orders:status:assignée', order_id)
-        
-        -- 3. Enregistrer l'affectation
-        redis.call('SET', 'assignment:' .. order_id, driver_id)
-        
-        -- 4. Incrémenter les livraisons en cours du livreur
-        redis.call('HINCRBY', driver_stats_key, 'deliveries_in_progress', 1)
-        
-        return 'OK'
-        """
-        
         try:
-            result = self.r.eval(lua_script, 2, order_id, driver_id)
+            self.scripts.call('assign_order', keys=[order_id, driver_id])
             print_success(f"Commande {order_id} assignée à {driver_id} de manière atomique")
             return True
         except Exception as e:
             print_error(f"Erreur lors de l'affectation: {e}")
             return False
     
+    def assign_orders_bulk(self, pairs, chunk_size=500):
+        """
+        Affecter atomiquement plusieurs couples (commande, livreur):
+        chaque paquet de chunk_size couples est traité par un seul appel Lua,
+        avec les mêmes vérifications que assign_order_atomic.
+        Retourne une liste de (order_id, driver_id, résultat) où résultat
+        vaut 'OK' ou la raison du refus
+        """
+        results = []
+        
+        for chunk in iter_chunks(pairs, chunk_size):
+            args = [value for pair in chunk for value in pair]
+            outcomes = self.scripts.call('assign_orders_bulk', args=args)
+            results.extend(
+                (order_id, driver_id, outcome)
+                for (order_id, driver_id), outcome in zip(chunk, outcomes)
+            )
+        
+        assigned = sum(1 for _, _, outcome in results if outcome == 'OK')
+        print_success(f"{assigned}/{len(results)} commandes assignées en lot")
+        for order_id, driver_id, outcome in results:
+            if outcome != 'OK':
+                print_warning(f"{order_id} → {driver_id}: {outcome}")
+        
+        return results
+    
     # =====================================================================
     # TRAVAIL 4 : Commandes affectées vs en attente
     # =====================================================================
     
-    def display_orders_status(self):
-        """Afficher toutes les commandes par statut"""
+    def display_orders_status(self, page_size=50):
+        """
+        Afficher les commandes par statut
+        Seule la première page (les page_size plus anciennes) de chaque
+        statut est lue: le coût ne dépend pas du nombre total de commandes
+        """
         print_subheader("TRAVAIL 4 : Commandes par statut")
+        counts = self.count_orders_by_status()
         
         # Commandes en attente
-        pending = self.get_orders_by_status('en_attente')
-        print_info(f"Commandes en attente: {len(pending)}")
-        if pending:
-            print(f"  IDs: {', '.join(sorted(pending))}")
+        self._display_status_page('en_attente', "Commandes en attente", counts, page_size)
         
         # Commandes assignées
-        assigned = self.get_orders_by_status('assignée')
-        print_info(f"Commandes assignées: {len(assigned)}")
+        assigned = self._display_status_page('assignée', "Commandes assignées", counts, page_size)
         if assigned:
-            print(f"  IDs: {', '.join(sorted(assigned))}")
-            # Afficher les affectations
-            for order_id in sorted(assigned):
-                driver_id = self.r.get(f"assignment:{order_id}")
-                driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            # Afficher les affectations (MGET + un pipeline pour les noms)
+            assignments = redis_batch.fetch_assignments(self.r, assigned, self.keys)
+            drivers = self.fetch_drivers({d for d in assignments.values() if d}, ['name'])
+            for order_id, driver_id in assignments.items():
+                driver_name = drivers.get(driver_id, {}).get('name')
                 print(f"    {order_id} → {driver_id} ({driver_name})")
         
         # Commandes livrées
-        delivered = self.get_orders_by_status('livrée')
-        print_info(f"Commandes livrées: {len(delivered)}")
-        if delivered:
-            print(f"  IDs: {', '.join(sorted(delivered))}")
+        self._display_status_page('livrée', "Commandes livrées", counts, page_size)
         
         # Livreur avec le rating maximal
         top_driver = self.r.zrevrange('drivers:ratings', 0, 0, withscores=True)
         if top_driver:
             driver_id, rating = top_driver[0]
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            driver_name = self._driver_name(driver_id)
             print_success(f"Meilleur livreur: {driver_id} ({driver_name}) - Rating: {rating}")
     
+    def _display_status_page(self, status, label, counts, page_size):
+        """Afficher le total et la première page d'un statut"""
+        total = counts.get(status, 0)
+        order_ids, token = self.page_orders_by_status(status, limit=page_size)
+        print_info(f"{label}: {total}")
+        if order_ids:
+            suffix = f", … (+{total - len(order_ids)})" if token else ""
+            print(f"  IDs: {', '.join(order_ids)}{suffix}")
+        return order_ids
+    
     # =====================================================================
     # TRAVAIL 5 : Simulation d'une livraison
     # =====================================================================
@@ -227,80 +533,71 @@ class RedisDeliverySystem:
         """
         print_subheader(f"TRAVAIL 5 : Complétion de la livraison {order_id}")
         
-        # Récupérer le livreur affecté
-        driver_id = self.r.get(f"assignment:{order_id}")
-        if not driver_id:
-            print_error(f"Aucun livreur affecté à la commande {order_id}")
-            return False
-        
-        # Récupérer le montant de la commande
-        amount = float(self.r.hget(f"order:{order_id}", 'amount') or 0)
-        
-        # Script Lua pour atomicité
-        lua_script = """
-        local order_id = KEYS[1]
-        local driver_id = KEYS[2]
-        local amount = tonumber(ARGV[1])
-        local order_key = 'order:' .. order_id
-        local driver_stats_key = 'driver:' .. driver_id .. ':stats'
-        
-        -- 1. Mettre à jour le statut
-        redis.call('HSET', order_key, 'status', 'livrée')
-        
-        -- 2. Déplacer entre les sets
-        redis.call('SMOVE', 'orders:status:assignée', 'orders:status:livrée', order_id)
-        
-        -- 3. Décrémenter les livraisons en cours
-        redis.call('HINCRBY', driver_stats_key, 'deliveries_in_progress', -1)
-        
-        -- 4. Incrémenter les livraisons complétées
-        redis.call('HINCRBY', driver_stats_key, 'deliveries_completed', 1)
-        
-        -- 5. Ajouter au revenu total
-        redis.call('HINCRBYFLOAT', driver_stats_key, 'total_revenue', amount)
-        
-        return 'OK'
-        """
-        
+        # Un seul appel atomique: le script lit lui-même livreur et montant
         try:
-            self.r.eval(lua_script, 2, order_id, driver_id, amount)
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            driver_id, amount = self.scripts.call('complete_delivery', keys=[order_id])
+            driver_name = self._driver_name(driver_id)
             print_success(f"Livraison {order_id} complétée par {driver_id} ({driver_name})")
-            print_info(f"Montant ajouté au revenu: {amount}€")
+            print_info(f"Montant ajouté au revenu: {float(amount)}€")
             return True
         except Exception as e:
             print_error(f"Erreur lors de la complétion: {e}")
             return False
     
+    def complete_deliveries_bulk(self, order_ids, chunk_size=500):
+        """
+        Compléter plusieurs livraisons d'un coup (ex: l'app livreur qui
+        se reconnecte et renvoie ses livraisons terminées hors ligne).
+        Chaque paquet de chunk_size commandes est traité par un seul appel Lua.
+        Retourne une liste de (order_id, résultat) où résultat vaut 'OK'
+        ou la raison du refus
+        """
+        results = []
+        
+        for chunk in iter_chunks(order_ids, chunk_size):
+            outcomes = self.scripts.call('complete_deliveries_bulk', args=chunk)
+            results.extend(zip(chunk, outcomes))
+        
+        completed = sum(1 for _, outcome in results if outcome == 'OK')
+        print_success(f"{completed}/{len(results)} livraisons complétées en lot")
+        for order_id, outcome in results:
+            if outcome != 'OK':
+                print_warning(f"{order_id}: {outcome}")
+        
+        return results
+    
     # =====================================================================
     # TRAVAIL 6 : État global du système (Dashboard)
     # =====================================================================
     
-    def display_dashboard(self):
-        """Afficher un dashboard temps réel du système"""
+    def display_dashboard(self, max_active=20):
+        """
+        Afficher un dashboard temps réel du système
+        Chaque section coûte un nombre constant de commandes, quelle que
+        soit la taille de la flotte (max_active livreurs actifs affichés)
+        """
         print_header("DASHBOARD TEMPS RÉEL")
         
-        # Nombre total de commandes par statut
+        # Nombre total de commandes par statut (SCARD est en O(1))
         print_subheader("Commandes par statut")
-        statuses = ['en_attente', 'assignée', 'livrée']
-        status_data = []
-        for status in statuses:
-            count = self.r.scard(f"orders:status:{status}")
-            status_data.append([status.upper(), count])
+        counts = self.count_orders_by_status()
+        status_data = [[status.upper(), count] for status, count in counts.items()]
         print_table(['Statut', 'Nombre'], status_data)
         
         # Livraisons en cours par livreur
         print_subheader("Livraisons en cours par livreur")
-        driver_ids = self.r.smembers('drivers:all')
-        active_drivers = []
-        for driver_id in driver_ids:
-            in_progress = int(self.r.hget(f"driver:{driver_id}:stats", 'deliveries_in_progress') or 0)
-            if in_progress > 0:
-                driver_name = self.r.hget(f"driver:{driver_id}", 'name')
-                active_drivers.append([driver_id, driver_name, in_progress])
+        # Classement maintenu par les scripts d'affectation / complétion
+        leaderboard = self.r.zrevrangebyscore(
+            'drivers:in_progress', '+inf', 1, start=0, num=max_active, withscores=True
+        )
+        names = self.fetch_drivers([driver_id for driver_id, _ in leaderboard], ['name'])
+        active_drivers = [
+            [driver_id, names[driver_id].get('name'), int(in_progress)]
+            for driver_id, in_progress in leaderboard
+        ]
         
         if active_drivers:
-            print_table(['ID', 'Nom', 'En cours'], sorted(active_drivers, key=lambda x: x[2], reverse=True))
+            print_table(['ID', 'Nom', 'En cours'], active_drivers)
         else:
             print_info("Aucune livraison en cours")
         
@@ -308,12 +605,17 @@ class RedisDeliverySystem:
         print_subheader("Top 2 meilleurs livreurs")
         top_2 = self.r.zrevrange('drivers:ratings', 0, 1, withscores=True)
         top_data = []
+        drivers = self.fetch_drivers(
+            [driver_id for driver_id, _ in top_2],
+            ['name', 'region'],
+            ['deliveries_completed', 'total_revenue']
+        )
         for driver_id, rating in top_2:
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
-            region = self.r.hget(f"driver:{driver_id}", 'region')
-            completed = self.r.hget(f"driver:{driver_id}:stats", 'deliveries_completed')
-            revenue = self.r.hget(f"driver:{driver_id}:stats", 'total_revenue')
-            top_data.append([driver_id, driver_name, region, rating, completed or 0, f"{float(revenue or 0)}€"])
+            info = drivers[driver_id]
+            top_data.append([
+                driver_id, info.get('name'), info.get('region'), rating,
+                info.get('deliveries_completed', 0), f"{float(info.get('total_revenue') or 0)}€"
+            ])
         
         print_table(['ID', 'Nom', 'Région', 'Rating', 'Livrées', 'Revenu'], top_data)
 
@@ -352,10 +654,10 @@ def run_partie1():
     print(f"Rating de d3: {system.get_driver_rating('d3')}")
     
     print("\nTop livreurs (rating >= 4.7):")
-    top_drivers = system.get_top_drivers(4.7)
-    for driver_id, rating in top_drivers[:5]:
-        name = r.hget(f"driver:{driver_id}", 'name')
-        print(f"  {driver_id} ({name}): {rating}")
+    top_drivers = system.get_top_drivers(4.7)[:5]
+    names = system.fetch_drivers([driver_id for driver_id, _ in top_drivers], ['name'])
+    for driver_id, rating in top_drivers:
+        print(f"  {driver_id} ({names[driver_id].get('name')}): {rating}")
     
     wait_for_input()
     
@@ -369,6 +671,10 @@ def run_partie1():
     # Affecter quelques autres commandes
     system.assign_order_atomic('c2', 'd1')
     system.assign_order_atomic('c3', 'd2')
+    
+    # Dispatch des commandes les plus urgentes (file de priorité SLA)
+    print("\n--- Dispatch par priorité ---")
+    system.dispatch_next(['d5', 'd6'])
     wait_for_input()
     
     # TRAVAIL 4 : Afficher les statuts
@@ -382,6 +688,12 @@ def run_partie1():
     # TRAVAIL 6 : Dashboard
     system.display_dashboard()
     
+    stats = system.profiles.stats()
+    print_info(
+        f"Cache des profils livreurs ({stats['mode']}): {stats['hits']} lectures locales, "
+        f"{stats['misses']} lectures Redis"
+    )
+    
     print_success("\n✓ Partie 1 terminée avec succès!")
 
 
@@ -10,23 +10,122 @@ Ce script implémente tous les travaux de la Partie 2:
 - Travail 6: Synchronisation Redis → MongoDB
 """
 
+import time
 from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, OperationFailure
 from utils import *
 from data_generator import DataGenerator
+from redis_events import LifecycleEventConsumer, MONGODB_GROUP, event_time
+from order_archiver import OrderArchiver
+from delivery_rollups import DeliveryRollups
+from aggregation_cache import AggregationCache
+from driver_cache import get_driver_profile_cache
+from redis_keys import KeySchema
+import redis_batch
+
+
+# Watermarks de la synchronisation incrémentale Redis → MongoDB
+SYNC_STATE_COLLECTION = 'sync_state'
 
 
 class MongoDeliveryHistory:
-    """Système de gestion d'historique de livraisons avec MongoDB"""
+    """
+    Système de gestion d'historique de livraisons avec MongoDB
+    timeseries=True: deliveries est une collection time-series (champ de
+    temps delivery_time, métadonnées meta = {driver_id, region}, regroupées
+    par MongoDB en buckets compressés de la granularité choisie). Les
+    documents gardent driver_id et region à la racine: requêtes inchangées.
+    cache (aggregation_cache.AggregationCache): analyses servies par Redis;
+    chaque écriture dans deliveries incrémente sa version de cache.
+    """
     
-    def __init__(self, db):
+    TIMESERIES_GRANULARITIES = ('seconds', 'minutes', 'hours')
+    
+    def __init__(self, db, timeseries=False, granularity='minutes', cache=None):
+        if granularity not in self.TIMESERIES_GRANULARITIES:
+            raise ValueError(f"Granularité inconnue: {granularity}")
         self.db = db
         self.deliveries = db['deliveries']
+        self.timeseries = timeseries
+        self.granularity = granularity
+        if timeseries:
+            self.ensure_timeseries()
+        self.cache = cache
+        # Agrégats par (jour, région, livreur) lus par les analyses
+        self.rollups = DeliveryRollups(db, cache=cache)
+    
+    def is_timeseries(self):
+        """deliveries existe-t-elle en tant que collection time-series ?"""
+        info = next(self.db.list_collections(filter={'name': self.deliveries.name}), None)
+        return bool(info) and info.get('type') == 'timeseries'
+    
+    def ensure_timeseries(self):
+        """
+        Créer deliveries en collection time-series si elle n'existe pas
+        (MongoDB >= 7.0: _upsert_deliveries supprime par command_id, champ
+        hors de meta). Une collection classique existante n'est pas
+        convertie: import_deliveries la recrée en time-series.
+        """
+        if self.deliveries.name not in self.db.list_collection_names():
+            self.db.create_collection(self.deliveries.name, timeseries={
+                'timeField': 'delivery_time',
+                'metaField': 'meta',
+                'granularity': self.granularity,
+            })
+        elif not self.is_timeseries():
+            print_warning("La collection deliveries existante n'est pas time-series (réimporter l'historique)")
+    
+    def _stored(self, doc):
+        """Document tel qu'écrit: métadonnées de bucket en mode time-series"""
+        if not self.timeseries:
+            return doc
+        return dict(doc, meta={'driver_id': doc.get('driver_id'), 'region': doc.get('region')})
+    
+    def _upsert_deliveries(self, docs):
+        """
+        Écrire des livraisons synchronisées depuis Redis, en remplaçant celles
+        de même command_id. synced_at marque les documents issus de Redis:
+        seuls ceux-là autorisent l'archiveur à supprimer la commande de Redis
+        (un historique importé peut réutiliser les mêmes IDs)
+        Retourne la plus ancienne delivery_time touchée, anciennes valeurs
+        des documents remplacés comprises: les agrégats doivent être
+        rafraîchis depuis ce jour (voir DeliveryRollups.refresh)
+        """
+        synced_at = datetime.now()
+        docs = [dict(doc, synced_at=synced_at) for doc in docs]
+        replaced = self.deliveries.find_one(
+            {'command_id': {'$in': [doc['command_id'] for doc in docs]}, 'delivery_time': {'$ne': None}},
+            {'delivery_time': 1},
+            sort=[('delivery_time', 1)],
+        )
+        earliest = min(doc['delivery_time'] for doc in docs)
+        if replaced:
+            earliest = min(earliest, replaced['delivery_time'])
+        
+        if self.timeseries:
+            # Pas d'upsert sur une collection time-series: suppression puis
+            # insertion, sans effet si rejouées
+            self.deliveries.delete_many({'command_id': {'$in': [doc['command_id'] for doc in docs]}})
+            self.deliveries.insert_many([self._stored(doc) for doc in docs], ordered=False)
+        else:
+            self.deliveries.bulk_write([
+                UpdateOne({'command_id': doc['command_id']}, {'$set': doc}, upsert=True) for doc in docs
+            ], ordered=False)
+        self._bump_cache_version()
+        return earliest
+    
+    def _bump_cache_version(self):
+        """Invalider les résultats en cache calculés sur deliveries"""
+        if self.cache is not None:
+            self.cache.bump(self.deliveries.name)
     
     # =====================================================================
     # TRAVAIL 1 : Importer l'historique
     # =====================================================================
     
-    def import_deliveries(self, deliveries_data):
+    def import_deliveries(self, deliveries_data, chunk_size=5000, staging=False, refresh_rollups=True):
         """
         Importer l'historique des livraisons dans MongoDB
         Structure de document:
@@ -35,16 +134,66 @@ class MongoDeliveryHistory:
             pickup_time, delivery_time, duration_minutes,
             amount, region, rating, review, status
         }
+        
+        deliveries_data peut être n'importe quel itérable (générateur): seul
+        le paquet courant de chunk_size documents est en mémoire, inséré par
+        un insert_many(ordered=False).
+        - staging=False: la collection est supprimée (drop, bien plus rapide
+          que delete_many) puis rechargée
+        - staging=True: chargement dans deliveries_staging puis renommage
+          atomique sur deliveries; les lecteurs voient l'ancien historique
+          jusqu'au bout, et l'échec du chargement le laisse intact
+          (indisponible en mode time-series: ces collections ne se
+          renomment pas, le chargement est alors direct)
+        Les index de deliveries sont reconstruits après le chargement, puis
+        les agrégats recalculés (sauf refresh_rollups=False, benchmarks).
+        Retourne le nombre de documents importés
         """
         print_subheader("TRAVAIL 1 : Import de l'historique des livraisons")
         
-        # Nettoyer la collection
-        self.deliveries.delete_many({})
+        index_specs = self._index_specs(self.deliveries)
+        if staging and self.timeseries:
+            print_warning("Collection time-series: chargement direct (renommage impossible)")
+            staging = False
+        target = self.db[f"{self.deliveries.name}_staging"] if staging else self.deliveries
+        target.drop()
+        if self.timeseries:
+            self.ensure_timeseries()
+        
+        start = time.perf_counter()
+        total = 0
+        failed = 0
+        for chunk in iter_chunks(deliveries_data, chunk_size):
+            try:
+                docs = [self._stored(doc) for doc in chunk]
+                total += len(target.insert_many(docs, ordered=False).inserted_ids)
+            except BulkWriteError as e:
+                # ordered=False: les documents valides du paquet sont insérés
+                total += e.details['nInserted']
+                failed += len(e.details['writeErrors'])
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed > 0 else 0
+        print_info(f"Chargement: {total} livraisons en {elapsed:.2f}s ({rate:.0f} documents/s)")
+        if failed:
+            print_warning(f"{failed} documents rejetés")
+        
+        try:
+            for keys, options in index_specs:
+                target.create_index(keys, **options)
+        except OperationFailure as e:
+            if staging:
+                target.drop()
+                print_error(f"Index impossible à reconstruire ({e}): historique actuel conservé")
+                return 0
+            raise
         
-        # Insérer les livraisons
-        if deliveries_data:
-            result = self.deliveries.insert_many(deliveries_data)
-            print_success(f"{len(result.inserted_ids)} livraisons importées dans MongoDB")
+        if staging:
+            target.rename(self.deliveries.name, dropTarget=True)
+        self._bump_cache_version()
+        print_success(f"{total} livraisons importées dans MongoDB")
+        if refresh_rollups:
+            self.rollups.ensure_indexes()
+            self.rollups.rebuild()
         
         # Afficher un exemple
         sample = self.deliveries.find_one()
@@ -58,28 +207,45 @@ class MongoDeliveryHistory:
             print(f"  Région: {sample.get('region')}")
             print(f"  Rating: {sample.get('rating')}")
             print(f"  Avis: {sample.get('review')}")
+        
+        return total
+    
+    @staticmethod
+    def _index_specs(collection):
+        """Index secondaires d'une collection [(clés, options)] pour les recréer"""
+        specs = []
+        for name, info in collection.index_information().items():
+            if name == '_id_':
+                continue
+            options = {k: v for k, v in info.items() if k not in ('key', 'v', 'ns')}
+            specs.append((info['key'], dict(options, name=name)))
+        return specs
     
     # =====================================================================
     # TRAVAIL 2 : Requête simple - Historique d'un livreur
     # =====================================================================
     
-    def get_driver_history(self, driver_id):
+    # Champs affichés dans l'historique (+ delivery_time et _id: clé de pagination)
+    HISTORY_FIELDS = ('command_id', 'client', 'destination', 'amount', 'duration_minutes',
+                      'rating', 'delivery_time')
+    
+    def get_driver_history(self, driver_id, page_size=50):
         """
-        Afficher toutes les livraisons d'un livreur
-        + leur nombre + le montant total
+        Afficher les livraisons d'un livreur (page la plus récente)
+        + leur nombre + le montant total, calculés côté serveur
+        Retourne le jeton de la page suivante (None si tout est affiché)
         """
         print_subheader(f"TRAVAIL 2 : Historique du livreur {driver_id}")
         
-        # Requête simple: filtrer par driver_id
-        deliveries = list(self.deliveries.find({'driver_id': driver_id}))
-        
-        if not deliveries:
+        totals = self.driver_history_totals(driver_id)
+        if not totals['count']:
             print_warning(f"Aucune livraison trouvée pour {driver_id}")
-            return
+            return None
+        
+        deliveries, token = self.page_driver_history(driver_id, limit=page_size)
         
         # Afficher les livraisons
         delivery_data = []
-        total_amount = 0
         for d in deliveries:
             delivery_data.append([
                 d['command_id'],
@@ -89,16 +255,69 @@ class MongoDeliveryHistory:
                 f"{d['duration_minutes']}min",
                 d['rating']
             ])
-            total_amount += d['amount']
         
         print_table(
             ['Commande', 'Client', 'Destination', 'Montant', 'Durée', 'Rating'],
             delivery_data,
             f"Livraisons de {driver_id}"
         )
+        if token:
+            print_info(f"{len(deliveries)} livraisons les plus récentes affichées sur {totals['count']}")
         
-        print_success(f"Nombre de livraisons: {len(deliveries)}")
-        print_success(f"Montant total: {total_amount}€")
+        print_success(f"Nombre de livraisons: {totals['count']}")
+        print_success(f"Montant total: {totals['total_amount']}€")
+        return token
+    
+    def page_driver_history(self, driver_id, after=None, limit=50):
+        """
+        Pagination par clé (keyset) de l'historique d'un livreur, des plus
+        récentes aux plus anciennes: tri (delivery_time, _id) décroissant,
+        servi par l'index idx_driver_history
+        - after: jeton de continuation renvoyé par la page précédente
+        Retourne (livraisons, jeton suivant), le jeton valant None en fin de liste
+        Chaque page ne lit que limit entrées d'index, quelle que soit sa position.
+        """
+        query, sort = self.history_query(driver_id, after)
+        deliveries = list(
+            self.deliveries.find(query, dict.fromkeys(self.HISTORY_FIELDS, 1))
+            .sort(sort)
+            .limit(limit)
+        )
+        
+        token = None
+        if len(deliveries) == limit:
+            last = deliveries[-1]
+            token = f"{last['delivery_time'].isoformat()}|{last['_id']}"
+        return deliveries, token
+    
+    @staticmethod
+    def history_query(driver_id, after=None):
+        """Filtre et tri d'une page d'historique (repris par query_advisor)"""
+        query = {'driver_id': driver_id}
+        if after:
+            delivery_time, last_id = after.split('|', 1)
+            delivery_time = datetime.fromisoformat(delivery_time)
+            last_id = ObjectId(last_id) if ObjectId.is_valid(last_id) else last_id
+            query['$or'] = [
+                {'delivery_time': {'$lt': delivery_time}},
+                {'delivery_time': delivery_time, '_id': {'$lt': last_id}},
+            ]
+        return query, [('delivery_time', -1), ('_id', -1)]
+    
+    @staticmethod
+    def totals_pipeline(driver_id):
+        """Pipeline de driver_history_totals"""
+        return [
+            {'$match': {'driver_id': driver_id}},
+            {'$group': {'_id': None, 'count': {'$sum': 1}, 'total_amount': {'$sum': '$amount'}}},
+        ]
+    
+    def driver_history_totals(self, driver_id):
+        """Nombre de livraisons et montant total d'un livreur ($group côté serveur)"""
+        result = next(self.deliveries.aggregate(self.totals_pipeline(driver_id)), None)
+        if result is None:
+            return {'count': 0, 'total_amount': 0}
+        return {'count': result['count'], 'total_amount': result['total_amount']}
     
     # =====================================================================
     # TRAVAIL 3 : Agrégation - Performance par région
@@ -115,24 +334,8 @@ class MongoDeliveryHistory:
         """
         print_subheader("TRAVAIL 3 : Performance par région")
         
-        pipeline = [
-            # Grouper par région
-            {
-                '$group': {
-                    '_id': '$region',
-                    'nombre_livraisons': {'$sum': 1},
-                    'revenu_total': {'$sum': '$amount'},
-                    'duree_moyenne': {'$avg': '$duration_minutes'},
-                    'rating_moyen': {'$avg': '$rating'}
-                }
-            },
-            # Trier par revenu décroissant
-            {
-                '$sort': {'revenu_total': -1}
-            }
-        ]
-        
-        results = list(self.deliveries.aggregate(pipeline))
+        # Somme des agrégats quotidiens (delivery_rollups), pas de la collection brute
+        results = self.rollups.region_totals()
         
         if results:
             region_data = []
@@ -164,32 +367,11 @@ class MongoDeliveryHistory:
         2. Calculer nombre de livraisons, revenu total, durée moyenne, rating moyen
         3. Trier par revenu décroissant
         4. Retourner le top N
+        Lu dans les agrégats quotidiens (delivery_rollups)
         """
         print_subheader(f"TRAVAIL 4 : Top {limit} livreurs")
         
-        pipeline = [
-            # Grouper par livreur
-            {
-                '$group': {
-                    '_id': '$driver_id',
-                    'driver_name': {'$first': '$driver_name'},
-                    'nombre_livraisons': {'$sum': 1},
-                    'revenu_total': {'$sum': '$amount'},
-                    'duree_moyenne': {'$avg': '$duration_minutes'},
-                    'rating_moyen': {'$avg': '$rating'}
-                }
-            },
-            # Trier par revenu décroissant
-            {
-                '$sort': {'revenu_total': -1}
-            },
-            # Limiter aux N premiers
-            {
-                '$limit': limit
-            }
-        ]
-        
-        results = list(self.deliveries.aggregate(pipeline))
+        results = self.rollups.driver_totals(limit)
         
         if results:
             driver_data = []
@@ -211,25 +393,174 @@ class MongoDeliveryHistory:
         else:
             print_warning("Aucune donnée trouvée")
     
+    # =====================================================================
+    # Rapport analytique sur une fenêtre de temps ($facet)
+    # =====================================================================
+    
+    # Indicateurs communs aux regroupements par région et par livreur
+    _REPORT_METRICS = {
+        'nombre_livraisons': {'$sum': 1},
+        'revenu_total': {'$sum': '$amount'},
+        'duree_moyenne': {'$avg': '$duration_minutes'},
+        'rating_moyen': {'$avg': '$rating'},
+    }
+    
+    @classmethod
+    def analytics_pipeline(cls, since, until, regions=None, top=5):
+        """
+        Pipeline du rapport analytique: un $match servi par
+        idx_region_delivery_time (idx_delivery_time sans filtre de régions),
+        puis un seul $facet pour tous les regroupements
+        """
+        match = {'delivery_time': {'$gte': since, '$lt': until}}
+        if regions:
+            match = {'region': {'$in': sorted(regions)}, **match}
+        return [
+            {'$match': match},
+            # Seuls les champs utilisés par les facettes sont transmis
+            {
+                '$project': {
+                    '_id': 0, 'region': 1, 'driver_id': 1, 'driver_name': 1, 'amount': 1,
+                    'duration_minutes': 1, 'rating': 1, 'delivery_time': 1,
+                }
+            },
+            {
+                '$facet': {
+                    'totals': [
+                        {'$group': {'_id': None, **cls._REPORT_METRICS}},
+                    ],
+                    'regions': [
+                        {'$group': {'_id': '$region', **cls._REPORT_METRICS}},
+                        {'$sort': {'revenu_total': -1}},
+                    ],
+                    'top_drivers': [
+                        {
+                            '$group': {
+                                '_id': '$driver_id',
+                                'driver_name': {'$last': '$driver_name'},
+                                **cls._REPORT_METRICS,
+                            }
+                        },
+                        {'$sort': {'revenu_total': -1, '_id': 1}},
+                        {'$limit': top},
+                    ],
+                    'hourly': [
+                        {
+                            '$group': {
+                                '_id': {'$hour': '$delivery_time'},
+                                'nombre_livraisons': {'$sum': 1},
+                                'revenu_total': {'$sum': '$amount'},
+                            }
+                        },
+                        {'$sort': {'_id': 1}},
+                    ],
+                }
+            },
+        ]
+    
+    def analytics(self, since=None, until=None, regions=None, top=5):
+        """
+        Indicateurs des livraisons de [since, until) en une seule lecture
+        de la collection (par défaut: les 7 derniers jours)
+        - until=None: début de la minute suivante, pour que les appels d'une
+          même minute partagent leur résultat en cache
+        - since: datetime, ou timedelta relatif à until
+        - regions: limiter le rapport à ces régions
+        Retourne {'since', 'until', 'totals', 'regions', 'top_drivers', 'hourly'}
+        """
+        if until is None:
+            until = datetime.now().replace(second=0, microsecond=0) + timedelta(minutes=1)
+        if since is None:
+            since = timedelta(days=7)
+        if isinstance(since, timedelta):
+            since = until - since
+        pipeline = self.analytics_pipeline(since, until, regions, top)
+        if self.cache is not None:
+            facets = self.cache.aggregate(self.deliveries, pipeline)
+        else:
+            facets = list(self.deliveries.aggregate(pipeline))
+        facets = facets[0] if facets else {}
+        
+        totals = (facets.get('totals') or [{}])[0]
+        return {
+            'since': since,
+            'until': until,
+            'totals': {metric: totals.get(metric, 0) for metric in self._REPORT_METRICS},
+            'regions': facets.get('regions', []),
+            'top_drivers': facets.get('top_drivers', []),
+            'hourly': facets.get('hourly', []),
+        }
+    
+    def analytics_report(self, since=None, until=None, regions=None, top=5):
+        """Afficher le rapport analytique de [since, until) (voir analytics)"""
+        report = self.analytics(since, until, regions, top)
+        window = f"{report['since']:%d/%m %H:%M} → {report['until']:%d/%m %H:%M}"
+        print_subheader(f"Rapport analytique ({window})")
+        
+        totals = report['totals']
+        if not totals['nombre_livraisons']:
+            print_warning("Aucune livraison sur la période")
+            return report
+        print_info(
+            f"{totals['nombre_livraisons']} livraisons, revenu {totals['revenu_total']}€"
+            + (f" - régions: {', '.join(sorted(regions))}" if regions else "")
+        )
+        
+        print_table(
+            ['Région', 'Livraisons', 'Revenu Total', 'Durée Moy.', 'Rating Moy.'],
+            [
+                [r['_id'], r['nombre_livraisons'], f"{r['revenu_total']}€",
+                 f"{r['duree_moyenne']:.1f}min", f"{r['rating_moyen']:.2f}"]
+                for r in report['regions']
+            ],
+            "Performance par région"
+        )
+        print_table(
+            ['ID', 'Nom', 'Livraisons', 'Revenu Total', 'Durée Moy.', 'Rating Moy.'],
+            [
+                [d['_id'], d['driver_name'], d['nombre_livraisons'], f"{d['revenu_total']}€",
+                 f"{d['duree_moyenne']:.1f}min", f"{d['rating_moyen']:.2f}"]
+                for d in report['top_drivers']
+            ],
+            f"Top {top} livreurs par revenu"
+        )
+        print_table(
+            ['Heure', 'Livraisons', 'Revenu'],
+            [[f"{h['_id']:02d}h", h['nombre_livraisons'], f"{h['revenu_total']}€"] for h in report['hourly']],
+            "Livraisons par heure"
+        )
+        return report
+    
     # =====================================================================
     # TRAVAIL 5 : Gestion des données (Indexation)
     # =====================================================================
     
+    def history_index_keys(self):
+        """Clés de idx_driver_history (pas de _id dans les index d'une collection time-series)"""
+        keys = [('driver_id', 1), ('delivery_time', -1)]
+        if not self.timeseries:
+            keys.append(('_id', -1))
+        return keys
+    
     def create_indexes(self):
         """
         Créer des index stratégiques:
-        - Index sur driver_id pour requêtes par livreur
+        - Index composé driver_id + delivery_time + _id pour l'historique
+          paginé d'un livreur (et les requêtes par livreur)
         - Index composé sur region + delivery_time pour analyses régionales
         """
         print_subheader("TRAVAIL 5 : Création d'index stratégiques")
         
-        # Index simple sur driver_id
+        # Index composé driver_id + (delivery_time, _id): filtre par livreur
+        # et clé de pagination de l'historique
         try:
-            self.deliveries.create_index('driver_id', name='idx_driver_id')
-            print_success("Index créé sur 'driver_id'")
+            history_keys = self.history_index_keys()
+            self.deliveries.create_index(history_keys, name='idx_driver_history')
+            print_success(f"Index composé créé sur {' + '.join(repr(key) for key, _ in history_keys)}")
         except Exception as e:
-            print_info(f"Index 'driver_id' existe déjà ou erreur: {str(e)[:50]}")
+            print_info(f"Index 'driver_history' existe déjà ou erreur: {str(e)[:50]}")
         print_info("  → Optimise les requêtes filtrant par livreur (Travail 2)")
+        print_info("  → Pagination de l'historique sans tri en mémoire ni saut de documents")
         print_info("  → Améliore les performances des agrégations par livreur")
         
         # Index composé sur region + delivery_time
@@ -263,58 +594,198 @@ class MongoDeliveryHistory:
     # TRAVAIL 6 : Synchronisation Redis → MongoDB
     # =====================================================================
     
-    def sync_from_redis(self, redis_conn, order_id):
+    def sync_from_redis(self, redis_conn, order_id, keys=None):
         """
         Synchroniser une livraison terminée depuis Redis vers MongoDB
         Cette fonction est appelée quand une livraison est marquée comme "livrée"
+        keys: schéma de clés (KeySchema par défaut, CompactKeySchema après migration)
         """
         print_subheader(f"TRAVAIL 6 : Synchronisation de {order_id} vers MongoDB")
         
         # Récupérer les infos de la commande depuis Redis
-        order_key = f"order:{order_id}"
-        order_info = redis_conn.hgetall(order_key)
+        order_info = redis_batch.fetch_orders(redis_conn, [order_id], keys=keys)[order_id]
         
         if not order_info or order_info.get('status') != 'livrée':
             print_error(f"Commande {order_id} non trouvée ou pas encore livrée")
             return False
         
         # Récupérer le livreur
-        driver_id = redis_conn.get(f"assignment:{order_id}")
+        driver_id = redis_batch.fetch_assignments(redis_conn, [order_id], keys=keys).get(order_id)
         if not driver_id:
             print_error(f"Pas d'affectation trouvée pour {order_id}")
             return False
         
-        driver_info = redis_conn.hgetall(f"driver:{driver_id}")
+        driver_info = redis_batch.fetch_drivers(
+            redis_conn, [driver_id], ['name', 'region', 'rating'], keys=keys
+        )[driver_id]
         
         # Créer le document MongoDB
-        delivery_doc = {
+        delivery_doc = self._delivery_doc(order_id, order_info, driver_id, driver_info, datetime.now())
+        
+        # Insérer ou mettre à jour dans MongoDB
+        self.rollups.refresh(since=self._upsert_deliveries([delivery_doc]))
+        
+        print_success(f"Livraison {order_id} synchronisée dans MongoDB")
+        print_info(f"  Driver: {driver_info.get('name')} ({driver_id})")
+        print_info(f"  Montant: {order_info.get('amount')}€")
+        
+        return True
+    
+    @staticmethod
+    def _delivery_doc(order_id, order_info, driver_id, driver_info, delivery_time):
+        """Document de livraison construit à partir de l'état Redis"""
+        return {
             'command_id': order_id,
             'client': order_info.get('client'),
             'driver_id': driver_id,
             'driver_name': driver_info.get('name'),
             'pickup_time': datetime.fromisoformat(order_info.get('created_at')),
-            'delivery_time': datetime.now(),  # Temps actuel
+            'delivery_time': delivery_time,
             'duration_minutes': 20,  # Valeur par défaut ou calculée
             'amount': float(order_info.get('amount')),
             'region': driver_info.get('region'),
-            'rating': float(driver_info.get('rating')),
+            'rating': float(driver_info.get('rating') or 0),
             'review': 'Livraison synchronisée depuis Redis',
             'status': 'completed',
             'destination': order_info.get('destination'),
         }
+    
+    def apply_delivery_events(self, redis_conn, events, keys=None):
+        """
+        Puits MongoDB du journal des transitions (voir redis_events)
+        Les événements 'delivered' d'un lot sont écrits en une seule passe
+        (_upsert_deliveries); l'heure de livraison est celle de l'entrée.
+        Rejouer un lot (reprise après panne) est sans effet: remplacement par command_id.
+        Retourne le nombre de livraisons écrites
+        """
+        delivered = {
+            fields['order_id']: (entry_id, fields['driver_id'])
+            for entry_id, fields in events if fields.get('event') == 'delivered'
+        }
+        if not delivered:
+            return 0
         
-        # Insérer ou mettre à jour dans MongoDB
-        self.deliveries.update_one(
-            {'command_id': order_id},
-            {'$set': delivery_doc},
-            upsert=True
+        orders = redis_batch.fetch_orders(redis_conn, delivered, keys=keys)
+        drivers = redis_batch.fetch_drivers(
+            redis_conn, {driver_id for _, driver_id in delivered.values()}, ['name', 'region', 'rating'],
+            keys=keys,
         )
         
-        print_success(f"Livraison {order_id} synchronisée dans MongoDB")
-        print_info(f"  Driver: {driver_info.get('name')} ({driver_id})")
-        print_info(f"  Montant: {order_info.get('amount')}€")
+        docs = []
+        for order_id, (entry_id, driver_id) in delivered.items():
+            order_info = orders.get(order_id)
+            if not order_info:
+                # Commande déjà archivée/supprimée de Redis: rien à synchroniser
+                continue
+            docs.append(self._delivery_doc(
+                order_id, order_info, driver_id, drivers.get(driver_id, {}), event_time(entry_id)
+            ))
         
-        return True
+        if docs:
+            self.rollups.refresh(since=self._upsert_deliveries(docs))
+        return len(docs)
+    
+    def sync_delivered_since(self, redis_conn, watermark=None, batch_size=1000, keys=None):
+        """
+        Synchroniser en masse les commandes livrées depuis watermark
+        (réconciliation de fin de service), via l'index orders:delivered_at
+        (score = heure de livraison, tenu par les scripts de livraison):
+        - par page de batch_size commandes: commandes en un pipeline, profils
+          livreurs via le cache local, un seul bulk_write non ordonné d'upserts
+        - le watermark de chaque index est enregistré dans sync_state après
+          chaque page: un nouvel appel sans watermark reprend là où celui-ci
+          s'est arrêté
+        watermark: datetime de départ (défaut: watermark enregistré)
+        Retourne le nombre de livraisons écrites
+        """
+        keys = keys or KeySchema()
+        profiles = get_driver_profile_cache(redis_conn, keys)
+        start = time.perf_counter()
+        written = 0
+        earliest = None
+        
+        for shard in keys.shards():
+            index_key = keys.delivered_index(shard)
+            since = watermark.timestamp() * 1000 if watermark else self._sync_watermark(index_key)
+            
+            for page in self._delivered_pages(redis_conn, index_key, since, batch_size):
+                order_ids = [order_id for order_id, _ in page]
+                # Le livreur est dans la commande (écrit par le script d'affectation)
+                orders = redis_batch.fetch_orders(redis_conn, order_ids, keys=keys)
+                drivers = profiles.get_many({order.get('driver_id') for order in orders.values()} - {None})
+                
+                docs = []
+                for order_id, score in page:
+                    order_info = orders[order_id]
+                    driver_id = order_info.get('driver_id')
+                    if not driver_id:
+                        # Commande archivée entre-temps: déjà persistée
+                        continue
+                    docs.append(self._delivery_doc(
+                        order_id, order_info, driver_id, drivers.get(driver_id, {}),
+                        datetime.fromtimestamp(score / 1000),
+                    ))
+                
+                if docs:
+                    page_earliest = self._upsert_deliveries(docs)
+                    written += len(docs)
+                    earliest = page_earliest if earliest is None else min(earliest, page_earliest)
+                self.db[SYNC_STATE_COLLECTION].update_one(
+                    {'_id': index_key}, {'$max': {'watermark': page[-1][1]}}, upsert=True
+                )
+        
+        if earliest is not None:
+            self.rollups.refresh(since=earliest)
+        elapsed = time.perf_counter() - start
+        rate = written / elapsed if elapsed > 0 else 0
+        print_success(f"{written} livraisons synchronisées en {elapsed:.2f}s ({rate:.0f} livraisons/s)")
+        return written
+    
+    def _sync_watermark(self, index_key):
+        state = self.db[SYNC_STATE_COLLECTION].find_one({'_id': index_key})
+        return state['watermark'] if state else 0
+    
+    @staticmethod
+    def _delivered_pages(redis_conn, index_key, since, batch_size):
+        """
+        Pages [(order_id, score)] de l'index des livraisons à partir du score
+        since (inclus), par clé: chaque page reprend au dernier score lu en
+        sautant les commandes déjà lues à ce score
+        """
+        low = since
+        seen_at_low = set()
+        while True:
+            page = redis_conn.zrangebyscore(
+                index_key, low, '+inf', start=0, num=batch_size + len(seen_at_low), withscores=True
+            )
+            page = [(order_id, score) for order_id, score in page
+                    if not (score == low and order_id in seen_at_low)]
+            if not page:
+                return
+            yield page
+            
+            last = page[-1][1]
+            if last != low:
+                low, seen_at_low = last, set()
+            seen_at_low.update(order_id for order_id, score in page if score == last)
+    
+    def consume_delivery_events(self, redis_conn, consumer_name='mongodb-1', max_batches=None,
+                                stop_event=None, keys=None):
+        """
+        Synchroniser en continu les livraisons terminées depuis le journal
+        des transitions, via le groupe de consommateurs MONGODB_GROUP
+        """
+        consumer = LifecycleEventConsumer(redis_conn, MONGODB_GROUP, consumer_name, keys)
+        consumer.ensure_group()
+        written = []
+        
+        def sink(events):
+            written.append(self.apply_delivery_events(redis_conn, events, keys))
+        
+        acked = consumer.run(sink, stop_event=stop_event, max_batches=max_batches)
+        print_success(f"{acked} événements traités, {sum(written)} livraisons synchronisées")
+        print_info(f"  Événements en attente d'acquittement: {consumer.pending_count()}")
+        return acked
 
 
 def create_initial_deliveries():
@@ -398,8 +869,9 @@ def run_partie2():
         print_error("Impossible de se connecter à MongoDB. Assurez-vous que Docker est lancé.")
         return
     
-    # Initialiser le système
-    history = MongoDeliveryHistory(db)
+    # Initialiser le système (analyses en cache Redis si disponible)
+    r = get_redis_connection()
+    history = MongoDeliveryHistory(db, cache=AggregationCache(r) if r else None)
     
     # Générer des données
     initial_deliveries = create_initial_deliveries()
@@ -423,6 +895,21 @@ def run_partie2():
     
     # TRAVAIL 4 : Top livreurs
     history.get_top_drivers(2)
+    if history.cache is not None:
+        # Deuxième lecture: servie par Redis tant qu'aucune écriture n'a eu lieu
+        history.rollups.region_totals()
+        stats = history.cache.stats()
+        print_info(
+            f"Cache des agrégations: {stats['hits']} lectures Redis, "
+            f"{stats['misses']} pipelines exécutés"
+        )
+    # Les mêmes indicateurs sur une fenêtre de temps, en une seule lecture
+    history.analytics_report(timedelta(days=1))
+    mismatches = history.rollups.check_consistency()
+    if mismatches:
+        print_warning(f"Agrégats incohérents avec l'historique: {mismatches}")
+    else:
+        print_success("Agrégats cohérents avec la collection brute")
     wait_for_input()
     
     # TRAVAIL 5 : Créer les index
@@ -437,14 +924,27 @@ def run_partie2():
     print_info("Appelée automatiquement lors de la complétion d'une livraison.")
     
     # Démonstration avec connexion Redis
-    r = get_redis_connection()
     if r:
         # Chercher une commande livrée
-        delivered_orders = r.smembers('orders:status:livrée')
-        if delivered_orders:
-            sample_order = list(delivered_orders)[0]
+        sample_order = r.srandmember('orders:status:livrée')
+        if sample_order:
             print_info(f"\nDémonstration avec la commande {sample_order}:")
             history.sync_from_redis(r, sample_order)
+        
+        # Synchronisation par le journal des transitions (Redis Streams)
+        print_info("\nConsommation du journal des transitions (groupe 'mongodb'):")
+        history.consume_delivery_events(r, max_batches=1)
+        
+        # Réconciliation en masse par l'index des livraisons (watermark)
+        print_info("\nRéconciliation des livraisons depuis le dernier watermark:")
+        history.sync_delivered_since(r)
+        
+        # Rétention: les livraisons persistées quittent l'état temps réel
+        result = OrderArchiver(r, history.deliveries).archive()
+        print_info(
+            f"Archivage: {result['archived']} commandes livrées retirées de Redis, "
+            f"{result['skipped']} en attente de persistance"
+        )
     
     print_success("\n✓ Partie 2 terminée avec succès!")
 
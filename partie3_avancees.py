@@ -9,6 +9,8 @@ Ce script implémente:
 import time
 from utils import *
 from data_generator import DataGenerator
+from driver_cache import get_driver_profile_cache
+import redis_batch
 
 
 class AdvancedRedisFeatures:
@@ -16,6 +18,8 @@ class AdvancedRedisFeatures:
     
     def __init__(self, redis_conn):
         self.r = redis_conn
+        # Noms / ratings des livreurs servis par le cache local des profils
+        self.profiles = get_driver_profile_cache(redis_conn)
     
     # =====================================================================
     # TRAVAIL 1 : Gestion des livreurs multi-régions
@@ -50,7 +54,7 @@ class AdvancedRedisFeatures:
                 # Ajouter le livreur au set de la région
                 self.r.sadd(f"region:{region}:drivers", driver_id)
             
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            driver_name = self.profiles.get(driver_id, 'name')
             print(f"  {driver_id} ({driver_name}): {', '.join(regions)}")
         
         print_success("Structure multi-régions configurée")
@@ -72,18 +76,21 @@ class AdvancedRedisFeatures:
             print_warning(f"Aucun livreur trouvé dans {region}")
             return []
         
-        # Récupérer les détails de chaque livreur
+        # Récupérer les détails de tous les livreurs en deux pipelines
+        driver_ids = sorted(driver_ids)
+        drivers = self.profiles.get_many(driver_ids, ['name', 'rating'])
+        all_regions = redis_batch.fetch_sets(self.r, [f"driver:{d}:regions" for d in driver_ids])
+        
         drivers_data = []
-        for driver_id in driver_ids:
-            driver_info = self.r.hgetall(f"driver:{driver_id}")
-            rating = self.r.zscore('drivers:ratings', driver_id)
-            regions = self.r.smembers(f"driver:{driver_id}:regions")
+        for driver_id, regions in zip(driver_ids, all_regions):
+            driver_info = drivers[driver_id]
+            rating = driver_info.get('rating')
             
             drivers_data.append([
                 driver_id,
                 driver_info.get('name', 'N/A'),
                 ', '.join(sorted(regions)),
-                rating or 'N/A'
+                float(rating) if rating else 'N/A'
             ])
         
         print_table(
@@ -111,9 +118,10 @@ class AdvancedRedisFeatures:
         top_drivers = self.r.zrevrange('drivers:ratings', 0, 4, withscores=True)
         
         # Stocker dans un cache avec TTL
+        names = self.profiles.get_many([d for d, _ in top_drivers], ['name'])
         cache_data = []
         for driver_id, rating in top_drivers:
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            driver_name = names[driver_id].get('name')
             cache_data.append(f"{driver_id}|{driver_name}|{rating}")
         
         # Stocker dans une liste Redis avec expiration
@@ -143,8 +151,8 @@ class AdvancedRedisFeatures:
         # Grouper par région (basé sur la destination)
         regions_cache = {}
         
-        for order_id in pending_orders:
-            order_info = self.r.hgetall(f"order:{order_id}")
+        orders = redis_batch.fetch_orders(self.r, pending_orders, ['destination'])
+        for order_id, order_info in orders.items():
             destination = order_info.get('destination', 'Unknown')
             
             # Déterminer la région approximativement
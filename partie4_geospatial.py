@@ -12,6 +12,8 @@ import random
 import math
 from utils import *
 from data_generator import DataGenerator
+from driver_cache import get_driver_profile_cache
+import redis_batch
 
 
 class GeoSpatialDelivery:
@@ -22,6 +24,8 @@ class GeoSpatialDelivery:
     
     def __init__(self, redis_conn):
         self.r = redis_conn
+        # Noms / ratings des livreurs servis par le cache local des profils
+        self.profiles = get_driver_profile_cache(redis_conn)
     
     # =====================================================================
     # TRAVAIL 1 : Stocker les positions géo-spatiales
@@ -83,8 +87,9 @@ class GeoSpatialDelivery:
         
         # Afficher les positions
         position_data = []
+        names = self.profiles.get_many(driver_positions, ['name'])
         for driver_id, coords in driver_positions.items():
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+            driver_name = names[driver_id].get('name')
             position_data.append([driver_id, driver_name or 'N/A', coords['lon'], coords['lat']])
         
         print_table(['ID', 'Nom', 'Longitude', 'Latitude'], position_data, "Positions actuelles")
@@ -126,9 +131,10 @@ class GeoSpatialDelivery:
         
         # Afficher les résultats
         driver_data = []
+        infos = self.profiles.get_many([d[0] for d in drivers], ['name', 'rating'])
         for driver_id, distance, coords in drivers:
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
-            rating = self.r.zscore('drivers:ratings', driver_id)
+            driver_name = infos[driver_id].get('name')
+            rating = float(infos[driver_id].get('rating') or 0) or None
             driver_data.append([
                 driver_id,
                 driver_name or 'N/A',
@@ -178,9 +184,10 @@ class GeoSpatialDelivery:
         
         # Afficher les résultats
         driver_data = []
+        infos = self.profiles.get_many([d[0] for d in drivers], ['name', 'rating'])
         for driver_id, distance in drivers:
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
-            rating = self.r.zscore('drivers:ratings', driver_id)
+            driver_name = infos[driver_id].get('name')
+            rating = float(infos[driver_id].get('rating') or 0) or None
             driver_data.append([
                 driver_id,
                 driver_name or 'N/A',
@@ -239,10 +246,16 @@ class GeoSpatialDelivery:
         
         # Récupérer les détails de chaque livreur
         candidates = []
-        for driver_id, distance in drivers:
-            driver_name = self.r.hget(f"driver:{driver_id}", 'name')
-            rating = float(self.r.zscore('drivers:ratings', driver_id) or 0)
-            in_progress = int(self.r.hget(f"driver:{driver_id}:stats", 'deliveries_in_progress') or 0)
+        # Profil depuis le cache local, stats (changeantes) depuis Redis
+        driver_ids = [d[0] for d in drivers]
+        infos = self.profiles.get_many(driver_ids, ['name', 'rating'])
+        stats = redis_batch.fetch_hashes(
+            self.r, [f"driver:{driver_id}:stats" for driver_id in driver_ids], ['deliveries_in_progress']
+        )
+        for (driver_id, distance), driver_stats in zip(drivers, stats):
+            driver_name = infos[driver_id].get('name')
+            rating = float(infos[driver_id].get('rating') or 0)
+            in_progress = int(driver_stats.get('deliveries_in_progress') or 0)
             
             # Calculer un score selon la stratégie
             if strategy == 'closest':
@@ -307,7 +320,7 @@ class GeoSpatialDelivery:
         # Using execute_command to avoid redis-py 5.0.1 bug
         self.r.execute_command('GEOADD', 'drivers_locations', new_lon, new_lat, driver_id)
         
-        driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+        driver_name = self.profiles.get(driver_id, 'name')
         print_success(f"Position de {driver_id} ({driver_name}) mise à jour: ({new_lon:.4f}, {new_lat:.4f})")
     
     def check_driver_in_zone(self, driver_id, max_distance_km=5):
@@ -332,7 +345,7 @@ class GeoSpatialDelivery:
             lat
         )
         
-        driver_name = self.r.hget(f"driver:{driver_id}", 'name')
+        driver_name = self.profiles.get(driver_id, 'name')
         
         if distance > max_distance_km:
             print_warning(f"⚠ ALERTE: {driver_id} ({driver_name}) est hors zone!")
@@ -0,0 +1,454 @@
+"""
+Plans d'exécution de l'historique MongoDB et conseils d'index
+
+Rejoue par explain("executionStats") les requêtes et pipelines de
+l'application sur deliveries (MongoDeliveryHistory, DeliveryRollups,
+OrderArchiver), avec les mêmes filtres, tris et projections et des valeurs
+réelles de la base, puis rapporte pour chacune:
+- le plan retenu (IXSCAN / COLLSCAN) et les index utilisés
+- les clés et documents examinés pour les documents retournés
+- si la requête est couverte par un index (aucun document lu)
+et propose:
+- les index manquants des requêtes en COLLSCAN, composés selon la règle
+  égalité → tri → intervalle; les conditions {champ: {$exists: true}}
+  deviennent le filtre d'un index partiel
+- les index couvrants des requêtes à projection étroite
+
+Les requêtes fréquentes (hot) ne doivent jamais parcourir toute la
+collection: avec --fail-on-collscan, le script sort en erreur (code 1) si
+l'une d'elles régresse en COLLSCAN (intégration continue, test_projet.py).
+
+Usage:
+    python query_advisor.py                      # rapport
+    python query_advisor.py --apply              # créer les index manquants
+    python query_advisor.py --apply --covering   # + index couvrants
+    python query_advisor.py --fail-on-collscan   # échec si COLLSCAN fréquent
+"""
+
+import argparse
+import sys
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo.errors import OperationFailure
+from utils import *
+from partie2_mongodb_historique import MongoDeliveryHistory
+from delivery_rollups import RAW_REGION_PIPELINE
+
+
+# Étapes de plan qui lisent un index
+_INDEX_STAGES = {'IXSCAN', 'EXPRESS_IXSCAN', 'IDHACK', 'EXPRESS_IDHACK', 'DISTINCT_SCAN', 'COUNT_SCAN'}
+
+# Opérateurs traités comme égalité (premier groupe de la règle ESR)
+_EQUALITY_OPERATORS = {'$eq', '$in'}
+
+# Au-delà, un index couvrant coûte plus en écritures et en mémoire qu'il ne fait gagner
+_MAX_COVERING_FIELDS = 4
+
+# Commandes lues par lot dans l'archiveur (OrderArchiver.batch_size)
+_ARCHIVER_BATCH = 500
+
+
+# =====================================================================
+# Requêtes de l'application
+# =====================================================================
+
+def query_cases(history):
+    """
+    Requêtes à inspecter, paramétrées par un document réel de deliveries
+    Chaque cas: {'name', 'collection', 'hot'} et soit filter / projection /
+    sort / limit (find), soit pipeline (aggregate); 'index' optionnel:
+    (clés, options) de l'index prévu par create_indexes pour cette requête
+    """
+    deliveries = history.deliveries
+    sample = deliveries.find_one({}, {'driver_id': 1, 'region': 1, 'delivery_time': 1}) or {}
+    driver_id = sample.get('driver_id', 'd1')
+    moment = sample.get('delivery_time') or datetime.now()
+    command_ids = [
+        doc['command_id']
+        for doc in deliveries.find({}, {'command_id': 1, '_id': 0}).limit(_ARCHIVER_BATCH)
+        if 'command_id' in doc
+    ] or ['c1']
+    
+    history_index = (history.history_index_keys(), {'name': 'idx_driver_history'})
+    command_index = ([('command_id', 1)], {'name': 'idx_command_id'})
+    time_index = ([('delivery_time', 1)], {'name': 'idx_delivery_time'})
+    first_page, sort = history.history_query(driver_id)
+    next_page, _ = history.history_query(driver_id, f"{moment.isoformat()}|{sample.get('_id', ObjectId())}")
+    history_fields = dict.fromkeys(history.HISTORY_FIELDS, 1)
+    rollups = history.rollups
+    
+    return [
+        {
+            'name': "Historique livreur (1re page)", 'collection': deliveries, 'hot': True,
+            'filter': first_page, 'projection': history_fields, 'sort': sort, 'limit': 50,
+            'index': history_index,
+        },
+        {
+            'name': "Historique livreur (page suivante)", 'collection': deliveries, 'hot': True,
+            'filter': next_page, 'projection': history_fields, 'sort': sort, 'limit': 50,
+            'index': history_index,
+        },
+        {
+            'name': "Totaux d'un livreur", 'collection': deliveries, 'hot': True,
+            'pipeline': history.totals_pipeline(driver_id), 'index': history_index,
+        },
+        {
+            'name': "Synchronisation (upsert par commande)", 'collection': deliveries, 'hot': True,
+            'filter': {'command_id': command_ids[0]}, 'index': command_index,
+        },
+        {
+            'name': "Archivage (commandes persistées)", 'collection': deliveries, 'hot': True,
+            'filter': {
+                'command_id': {'$in': command_ids},
+                'synced_at': {'$exists': True},
+                'delivery_time': {'$lte': datetime.now()},
+            },
+            'projection': {'command_id': 1, '_id': 0}, 'index': command_index,
+        },
+        {
+            'name': "Watermark des agrégats", 'collection': deliveries, 'hot': True,
+            'filter': {'delivery_time': {'$ne': None}}, 'projection': {'delivery_time': 1},
+            'sort': [('delivery_time', -1)], 'limit': 1, 'index': time_index,
+        },
+        {
+            'name': "Rafraîchissement des agrégats", 'collection': deliveries, 'hot': True,
+            'pipeline': rollups.window_pipeline(
+                moment - timedelta(days=rollups.lookback_days), None, ObjectId()
+            ),
+            'index': time_index,
+        },
+        {
+            'name': "Rapport analytique (fenêtre, régions)", 'collection': deliveries, 'hot': True,
+            'pipeline': history.analytics_pipeline(
+                moment - timedelta(days=7), moment + timedelta(seconds=1), [sample.get('region', 'Paris')]
+            ),
+            'index': ([('region', 1), ('delivery_time', -1)], {'name': 'idx_region_delivery_time'}),
+        },
+        {
+            'name': "Analyse par région (agrégats)", 'collection': rollups.rollups, 'hot': False,
+            'pipeline': rollups.totals_pipeline('$region'),
+        },
+        {
+            'name': "Top livreurs (agrégats)", 'collection': rollups.rollups, 'hot': False,
+            'pipeline': rollups.totals_pipeline('$driver_id', {'driver_name': {'$last': '$driver_name'}}, 2),
+        },
+        {
+            'name': "Contrôle de cohérence", 'collection': deliveries, 'hot': False,
+            'pipeline': RAW_REGION_PIPELINE,
+        },
+    ]
+
+
+# =====================================================================
+# Explain
+# =====================================================================
+
+def explain(case):
+    """explain('executionStats') d'un cas (commande find ou aggregate)"""
+    collection = case['collection']
+    if 'pipeline' in case:
+        command = {'aggregate': collection.name, 'pipeline': case['pipeline'], 'cursor': {}}
+    else:
+        command = {'find': collection.name, 'filter': case['filter']}
+        if case.get('projection'):
+            command['projection'] = case['projection']
+        if case.get('sort'):
+            command['sort'] = dict(case['sort'])
+        if case.get('limit'):
+            command['limit'] = case['limit']
+    return collection.database.command('explain', command, verbosity='executionStats')
+
+
+def _values_of(node, key):
+    """Valeurs de key à toute profondeur (plans rejetés exclus)"""
+    if isinstance(node, dict):
+        for name, value in node.items():
+            if name == key:
+                yield value
+            elif name != 'rejectedPlans':
+                yield from _values_of(value, key)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _values_of(item, key)
+
+
+def summarize_explain(explained):
+    """
+    Résumé d'une sortie d'explain, quelle que soit sa forme (find, aggregate
+    avec étape $cursor, moteur SBE avec queryPlan, collection shardée):
+    {'plan', 'stages', 'indexes', 'keys_examined', 'docs_examined',
+     'returned', 'millis', 'covered'}
+    """
+    stages, indexes = [], []
+    for plan in _values_of(explained, 'winningPlan'):
+        stages.extend(_values_of(plan, 'stage'))
+        for name in _values_of(plan, 'indexName'):
+            if name not in indexes:
+                indexes.append(name)
+    
+    keys_examined = docs_examined = returned = millis = 0
+    for stats in _values_of(explained, 'executionStats'):
+        keys_examined += stats.get('totalKeysExamined', 0)
+        docs_examined += stats.get('totalDocsExamined', 0)
+        returned += stats.get('nReturned', 0)
+        millis = max(millis, stats.get('executionTimeMillis', 0))
+    
+    if 'COLLSCAN' in stages:
+        plan = 'COLLSCAN'
+    elif _INDEX_STAGES & set(stages):
+        plan = 'IXSCAN'
+    else:
+        plan = stages[0] if stages else 'inconnu'
+    
+    return {
+        'plan': plan,
+        'stages': stages,
+        'indexes': indexes,
+        'keys_examined': keys_examined,
+        'docs_examined': docs_examined,
+        'returned': returned,
+        'millis': millis,
+        'covered': plan == 'IXSCAN' and docs_examined == 0 and 'FETCH' not in stages,
+    }
+
+
+# =====================================================================
+# Conseils d'index
+# =====================================================================
+
+def derive_index(query, sort=None):
+    """
+    Index composé servant un filtre et un tri: champs en égalité, puis
+    champs du tri, puis champs en intervalle (règle ESR). Les conditions
+    {champ: {$exists: true}} du niveau principal forment le filtre d'un
+    index partiel. Retourne (clés, options)
+    """
+    equality, ranges, partial = [], [], {}
+    
+    def visit(conditions, in_or):
+        for field, condition in conditions.items():
+            if field in ('$and', '$or', '$nor'):
+                for branch in condition:
+                    visit(branch, in_or or field != '$and')
+                continue
+            if field.startswith('$'):
+                continue
+            is_operators = isinstance(condition, dict) and condition and all(
+                op.startswith('$') for op in condition
+            )
+            operators = set(condition) if is_operators else {'$eq'}
+            if not in_or and is_operators and condition == {'$exists': True}:
+                partial[field] = condition
+            elif not in_or and operators <= _EQUALITY_OPERATORS:
+                equality.append(field)
+            else:
+                ranges.append(field)
+    
+    visit(query or {}, False)
+    keys = []
+    for field, direction in [(f, 1) for f in equality] + list(sort or []) + [(f, 1) for f in ranges]:
+        if field not in [name for name, _ in keys]:
+            keys.append((field, direction))
+    
+    options = {'name': _index_name(keys)}
+    if partial:
+        options['partialFilterExpression'] = partial
+    return keys, options
+
+
+def _index_name(keys):
+    return 'idx_' + '_'.join(field.lstrip('_') for field, _ in keys)
+
+
+def _pipeline_shape(pipeline):
+    """Filtre ($match de tête) et tri ($sort qui le suit) d'un pipeline"""
+    stages = list(pipeline)
+    query = stages.pop(0)['$match'] if stages and '$match' in stages[0] else {}
+    sort = list(stages[0]['$sort'].items()) if stages and '$sort' in stages[0] else None
+    return query, sort
+
+
+def _covering_keys(case):
+    """
+    Index couvrant d'un find à projection étroite: (clés, options), None si
+    trop large (le filtre partiel éventuel est celui de derive_index)
+    """
+    projection = case.get('projection')
+    if 'pipeline' in case or not projection:
+        return None
+    keys, options = derive_index(case['filter'], case.get('sort'))
+    fields = [field for field, included in projection.items() if included and field != '_id']
+    if projection.get('_id', 1):
+        fields.append('_id')
+    covering = list(keys) + [(field, 1) for field in fields if field not in [n for n, _ in keys]]
+    if len(covering) > _MAX_COVERING_FIELDS:
+        return None
+    return covering, dict(options, name=_index_name(covering))
+
+
+def _index_exists(collection, keys):
+    """Un index existant commence-t-il par keys (dans un sens de parcours ou l'autre) ?"""
+    wanted = [(field, direction) for field, direction in keys]
+    reverse = [(field, -direction) for field, direction in keys]
+    for info in collection.index_information().values():
+        prefix = [(field, direction) for field, direction in info['key'][:len(wanted)]]
+        if prefix in (wanted, reverse):
+            return True
+    return False
+
+
+def format_keys(keys):
+    return '{' + ', '.join(f"{field}: {direction}" for field, direction in keys) + '}'
+
+
+def inspect_queries(history, cases=None):
+    """
+    Explain de chaque requête et conseils d'index
+    Retourne une liste de résumés (voir summarize_explain) complétés de
+    'name', 'hot', 'collection' et 'suggestions' [{'kind', 'collection',
+    'keys', 'options'}], kind valant 'manquant', 'inutilisé' ou 'couvrant'
+    """
+    results = []
+    for case in cases if cases is not None else query_cases(history):
+        collection = case['collection']
+        try:
+            summary = summarize_explain(explain(case))
+        except OperationFailure as e:
+            print_warning(f"explain impossible pour '{case['name']}': {e}")
+            continue
+        
+        if 'pipeline' in case:
+            query, sort = _pipeline_shape(case['pipeline'])
+        else:
+            query, sort = case['filter'], case.get('sort')
+        keys, options = case.get('index') or derive_index(query, sort)
+        
+        suggestions = []
+        if summary['plan'] == 'COLLSCAN' and query:
+            kind = 'inutilisé' if _index_exists(collection, keys) else 'manquant'
+            suggestions.append({'kind': kind, 'collection': collection, 'keys': keys, 'options': options})
+        covering = _covering_keys(case)
+        # Une seule lecture de document ne justifie pas un index de plus
+        if (covering and not summary['covered'] and summary['docs_examined'] > 1
+                and not _index_exists(collection, covering[0])):
+            suggestions.append({
+                'kind': 'couvrant', 'collection': collection, 'keys': covering[0],
+                'options': covering[1],
+            })
+        
+        results.append(dict(
+            summary, name=case['name'], hot=case['hot'], collection=collection.name,
+            suggestions=suggestions,
+        ))
+    return results
+
+
+def hot_collscans(results):
+    """Requêtes fréquentes qui parcourent toute la collection (régressions)"""
+    return [result['name'] for result in results if result['hot'] and result['plan'] == 'COLLSCAN']
+
+
+def apply_suggestions(results, covering=False):
+    """Créer les index manquants (et couvrants si covering). Retourne leurs noms"""
+    created, seen = [], set()
+    for result in results:
+        for suggestion in result['suggestions']:
+            if suggestion['kind'] != 'manquant' and not (covering and suggestion['kind'] == 'couvrant'):
+                continue
+            collection = suggestion['collection']
+            if (collection.name, tuple(suggestion['keys'])) in seen:
+                continue
+            seen.add((collection.name, tuple(suggestion['keys'])))
+            try:
+                name = collection.create_index(suggestion['keys'], **suggestion['options'])
+                print_success(f"Index {name} créé sur {collection.name} {format_keys(suggestion['keys'])}")
+                created.append(name)
+            except OperationFailure as e:
+                print_warning(f"Index {format_keys(suggestion['keys'])} non créé: {e}")
+    return created
+
+
+def print_advisor_report(results):
+    """Afficher les plans et les conseils d'index"""
+    rows = [
+        [
+            result['name'],
+            'oui' if result['hot'] else '',
+            result['plan'],
+            ', '.join(result['indexes']) or '-',
+            result['keys_examined'],
+            result['docs_examined'],
+            result['returned'],
+            result['millis'],
+            'oui' if result['covered'] else '',
+        ]
+        for result in results
+    ]
+    print_table(
+        ['Requête', 'Fréquente', 'Plan', 'Index', 'Clés exam.', 'Docs exam.', 'Retournés', 'ms', 'Couverte'],
+        rows,
+    )
+    
+    suggestions = [(result, s) for result in results for s in result['suggestions']]
+    if not suggestions:
+        print_success("Aucun index à ajouter")
+        return
+    labels = {
+        'manquant': "Index manquant",
+        'inutilisé': "Index existant non retenu par le planificateur",
+        'couvrant': "Index couvrant possible",
+    }
+    for result, suggestion in suggestions:
+        message = (
+            f"{labels[suggestion['kind']]} pour '{result['name']}': "
+            f"{suggestion['collection'].name} {format_keys(suggestion['keys'])}"
+        )
+        partial = suggestion['options'].get('partialFilterExpression')
+        if partial:
+            message += f" (partiel: {partial})"
+        if suggestion['kind'] == 'couvrant':
+            print_info(message)
+        else:
+            print_warning(message)
+
+
+def run_advisor(apply=False, covering=False, fail_on_collscan=False):
+    """Rapport complet; retourne le code de sortie (1 si régression et fail_on_collscan)"""
+    print_header("PLANS D'EXÉCUTION MONGODB")
+    
+    db = get_mongodb_connection()
+    if db is None:
+        print_error("Impossible de se connecter à MongoDB. Assurez-vous que Docker est lancé.")
+        return 1
+    
+    history = MongoDeliveryHistory(db)
+    history.timeseries = history.is_timeseries()
+    results = inspect_queries(history)
+    print_advisor_report(results)
+    
+    if apply:
+        print_subheader("Création des index conseillés")
+        if apply_suggestions(results, covering):
+            results = inspect_queries(history)
+            print_advisor_report(results)
+        else:
+            print_info("Aucun index créé")
+    
+    regressions = hot_collscans(results)
+    if not regressions:
+        print_success("Aucune requête fréquente ne parcourt toute la collection")
+        return 0
+    for name in regressions:
+        (print_error if fail_on_collscan else print_warning)(f"COLLSCAN sur une requête fréquente: {name}")
+    return 1 if fail_on_collscan else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plans d'exécution et conseils d'index (deliveries)")
+    parser.add_argument('--apply', action='store_true', help="créer les index manquants")
+    parser.add_argument('--covering', action='store_true', help="avec --apply: créer aussi les index couvrants")
+    parser.add_argument('--fail-on-collscan', action='store_true',
+                        help="code de sortie 1 si une requête fréquente fait un COLLSCAN")
+    args = parser.parse_args()
+    
+    sys.exit(run_advisor(args.apply, args.covering, args.fail_on_collscan))
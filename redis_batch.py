@@ -0,0 +1,144 @@
+"""
+Lectures groupées Redis (suppression des requêtes N+1)
+
+Les vues de lecture passent par ces fonctions: les HGETALL/HMGET d'une
+liste d'IDs sont envoyés dans un pipeline non transactionnel, donc en un
+seul aller-retour par paquet de BATCH_SIZE clés au lieu d'une commande
+par livreur ou par commande.
+Avec le stockage compact (redis_keys.CompactKeySchema), un seul HMGET lit
+tous les enregistrements demandés d'un même paquet.
+"""
+
+from utils import iter_chunks
+from redis_keys import KeySchema
+
+
+# Nombre de commandes par pipeline: borne la taille des tampons réseau
+BATCH_SIZE = 1000
+
+
+def fetch_hashes(r, keys, fields=None):
+    """
+    Lire plusieurs hashes en pipeline
+    - fields=None: HGETALL de chaque clé
+    - sinon: HMGET des seuls champs demandés (champs absents ignorés)
+    Retourne une liste de dicts, dans l'ordre des clés
+    """
+    return _read_hashes(r, [(key, fields) for key in keys])
+
+
+def fetch_sets(r, keys):
+    """Lire plusieurs sets (SMEMBERS) en pipeline, dans l'ordre des clés"""
+    results = []
+    for chunk in iter_chunks(keys, BATCH_SIZE):
+        pipe = r.pipeline(transaction=False)
+        for key in chunk:
+            pipe.smembers(key)
+        results.extend(pipe.execute())
+    return results
+
+
+def fetch_drivers(r, driver_ids, fields=None, stats_fields=None, keys=None):
+    """
+    Récupérer les profils de plusieurs livreurs en un aller-retour
+    Si stats_fields est fourni, les champs de driver:{id}:stats sont lus
+    dans le même pipeline et fusionnés dans le résultat.
+    Retourne {driver_id: {champ: valeur}}
+    """
+    driver_ids = list(driver_ids)
+    if keys is not None and keys.compact:
+        # Profil et stats sont dans le même enregistrement compact
+        wanted = None if fields is None else list(fields) + list(stats_fields or [])
+        return _read_records(r, driver_ids, keys.driver_bucket, keys.DRIVER_FIELDS, wanted, keys)
+    
+    requests = [(f"driver:{driver_id}", fields) for driver_id in driver_ids]
+    if stats_fields is not None:
+        requests += [(f"driver:{driver_id}:stats", stats_fields) for driver_id in driver_ids]
+    
+    hashes = _read_hashes(r, requests)
+    drivers = dict(zip(driver_ids, hashes))
+    if stats_fields is not None:
+        for driver_id, stats in zip(driver_ids, hashes[len(driver_ids):]):
+            drivers[driver_id].update(stats)
+    return drivers
+
+
+def fetch_orders(r, order_ids, fields=None, keys=None):
+    """
+    Récupérer plusieurs commandes en un aller-retour
+    keys: schéma de clés (KeySchema par défaut, voir redis_keys)
+    Retourne {order_id: {champ: valeur}}
+    """
+    keys = keys or KeySchema()
+    order_ids = list(order_ids)
+    if keys.compact:
+        return _read_records(r, order_ids, keys.order_bucket, keys.ORDER_FIELDS, fields, keys)
+    hashes = fetch_hashes(r, [keys.order(order_id) for order_id in order_ids], fields)
+    return dict(zip(order_ids, hashes))
+
+
+def fetch_assignments(r, order_ids, keys=None):
+    """
+    Récupérer les livreurs affectés à plusieurs commandes (MGET)
+    En mode cluster, les clés sont sur plusieurs slots: MGET non atomique
+    (une requête par nœud) de redis-py
+    """
+    keys = keys or KeySchema()
+    if keys.compact:
+        # Le livreur affecté est un champ de l'enregistrement de la commande
+        orders = _read_records(r, order_ids, keys.order_bucket, keys.ORDER_FIELDS, ['driver_id'], keys)
+        return {order_id: order.get('driver_id') for order_id, order in orders.items()}
+    
+    assignments = {}
+    for chunk in iter_chunks(order_ids, BATCH_SIZE):
+        assignment_keys = [keys.assignment(order_id) for order_id in chunk]
+        if keys.sharded:
+            values = r.mget_nonatomic(assignment_keys)
+        else:
+            values = r.mget(assignment_keys)
+        assignments.update(zip(chunk, values))
+    return assignments
+
+
+def _read_hashes(r, requests):
+    """Exécuter une liste de (clé, champs) en pipelines de BATCH_SIZE"""
+    results = []
+    for chunk in iter_chunks(requests, BATCH_SIZE):
+        pipe = r.pipeline(transaction=False)
+        for key, fields in chunk:
+            if fields is None:
+                pipe.hgetall(key)
+            else:
+                pipe.hmget(key, fields)
+        for (key, fields), reply in zip(chunk, pipe.execute()):
+            if fields is None:
+                results.append(reply)
+            else:
+                results.append({f: v for f, v in zip(fields, reply) if v is not None})
+    return results
+
+
+def _read_records(r, record_ids, bucket_of, record_fields, fields, keys):
+    """
+    Lire des enregistrements du stockage compact: un HMGET par paquet
+    (bucket_of: id → clé du hash), en pipelines de BATCH_SIZE paquets
+    Retourne {id: {champ: valeur}} limité à fields (tous si None)
+    """
+    by_bucket = {}
+    for record_id in record_ids:
+        by_bucket.setdefault(bucket_of(record_id), []).append(record_id)
+    
+    records = {}
+    for chunk in iter_chunks(by_bucket.items(), BATCH_SIZE):
+        pipe = r.pipeline(transaction=False)
+        for bucket, ids in chunk:
+            pipe.hmget(bucket, ids)
+        for (_, ids), values in zip(chunk, pipe.execute()):
+            for record_id, value in zip(ids, values):
+                record = keys.unpack(record_fields, value, record_id if value is not None else None)
+                if fields is not None:
+                    record = {f: v for f, v in record.items() if f in fields}
+                records[record_id] = record
+    
+    # Même ordre que les IDs demandés
+    return {record_id: records[record_id] for record_id in record_ids}
@@ -0,0 +1,143 @@
+"""
+Journal des transitions de commandes (Redis Streams)
+
+Les scripts d'affectation et de livraison (voir redis_scripts) ajoutent un
+événement compact au flux orders:events dans le même appel atomique que la
+transition:
+    event=assigned  order_id=c1 driver_id=d3
+    event=delivered order_id=c1 driver_id=d3 amount=25
+L'ID de l'entrée (millisecondes Redis) donne l'heure de la transition.
+
+Chaque consommateur aval (MongoDB, métriques, dashboard) lit le flux via
+son propre groupe de consommateurs, à son rythme:
+- XREADGROUP distribue les nouvelles entrées entre les membres du groupe
+- XACK acquitte une entrée une fois traitée
+- XAUTOCLAIM reprend les entrées restées en attente trop longtemps
+  (consommateur planté avant l'acquittement)
+"""
+
+import time
+from datetime import datetime
+from redis.exceptions import ResponseError
+from redis_keys import KeySchema
+
+
+# Groupe de consommateurs de la synchronisation vers MongoDB
+MONGODB_GROUP = 'mongodb'
+
+
+def event_time(entry_id):
+    """Heure d'une entrée de flux (partie millisecondes de son ID)"""
+    return datetime.fromtimestamp(int(entry_id.split('-')[0]) / 1000)
+
+
+class LifecycleEventConsumer:
+    """
+    Membre d'un groupe de consommateurs du journal des transitions
+    En mode cluster (ClusterKeySchema), chaque shard a son propre flux:
+    le consommateur les lit tous.
+    """
+    
+    def __init__(self, redis_conn, group, consumer, keys=None):
+        self.r = redis_conn
+        self.group = group
+        self.consumer = consumer
+        self.keys = keys or KeySchema()
+        self.streams = [self.keys.event_stream(shard) for shard in self.keys.shards()]
+    
+    def ensure_group(self, start_id='0'):
+        """
+        Créer le groupe sur chaque flux (et le flux s'il n'existe pas)
+        start_id='0' relit tout l'historique conservé, '$' seulement la suite
+        """
+        for stream in self.streams:
+            try:
+                self.r.xgroup_create(stream, self.group, id=start_id, mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+    
+    def read(self, count=100, block_ms=1000):
+        """
+        Lire les nouvelles entrées attribuées à ce consommateur
+        Retourne [(flux, entry_id, champs)]
+        """
+        entries = []
+        # Un seul flux: lecture bloquante. Plusieurs flux (cluster): un
+        # XREADGROUP par flux, sans blocage, car ils sont sur des slots différents
+        block = block_ms if len(self.streams) == 1 else None
+        for stream in self.streams:
+            replies = self.r.xreadgroup(
+                self.group, self.consumer, {stream: '>'}, count=count, block=block
+            )
+            for _, messages in replies or []:
+                entries.extend((stream, entry_id, fields) for entry_id, fields in messages)
+        return entries
+    
+    def reclaim(self, min_idle_ms=60000, count=100):
+        """
+        Reprendre les entrées non acquittées depuis plus de min_idle_ms
+        (XAUTOCLAIM), retourne [(flux, entry_id, champs)]
+        """
+        entries = []
+        for stream in self.streams:
+            start = '0-0'
+            while True:
+                reply = self.r.xautoclaim(
+                    stream, self.group, self.consumer, min_idle_ms, start_id=start, count=count
+                )
+                start, messages = reply[0], reply[1]
+                # Les entrées élaguées par MAXLEN sont retirées des attentes par Redis
+                entries.extend(
+                    (stream, entry_id, fields)
+                    for entry_id, fields in messages if entry_id is not None
+                )
+                if start in ('0-0', b'0-0') or len(entries) >= count:
+                    break
+        return entries
+    
+    def ack(self, entries):
+        """Acquitter des entrées [(flux, entry_id, champs)]"""
+        by_stream = {}
+        for stream, entry_id, _ in entries:
+            by_stream.setdefault(stream, []).append(entry_id)
+        
+        pipe = self.r.pipeline(transaction=False)
+        for stream, entry_ids in by_stream.items():
+            pipe.xack(stream, self.group, *entry_ids)
+        return sum(pipe.execute())
+    
+    def pending_count(self):
+        """Nombre d'entrées délivrées au groupe mais pas encore acquittées"""
+        return sum(self.r.xpending(stream, self.group)['pending'] for stream in self.streams)
+    
+    def process(self, handler, count=100, block_ms=1000, min_idle_ms=60000):
+        """
+        Traiter un lot: entrées reprises puis nouvelles entrées
+        handler reçoit [(entry_id, champs)]; le lot n'est acquitté que si
+        handler ne lève pas d'exception (sinon il sera repris plus tard).
+        Retourne le nombre d'entrées acquittées
+        """
+        entries = self.reclaim(min_idle_ms, count) + self.read(count, block_ms)
+        if not entries:
+            return 0
+        handler([(entry_id, fields) for _, entry_id, fields in entries])
+        return self.ack(entries)
+    
+    def run(self, handler, stop_event=None, max_batches=None, idle_sleep=0.5, **options):
+        """
+        Boucle de consommation jusqu'à stop_event.set() (ou max_batches lots)
+        Retourne le nombre total d'entrées acquittées
+        """
+        total = 0
+        batches = 0
+        while not (stop_event and stop_event.is_set()):
+            if max_batches is not None and batches >= max_batches:
+                break
+            processed = self.process(handler, **options)
+            total += processed
+            batches += 1
+            if not processed and len(self.streams) > 1:
+                # Les lectures multi-flux ne bloquent pas: éviter de boucler à vide
+                time.sleep(idle_sleep)
+        return total
@@ -0,0 +1,162 @@
+"""
+Schéma des clés Redis des commandes
+
+- KeySchema : schéma historique mono-nœud (order:{id}, orders:status:*, ...)
+- ClusterKeySchema : schéma Redis Cluster. Chaque commande appartient à un
+  shard (crc32(id) % shards) et toutes ses clés portent le hash tag du
+  shard: {o:3}:order:c1, {o:3}:assignment:c1, {o:3}:orders:status:en_attente...
+  La commande, son affectation et les sets/index de statut de son shard
+  sont donc sur le même slot, ce qui permet aux scripts Lua de rester
+  atomiques sur un cluster.
+
+Les clés livreurs (driver:{id}, driver:{id}:stats, drivers:*) ne changent
+pas: elles ne sont jamais écrites dans le même script qu'une commande en
+mode cluster.
+
+- CompactKeySchema : stockage compact mono-nœud. Les commandes et les
+  livreurs sont regroupés par paquets de COMPACT_BUCKET_SIZE dans de petits
+  hashes (orders:b:12, drivers:b:0) dont chaque champ est un enregistrement
+  encodé: un seul hash encodé en listpack remplace des milliers de clés.
+"""
+
+import re
+import zlib
+
+
+# Nombre d'enregistrements par hash du stockage compact. Les scripts Lua
+# calculent le même paquet: la valeur est partagée avec redis_scripts.
+# Pour rester en listpack, Redis doit être configuré avec
+# hash-max-listpack-entries >= COMPACT_BUCKET_SIZE (voir docker-compose.yml)
+COMPACT_BUCKET_SIZE = 1000
+
+# Séparateur des champs d'un enregistrement compact (caractère US, 0x1f)
+RECORD_SEPARATOR = '\x1f'
+
+
+class KeySchema:
+    """Noms de clés mono-nœud (schéma historique, un seul shard)"""
+    
+    sharded = False
+    compact = False
+    
+    def shards(self):
+        """Liste des shards de statut"""
+        return [None]
+    
+    def shard_of(self, order_id):
+        """Shard d'une commande"""
+        return None
+    
+    def order(self, order_id):
+        return f"order:{order_id}"
+    
+    def assignment(self, order_id):
+        return f"assignment:{order_id}"
+    
+    def status_set(self, status, shard=None):
+        return f"orders:status:{status}"
+    
+    def created_index(self, status, shard=None):
+        return f"orders:created:{status}"
+    
+    def pending_queue(self, shard=None):
+        return "orders:queue"
+    
+    def event_stream(self, shard=None):
+        return "orders:events"
+    
+    def delivered_index(self, shard=None):
+        """Commandes livrées, score = heure de livraison (ms)"""
+        return "orders:delivered_at"
+
+
+class ClusterKeySchema(KeySchema):
+    """Noms de clés Redis Cluster: hash tag {o:<shard>} par commande"""
+    
+    sharded = True
+    
+    def __init__(self, shard_count=16):
+        self.shard_count = shard_count
+    
+    def shards(self):
+        return list(range(self.shard_count))
+    
+    def shard_of(self, order_id):
+        # crc32 est stable d'un processus à l'autre (contrairement à hash())
+        return zlib.crc32(str(order_id).encode('utf-8')) % self.shard_count
+    
+    def _tag(self, shard):
+        return f"{{o:{shard}}}"
+    
+    def order(self, order_id):
+        return f"{self._tag(self.shard_of(order_id))}:order:{order_id}"
+    
+    def assignment(self, order_id):
+        return f"{self._tag(self.shard_of(order_id))}:assignment:{order_id}"
+    
+    def status_set(self, status, shard=None):
+        return f"{self._tag(shard)}:orders:status:{status}"
+    
+    def created_index(self, status, shard=None):
+        return f"{self._tag(shard)}:orders:created:{status}"
+    
+    def pending_queue(self, shard=None):
+        return f"{self._tag(shard)}:orders:queue"
+    
+    def event_stream(self, shard=None):
+        return f"{self._tag(shard)}:orders:events"
+    
+    def delivered_index(self, shard=None):
+        return f"{self._tag(shard)}:orders:delivered_at"
+
+
+class CompactKeySchema(KeySchema):
+    """
+    Stockage compact: enregistrements encodés dans des hashes par paquets
+    - orders:b:{n}  : champ order_id  → client, destination, montant,
+                       created_at, statut, livreur (remplace order:{id}
+                       et assignment:{id})
+    - drivers:b:{n} : champ driver_id → nom, région, rating et stats
+                       (remplace driver:{id} et driver:{id}:stats)
+    n = partie numérique finale de l'ID // COMPACT_BUCKET_SIZE ('_' sinon)
+    Les sets, index et classements restent ceux du schéma historique.
+    """
+    
+    compact = True
+    
+    ORDER_FIELDS = ('client', 'destination', 'amount', 'created_at', 'status', 'driver_id')
+    DRIVER_FIELDS = (
+        'name', 'region', 'rating',
+        'deliveries_in_progress', 'deliveries_completed', 'total_revenue',
+    )
+    
+    @staticmethod
+    def bucket_of(record_id):
+        """Paquet d'un enregistrement (même calcul que les scripts Lua)"""
+        match = re.search(r'(\d+)$', str(record_id))
+        return int(match.group(1)) // COMPACT_BUCKET_SIZE if match else '_'
+    
+    def order_bucket(self, order_id):
+        return f"orders:b:{self.bucket_of(order_id)}"
+    
+    def driver_bucket(self, driver_id):
+        return f"drivers:b:{self.bucket_of(driver_id)}"
+    
+    @staticmethod
+    def pack(fields, record):
+        """Encoder un enregistrement (champs absents: chaîne vide)"""
+        return RECORD_SEPARATOR.join(
+            '' if record.get(field) is None else str(record[field]) for field in fields
+        )
+    
+    @staticmethod
+    def unpack(fields, value, record_id=None):
+        """Décoder un enregistrement ({} s'il n'existe pas), sans les champs vides"""
+        if value is None:
+            return {}
+        record = {
+            field: part for field, part in zip(fields, value.split(RECORD_SEPARATOR)) if part != ''
+        }
+        if record_id is not None:
+            record['id'] = record_id
+        return record
@@ -0,0 +1,281 @@
+"""
+Rapport mémoire Redis par famille de clés
+
+Parcourt l'espace de clés par SCAN (non bloquant), regroupe les clés en
+familles (les segments d'ID sont remplacés par *: driver:d12:stats →
+driver:*:stats, {o:3}:order:c1 → {o:*}:order:*), échantillonne chaque
+famille (MEMORY USAGE, OBJECT ENCODING, taille) et extrapole:
+- la mémoire totale estimée de chaque famille
+- les octets par livreur et par commande (familles driver*/order*)
+- les clés sorties de l'encodage compact (listpack / intset)
+
+Usage:
+    python redis_memory_report.py                    # rapport console
+    python redis_memory_report.py --json report.json # + export JSON (suivi)
+    python redis_memory_report.py --json -           # JSON sur la sortie standard
+"""
+
+import argparse
+import json
+import random
+import re
+from datetime import datetime
+from redis.exceptions import ResponseError
+from utils import *
+from data_generator import DataGenerator
+
+
+# Segments considérés comme des IDs (d12, c345, 12, {o:3})
+_ID_SEGMENT = re.compile(r'^[a-z]{0,2}\d+$')
+_SHARD_TAG = re.compile(r'^\{o:\d+\}')
+
+# Réglages du seuil d'encodage compact par type (le premier connu de
+# Redis est retenu: set-max-listpack-entries n'existe que depuis Redis 7.2)
+_COMPACT_THRESHOLDS = {
+    'hash': ('hash-max-listpack-entries', 'hash-max-ziplist-entries'),
+    'zset': ('zset-max-listpack-entries', 'zset-max-ziplist-entries'),
+    'set': ('set-max-listpack-entries', 'set-max-intset-entries'),
+    'list': ('list-max-listpack-size', 'list-max-ziplist-size'),
+}
+_LARGE_ENCODINGS = {'hashtable', 'skiplist', 'linkedlist', 'quicklist'}
+
+# Préfixes des familles rattachées à un livreur / une commande
+_DRIVER_PREFIXES = ('driver:', 'drivers:')
+_ORDER_PREFIXES = ('order:', 'orders:', 'assignment:')
+
+
+def key_family(key):
+    """Famille d'une clé: segments d'ID remplacés par *"""
+    key = _SHARD_TAG.sub('{o:*}', key)
+    return ':'.join('*' if _ID_SEGMENT.match(part) else part for part in key.split(':'))
+
+
+def _entity_of(family):
+    """'driver', 'order' ou None selon la famille (hash tag de shard ignoré)"""
+    name = family.split('}:', 1)[-1] + ':'
+    if name.startswith(_DRIVER_PREFIXES):
+        return 'driver'
+    if name.startswith(_ORDER_PREFIXES):
+        return 'order'
+    return None
+
+
+def _scan_families(r, sample_size, scan_count, max_keys):
+    """
+    SCAN de l'espace de clés: nombre de clés et échantillon (réservoir)
+    de sample_size clés par famille. Retourne (familles, clés parcourues)
+    """
+    families = {}
+    scanned = 0
+    for key in r.scan_iter(count=scan_count):
+        family = families.setdefault(key_family(key), {'keys': 0, 'sample': []})
+        family['keys'] += 1
+        if len(family['sample']) < sample_size:
+            family['sample'].append(key)
+        else:
+            slot = random.randrange(family['keys'])
+            if slot < sample_size:
+                family['sample'][slot] = key
+        scanned += 1
+        if max_keys and scanned >= max_keys:
+            break
+    return families, scanned
+
+
+def _inspect_keys(r, keys):
+    """TYPE, OBJECT ENCODING, MEMORY USAGE et taille de chaque clé (pipelinés)"""
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        pipe.object('encoding', key)
+        pipe.memory_usage(key)
+    replies = pipe.execute(raise_on_error=False)
+    
+    details = []
+    pipe = r.pipeline(transaction=False)
+    for index, key in enumerate(keys):
+        key_type, encoding, usage = replies[3 * index:3 * index + 3]
+        details.append({
+            'key': key,
+            'type': key_type,
+            'encoding': encoding if isinstance(encoding, str) else 'inconnu',
+            'bytes': usage if isinstance(usage, int) else 0,
+        })
+        length_command = {'hash': pipe.hlen, 'zset': pipe.zcard, 'set': pipe.scard, 'list': pipe.llen}
+        length_command.get(key_type, pipe.exists)(key)
+    for detail, length in zip(details, pipe.execute(raise_on_error=False)):
+        detail['length'] = length if isinstance(length, int) else 0
+    return details
+
+
+def _compact_thresholds(r):
+    """Seuils d'encodage compact configurés {type: nombre d'éléments}"""
+    thresholds = dict.fromkeys(_COMPACT_THRESHOLDS)
+    for key_type, settings in _COMPACT_THRESHOLDS.items():
+        for setting in settings:
+            try:
+                value = r.config_get(setting).get(setting)
+            except ResponseError:
+                # CONFIG désactivée (Redis managé): seuils inconnus
+                return thresholds
+            if value is not None:
+                thresholds[key_type] = int(value)
+                break
+    return thresholds
+
+
+def _non_compact_reason(detail, thresholds):
+    """Raison du signalement d'une clé non compacte (None si compacte)"""
+    if detail['encoding'] not in _LARGE_ENCODINGS:
+        return None
+    threshold = thresholds.get(detail['type'])
+    if threshold and threshold > 0 and detail['length'] > threshold:
+        return f"{detail['length']} éléments > {threshold}"
+    # Petite clé non compacte: une valeur trop longue l'a convertie (conversion définitive)
+    return "sortie du listpack (valeur trop longue ou clé ayant grossi)"
+
+
+def collect_memory_report(r, sample_size=50, scan_count=1000, max_keys=None):
+    """
+    Construire le rapport mémoire (dict sérialisable en JSON)
+    max_keys borne le parcours: les comptes sont alors extrapolés à DBSIZE
+    """
+    used_memory = r.info('memory')['used_memory']
+    dbsize = r.dbsize()
+    families, scanned = _scan_families(r, sample_size, scan_count, max_keys)
+    scale = dbsize / scanned if scanned and max_keys and scanned < dbsize else 1
+    thresholds = _compact_thresholds(r)
+    
+    report_families = {}
+    flagged = []
+    for family, data in families.items():
+        details = _inspect_keys(r, data['sample'])
+        sampled_bytes = sum(detail['bytes'] for detail in details)
+        average = sampled_bytes / len(details) if details else 0
+        keys = round(data['keys'] * scale)
+        
+        encodings = {}
+        for detail in details:
+            encodings[detail['encoding']] = encodings.get(detail['encoding'], 0) + 1
+            reason = _non_compact_reason(detail, thresholds)
+            if reason:
+                flagged.append({
+                    'key': detail['key'],
+                    'family': family,
+                    'type': detail['type'],
+                    'encoding': detail['encoding'],
+                    'length': detail['length'],
+                    'bytes': detail['bytes'],
+                    'reason': reason,
+                })
+        
+        report_families[family] = {
+            'keys': keys,
+            'sampled': len(details),
+            'avg_bytes': round(average, 1),
+            'estimated_bytes': round(average * keys),
+            'types': sorted({detail['type'] for detail in details}),
+            'encodings': encodings,
+            'entity': _entity_of(family),
+        }
+    
+    # Nombre de commandes: somme des sets de statut (tous shards), peu nombreux
+    # donc tous présents dans l'échantillon de leur famille
+    status_keys = [
+        key for family, data in families.items() if 'orders:status:' in family for key in data['sample']
+    ] or [f"orders:status:{status}" for status in DataGenerator.ORDER_STATUSES]
+    pipe = r.pipeline(transaction=False)
+    for key in status_keys:
+        pipe.scard(key)
+    orders = sum(pipe.execute())
+    drivers = r.scard('drivers:all')
+    per_entity = {}
+    for entity, count in (('driver', drivers), ('order', orders)):
+        total = sum(f['estimated_bytes'] for f in report_families.values() if f['entity'] == entity)
+        per_entity[entity] = {
+            'count': count,
+            'estimated_bytes': total,
+            'bytes_each': round(total / count, 1) if count else None,
+        }
+    
+    return {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'used_memory': used_memory,
+        'dbsize': dbsize,
+        'scanned_keys': scanned,
+        'sample_size': sample_size,
+        'compact_thresholds': thresholds,
+        'families': dict(sorted(
+            report_families.items(), key=lambda item: item[1]['estimated_bytes'], reverse=True
+        )),
+        'per_driver': per_entity['driver'],
+        'per_order': per_entity['order'],
+        'flagged': sorted(flagged, key=lambda item: item['bytes'], reverse=True),
+    }
+
+
+def print_memory_report(report, top_flagged=20):
+    """Afficher le rapport: familles, octets par entité, clés signalées"""
+    print_subheader("Mémoire par famille de clés")
+    print_info(
+        f"Mémoire utilisée: {format_bytes(report['used_memory'])} - "
+        f"{report['dbsize']} clés ({report['scanned_keys']} parcourues)"
+    )
+    
+    used = report['used_memory'] or 1
+    rows = [
+        [
+            family,
+            data['keys'],
+            data['avg_bytes'],
+            format_bytes(data['estimated_bytes']),
+            f"{data['estimated_bytes'] / used:.1%}",
+            ', '.join(f"{encoding}:{count}" for encoding, count in data['encodings'].items()),
+        ]
+        for family, data in report['families'].items()
+    ]
+    print_table(['Famille', 'Clés', 'Octets/clé', 'Total estimé', '% mémoire', 'Encodages'], rows)
+    
+    for label, entity in (('livreur', report['per_driver']), ('commande', report['per_order'])):
+        if entity['bytes_each'] is not None:
+            print_info(f"Octets par {label}: {entity['bytes_each']} ({entity['count']} {label}s)")
+    
+    flagged = report['flagged']
+    if flagged:
+        print_warning(f"{len(flagged)} clés échantillonnées hors encodage compact:")
+        for item in flagged[:top_flagged]:
+            print(f"  {item['key']} ({item['type']}, {item['encoding']}, "
+                  f"{format_bytes(item['bytes'])}): {item['reason']}")
+    else:
+        print_success("Toutes les clés échantillonnées sont en encodage compact")
+
+
+def run_memory_report(json_path=None, sample_size=50, max_keys=None):
+    """Collecter, afficher et (optionnellement) exporter le rapport en JSON"""
+    r = get_redis_connection()
+    if not r:
+        print_error("Impossible de se connecter à Redis. Assurez-vous que Docker est lancé.")
+        return None
+    
+    report = collect_memory_report(r, sample_size=sample_size, max_keys=max_keys)
+    if json_path == '-':
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return report
+    
+    print_header("RAPPORT MÉMOIRE REDIS")
+    print_memory_report(report)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print_success(f"Rapport JSON écrit dans {json_path}")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rapport mémoire Redis par famille de clés")
+    parser.add_argument('--json', metavar='FICHIER', help="exporter le rapport en JSON ('-' = stdout)")
+    parser.add_argument('--sample-size', type=int, default=50, help="clés échantillonnées par famille")
+    parser.add_argument('--max-keys', type=int, help="borner le nombre de clés parcourues")
+    args = parser.parse_args()
+    
+    run_memory_report(args.json, args.sample_size, args.max_keys)
@@ -0,0 +1,476 @@
+"""
+Registre des scripts Lua du cycle de vie des commandes
+
+Les scripts sont chargés une seule fois au démarrage (SCRIPT LOAD) puis
+appelés par EVALSHA: seul le SHA1 transite sur le réseau et Redis ne
+reparse plus le source à chaque appel. Si Redis a redémarré entre-temps
+(erreur NOSCRIPT), le script est rechargé et l'appel rejoué.
+"""
+
+import hashlib
+from redis.exceptions import NoScriptError
+from redis_keys import COMPACT_BUCKET_SIZE, CompactKeySchema
+
+
+# Taille approximative (MAXLEN ~) du flux d'événements du cycle de vie:
+# les entrées les plus anciennes sont élaguées par blocs entiers
+EVENTS_MAXLEN = 100000
+
+# Journal des transitions: chaque affectation / livraison ajoute un
+# événement compact au flux, dans le même script que la transition
+_EMIT_EVENT = f"""
+local EVENTS_MAXLEN = {EVENTS_MAXLEN}
+
+local function emit_event(stream_key, ...)
+    redis.call('XADD', stream_key, 'MAXLEN', '~', EVENTS_MAXLEN, '*', ...)
+end
+"""
+
+# Changement de statut: déplacement entre les sets orders:status:* et
+# entre les index orders:created:* (score = created_at) de la pagination
+_MOVE_STATUS = """
+local function move_status(order_id, from_status, to_status)
+    redis.call('SMOVE', 'orders:status:' .. from_status, 'orders:status:' .. to_status, order_id)
+    
+    local created = redis.call('ZSCORE', 'orders:created:' .. from_status, order_id)
+    if created then
+        redis.call('ZREM', 'orders:created:' .. from_status, order_id)
+        redis.call('ZADD', 'orders:created:' .. to_status, created, order_id)
+    end
+end
+"""
+
+# Index des commandes livrées (synchronisation incrémentale vers MongoDB):
+# score = heure Redis de la livraison en millisecondes
+_MARK_DELIVERED = """
+local function mark_delivered(index_key, order_id)
+    local now = redis.call('TIME')
+    redis.call('ZADD', index_key, now[1] * 1000 + math.floor(now[2] / 1000), order_id)
+end
+"""
+
+# Affectation d'une commande à un livreur, partagée par les scripts
+# unitaire et groupé: retourne 'OK' ou la raison du refus
+_ASSIGN_ONE = _MOVE_STATUS + _EMIT_EVENT + """
+local function assign_one(order_id, driver_id)
+    local order_key = 'order:' .. order_id
+    local driver_stats_key = 'driver:' .. driver_id .. ':stats'
+    
+    -- Vérifier que la commande existe et est en attente
+    local current_status = redis.call('HGET', order_key, 'status')
+    if not current_status then
+        return 'Commande inexistante'
+    end
+    if current_status ~= 'en_attente' then
+        return 'Commande déjà assignée ou livrée'
+    end
+    
+    -- 1. Mettre à jour le statut de la commande
+    redis.call('HSET', order_key, 'status', 'assignée')
+    redis.call('HSET', order_key, 'driver_id', driver_id)
+    
+    -- 2. Déplacer la commande entre les sets (et index) de statut
+    --    et la retirer de la file de dispatch
+    move_status(order_id, 'en_attente', 'assignée')
+    redis.call('ZREM', 'orders:queue', order_id)
+    
+    -- 3. Enregistrer l'affectation
+    redis.call('SET', 'assignment:' .. order_id, driver_id)
+    
+    -- 4. Incrémenter les livraisons en cours du livreur
+    --    (hash de stats + classement drivers:in_progress du dashboard)
+    redis.call('HINCRBY', driver_stats_key, 'deliveries_in_progress', 1)
+    redis.call('ZINCRBY', 'drivers:in_progress', 1, driver_id)
+    
+    -- 5. Journaliser la transition
+    emit_event('orders:events', 'event', 'assigned', 'order_id', order_id, 'driver_id', driver_id)
+    
+    return 'OK'
+end
+"""
+
+# Affectation d'une commande à un livreur
+# KEYS[1] = id de la commande, KEYS[2] = id du livreur
+_ASSIGN_ORDER_MAIN = """
+local result = assign_one(KEYS[1], KEYS[2])
+if result ~= 'OK' then
+    return {err = result}
+end
+return result
+"""
+ASSIGN_ORDER = _ASSIGN_ONE + _ASSIGN_ORDER_MAIN
+
+# Affectation groupée de N couples (commande, livreur) en un seul appel
+# ARGV = order_id_1, driver_id_1, order_id_2, driver_id_2, ...
+# Retourne un résultat par couple: 'OK' ou la raison du refus
+_ASSIGN_ORDERS_BULK_MAIN = """
+local results = {}
+for i = 1, #ARGV, 2 do
+    results[#results + 1] = assign_one(ARGV[i], ARGV[i + 1])
+end
+return results
+"""
+ASSIGN_ORDERS_BULK = _ASSIGN_ONE + _ASSIGN_ORDERS_BULK_MAIN
+
+# Fin d'une livraison, partagée par les scripts unitaire et groupé.
+# Le livreur et le montant sont lus dans le script: pas de lecture côté
+# client qui pourrait diverger de l'état au moment de l'écriture.
+# Retourne 'OK' (ou la raison du refus), l'id du livreur et le montant
+_COMPLETE_ONE = _MOVE_STATUS + _EMIT_EVENT + _MARK_DELIVERED + """
+local function complete_one(order_id)
+    local order_key = 'order:' .. order_id
+    
+    -- Récupérer le livreur affecté et vérifier le statut
+    local driver_id = redis.call('GET', 'assignment:' .. order_id)
+    if not driver_id then
+        return 'Aucun livreur affecté à la commande'
+    end
+    local order = redis.call('HMGET', order_key, 'status', 'amount')
+    if order[1] ~= 'assignée' then
+        return 'Commande non assignée ou déjà livrée'
+    end
+    local amount = order[2] or '0'
+    local driver_stats_key = 'driver:' .. driver_id .. ':stats'
+    
+    -- 1. Mettre à jour le statut
+    redis.call('HSET', order_key, 'status', 'livrée')
+    
+    -- 2. Déplacer entre les sets (et index) de statut, dater la livraison
+    move_status(order_id, 'assignée', 'livrée')
+    mark_delivered('orders:delivered_at', order_id)
+    
+    -- 3. Décrémenter les livraisons en cours (le classement ne garde
+    --    que les livreurs ayant encore des livraisons en cours)
+    local remaining = redis.call('HINCRBY', driver_stats_key, 'deliveries_in_progress', -1)
+    if remaining > 0 then
+        redis.call('ZADD', 'drivers:in_progress', remaining, driver_id)
+    else
+        redis.call('ZREM', 'drivers:in_progress', driver_id)
+    end
+    
+    -- 4. Incrémenter les livraisons complétées
+    redis.call('HINCRBY', driver_stats_key, 'deliveries_completed', 1)
+    
+    -- 5. Ajouter au revenu total
+    redis.call('HINCRBYFLOAT', driver_stats_key, 'total_revenue', amount)
+    
+    -- 6. Journaliser la transition
+    emit_event('orders:events', 'event', 'delivered', 'order_id', order_id,
+               'driver_id', driver_id, 'amount', amount)
+    
+    return 'OK', driver_id, amount
+end
+"""
+
+# Fin d'une livraison en un seul aller-retour
+# KEYS[1] = id de la commande
+# Retourne {driver_id, montant}
+_COMPLETE_DELIVERY_MAIN = """
+local result, driver_id, amount = complete_one(KEYS[1])
+if result ~= 'OK' then
+    return {err = result}
+end
+return {driver_id, amount}
+"""
+COMPLETE_DELIVERY = _COMPLETE_ONE + _COMPLETE_DELIVERY_MAIN
+
+# Fin groupée de plusieurs livraisons (reconnexion de l'app livreur)
+# ARGV = order_id_1, order_id_2, ...
+# Retourne un résultat par commande: 'OK' ou la raison du refus
+_COMPLETE_DELIVERIES_BULK_MAIN = """
+local results = {}
+for i = 1, #ARGV do
+    results[i] = (complete_one(ARGV[i]))
+end
+return results
+"""
+COMPLETE_DELIVERIES_BULK = _COMPLETE_ONE + _COMPLETE_DELIVERIES_BULK_MAIN
+
+# ---------------------------------------------------------------------
+# Variantes Redis Cluster (voir redis_keys.ClusterKeySchema)
+# Toutes les clés sont passées dans KEYS et partagent le hash tag du shard:
+#   KEYS[1], KEYS[2] = sets de statut source / destination du shard
+#   KEYS[3], KEYS[4] = index created_at source / destination du shard
+#   KEYS[5] = file de dispatch du shard
+#   KEYS[6] = flux d'événements du shard
+#   KEYS[7] = index des livraisons du shard (orders:delivered_at)
+#   puis pour la commande i: KEYS[6 + 2i] = hash, KEYS[7 + 2i] = affectation
+# Les compteurs livreurs, sur d'autres slots, sont mis à jour par l'appelant.
+# ---------------------------------------------------------------------
+
+_MOVE_SHARD_STATUS = """
+local function move_shard_status(order_id)
+    redis.call('SMOVE', KEYS[1], KEYS[2], order_id)
+    
+    local created = redis.call('ZSCORE', KEYS[3], order_id)
+    if created then
+        redis.call('ZREM', KEYS[3], order_id)
+        redis.call('ZADD', KEYS[4], created, order_id)
+    end
+end
+"""
+
+# Affectation des commandes d'un shard
+# ARGV = order_id_1, driver_id_1, ... ; retourne 'OK' ou la raison par couple
+CLUSTER_ASSIGN_ORDERS = _MOVE_SHARD_STATUS + _EMIT_EVENT + """
+local results = {}
+for i = 1, #ARGV / 2 do
+    local order_key = KEYS[6 + 2 * i]
+    local order_id = ARGV[2 * i - 1]
+    local driver_id = ARGV[2 * i]
+    
+    local current_status = redis.call('HGET', order_key, 'status')
+    if not current_status then
+        results[i] = 'Commande inexistante'
+    elseif current_status ~= 'en_attente' then
+        results[i] = 'Commande déjà assignée ou livrée'
+    else
+        redis.call('HSET', order_key, 'status', 'assignée', 'driver_id', driver_id)
+        move_shard_status(order_id)
+        redis.call('ZREM', KEYS[5], order_id)
+        redis.call('SET', KEYS[7 + 2 * i], driver_id)
+        emit_event(KEYS[6], 'event', 'assigned', 'order_id', order_id, 'driver_id', driver_id)
+        results[i] = 'OK'
+    end
+end
+return results
+"""
+
+# Fin des livraisons d'un shard
+# ARGV = order_id_1, order_id_2, ...
+# Retourne par commande {'OK', driver_id, montant} ou {raison du refus}
+CLUSTER_COMPLETE_DELIVERIES = _MOVE_SHARD_STATUS + _EMIT_EVENT + _MARK_DELIVERED + """
+local results = {}
+for i = 1, #ARGV do
+    local order_key = KEYS[6 + 2 * i]
+    local driver_id = redis.call('GET', KEYS[7 + 2 * i])
+    
+    if not driver_id then
+        results[i] = {'Aucun livreur affecté à la commande'}
+    else
+        local order = redis.call('HMGET', order_key, 'status', 'amount')
+        if order[1] ~= 'assignée' then
+            results[i] = {'Commande non assignée ou déjà livrée'}
+        else
+            redis.call('HSET', order_key, 'status', 'livrée')
+            move_shard_status(ARGV[i])
+            mark_delivered(KEYS[7], ARGV[i])
+            emit_event(KEYS[6], 'event', 'delivered', 'order_id', ARGV[i],
+                       'driver_id', driver_id, 'amount', order[2] or '0')
+            results[i] = {'OK', driver_id, order[2] or '0'}
+        end
+    end
+end
+return results
+"""
+
+CLUSTER_SCRIPTS = {
+    'assign_orders': CLUSTER_ASSIGN_ORDERS,
+    'complete_deliveries': CLUSTER_COMPLETE_DELIVERIES,
+}
+
+# Positions Lua (base 1) des champs des enregistrements compacts
+_ORDER_POS = {field: i + 1 for i, field in enumerate(CompactKeySchema.ORDER_FIELDS)}
+_DRIVER_POS = {field: i + 1 for i, field in enumerate(CompactKeySchema.DRIVER_FIELDS)}
+
+# ---------------------------------------------------------------------
+# Variantes stockage compact (voir redis_keys.CompactKeySchema)
+# Mêmes signatures et mêmes résultats que les scripts historiques: seules
+# les fonctions assign_one / complete_one changent. Les enregistrements
+# sont décodés, modifiés puis réencodés dans leur hash de paquet.
+# ---------------------------------------------------------------------
+
+_COMPACT_RECORDS = f"""
+local BUCKET_SIZE = {COMPACT_BUCKET_SIZE}
+local SEP = string.char(31)
+
+-- Positions des champs dans les enregistrements (cf. CompactKeySchema)
+local O_AMOUNT, O_STATUS, O_DRIVER = {_ORDER_POS['amount']}, {_ORDER_POS['status']}, {_ORDER_POS['driver_id']}
+local D_IN_PROGRESS, D_COMPLETED, D_REVENUE = {_DRIVER_POS['deliveries_in_progress']}, {_DRIVER_POS['deliveries_completed']}, {_DRIVER_POS['total_revenue']}
+
+local function bucket_of(record_id)
+    local digits = string.match(record_id, '(%d+)$')
+    if not digits then
+        return '_'
+    end
+    return tostring(math.floor(tonumber(digits) / BUCKET_SIZE))
+end
+
+local function unpack_record(value)
+    local fields = {{}}
+    for field in string.gmatch(value .. SEP, '(.-)' .. SEP) do
+        fields[#fields + 1] = field
+    end
+    return fields
+end
+
+local function pack_record(fields)
+    return table.concat(fields, SEP)
+end
+"""
+
+_COMPACT_ASSIGN_ONE = _MOVE_STATUS + _EMIT_EVENT + _COMPACT_RECORDS + """
+local function assign_one(order_id, driver_id)
+    local order_bucket = 'orders:b:' .. bucket_of(order_id)
+    local driver_bucket = 'drivers:b:' .. bucket_of(driver_id)
+    
+    -- Vérifier que la commande existe et est en attente
+    local raw_order = redis.call('HGET', order_bucket, order_id)
+    if not raw_order then
+        return 'Commande inexistante'
+    end
+    local order = unpack_record(raw_order)
+    if order[O_STATUS] ~= 'en_attente' then
+        return 'Commande déjà assignée ou livrée'
+    end
+    local raw_driver = redis.call('HGET', driver_bucket, driver_id)
+    if not raw_driver then
+        return 'Livreur inexistant'
+    end
+    
+    -- 1. Statut et livreur dans l'enregistrement (tient lieu d'affectation)
+    order[O_STATUS] = 'assignée'
+    order[O_DRIVER] = driver_id
+    redis.call('HSET', order_bucket, order_id, pack_record(order))
+    
+    -- 2. Sets / index de statut et file de dispatch
+    move_status(order_id, 'en_attente', 'assignée')
+    redis.call('ZREM', 'orders:queue', order_id)
+    
+    -- 3. Livraisons en cours du livreur
+    local driver = unpack_record(raw_driver)
+    driver[D_IN_PROGRESS] = tostring((tonumber(driver[D_IN_PROGRESS]) or 0) + 1)
+    redis.call('HSET', driver_bucket, driver_id, pack_record(driver))
+    redis.call('ZINCRBY', 'drivers:in_progress', 1, driver_id)
+    
+    -- 4. Journaliser la transition
+    emit_event('orders:events', 'event', 'assigned', 'order_id', order_id, 'driver_id', driver_id)
+    
+    return 'OK'
+end
+"""
+
+_COMPACT_COMPLETE_ONE = _MOVE_STATUS + _EMIT_EVENT + _MARK_DELIVERED + _COMPACT_RECORDS + """
+local function complete_one(order_id)
+    local order_bucket = 'orders:b:' .. bucket_of(order_id)
+    
+    -- Livreur affecté et statut, lus dans l'enregistrement de la commande
+    local raw_order = redis.call('HGET', order_bucket, order_id)
+    local order = raw_order and unpack_record(raw_order) or {}
+    local driver_id = order[O_DRIVER]
+    if not driver_id or driver_id == '' then
+        return 'Aucun livreur affecté à la commande'
+    end
+    if order[O_STATUS] ~= 'assignée' then
+        return 'Commande non assignée ou déjà livrée'
+    end
+    local amount = order[O_AMOUNT] ~= '' and order[O_AMOUNT] or '0'
+    
+    -- 1. Statut
+    order[O_STATUS] = 'livrée'
+    redis.call('HSET', order_bucket, order_id, pack_record(order))
+    
+    -- 2. Sets / index de statut, date de livraison
+    move_status(order_id, 'assignée', 'livrée')
+    mark_delivered('orders:delivered_at', order_id)
+    
+    -- 3. Stats du livreur (en cours, complétées, revenu)
+    local driver_bucket = 'drivers:b:' .. bucket_of(driver_id)
+    local raw_driver = redis.call('HGET', driver_bucket, driver_id)
+    if raw_driver then
+        local driver = unpack_record(raw_driver)
+        local remaining = (tonumber(driver[D_IN_PROGRESS]) or 0) - 1
+        driver[D_IN_PROGRESS] = tostring(remaining)
+        driver[D_COMPLETED] = tostring((tonumber(driver[D_COMPLETED]) or 0) + 1)
+        driver[D_REVENUE] = tostring((tonumber(driver[D_REVENUE]) or 0) + tonumber(amount))
+        redis.call('HSET', driver_bucket, driver_id, pack_record(driver))
+        if remaining > 0 then
+            redis.call('ZADD', 'drivers:in_progress', remaining, driver_id)
+        else
+            redis.call('ZREM', 'drivers:in_progress', driver_id)
+        end
+    end
+    
+    -- 4. Journaliser la transition
+    emit_event('orders:events', 'event', 'delivered', 'order_id', order_id,
+               'driver_id', driver_id, 'amount', amount)
+    
+    return 'OK', driver_id, amount
+end
+"""
+
+COMPACT_SCRIPTS = {
+    'assign_order': _COMPACT_ASSIGN_ONE + _ASSIGN_ORDER_MAIN,
+    'assign_orders_bulk': _COMPACT_ASSIGN_ONE + _ASSIGN_ORDERS_BULK_MAIN,
+    'complete_delivery': _COMPACT_COMPLETE_ONE + _COMPLETE_DELIVERY_MAIN,
+    'complete_deliveries_bulk': _COMPACT_COMPLETE_ONE + _COMPLETE_DELIVERIES_BULK_MAIN,
+}
+
+# Libération d'un verrou SET NX: seulement par son détenteur (jeton), un
+# verrou expiré puis repris par un autre worker n'est pas supprimé
+RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+CACHE_SCRIPTS = {
+    'release_lock': RELEASE_LOCK,
+}
+
+LIFECYCLE_SCRIPTS = {
+    'assign_order': ASSIGN_ORDER,
+    'assign_orders_bulk': ASSIGN_ORDERS_BULK,
+    'complete_delivery': COMPLETE_DELIVERY,
+    'complete_deliveries_bulk': COMPLETE_DELIVERIES_BULK,
+}
+
+
+class ScriptRegistry:
+    """Scripts Lua préchargés, appelés par EVALSHA avec repli sur NOSCRIPT"""
+    
+    def __init__(self, redis_conn, scripts=None):
+        self.r = redis_conn
+        self.sources = dict(scripts or LIFECYCLE_SCRIPTS)
+        # Le SHA1 est connu localement: pas besoin d'attendre SCRIPT LOAD
+        self.shas = {
+            name: hashlib.sha1(source.encode('utf-8')).hexdigest()
+            for name, source in self.sources.items()
+        }
+    
+    def load(self):
+        """
+        Charger tous les scripts dans le cache de scripts de Redis
+        (sur un RedisCluster, SCRIPT LOAD est envoyé à tous les primaires)
+        """
+        for name, source in self.sources.items():
+            self.shas[name] = self.r.script_load(source)
+        return self.shas
+    
+    def call(self, name, keys=(), args=()):
+        """Exécuter un script par EVALSHA, en le rechargeant si Redis l'a oublié"""
+        try:
+            return self.r.evalsha(self.shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            # Redis a redémarré ou SCRIPT FLUSH: recharger puis rejouer
+            self.shas[name] = self.r.script_load(self.sources[name])
+            return self.r.evalsha(self.shas[name], len(keys), *keys, *args)
+
+
+class AsyncScriptRegistry(ScriptRegistry):
+    """Même registre pour un client redis.asyncio (méthodes coroutines)"""
+    
+    async def load(self):
+        """Charger tous les scripts dans le cache de scripts de Redis"""
+        for name, source in self.sources.items():
+            self.shas[name] = await self.r.script_load(source)
+        return self.shas
+    
+    async def call(self, name, keys=(), args=()):
+        """Exécuter un script par EVALSHA, en le rechargeant si Redis l'a oublié"""
+        try:
+            return await self.r.evalsha(self.shas[name], len(keys), *keys, *args)
+        except NoScriptError:
+            self.shas[name] = await self.r.script_load(self.sources[name])
+            return await self.r.evalsha(self.shas[name], len(keys), *keys, *args)
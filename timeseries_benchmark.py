@@ -0,0 +1,137 @@
+"""
+Comparaison collection classique / time-series pour deliveries
+
+Charge le même historique généré (graine fixe, livraisons réparties sur
+--days jours) dans deux bases temporaires, l'une avec deliveries classique,
+l'autre en time-series (MongoDeliveryHistory(timeseries=True)), puis compare:
+- le débit d'insertion (documents/s): les documents sont générés avant
+  le chronomètre et les agrégats ne sont pas recalculés, seule
+  l'insertion est mesurée
+- la taille sur disque des données et des index ($collStats)
+- la durée d'une agrégation par région sur les --window derniers jours
+
+Taille et agrégation sont mesurées avec les index de production
+(create_indexes, index des agrégats), créés après l'insertion chronométrée:
+la comparaison porte sur le déploiement réel, pas sur des collections nues.
+
+Usage:
+    python timeseries_benchmark.py                        # 100000 livraisons
+    python timeseries_benchmark.py --count 1000000 --granularity hours
+    python timeseries_benchmark.py --keep                 # garder les bases
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from utils import *
+from data_generator import DataGenerator, fake
+from partie2_mongodb_historique import MongoDeliveryHistory
+
+
+def iter_bench_deliveries(count, days, seed=42):
+    """Historique reproductible: même graine = mêmes documents"""
+    random.seed(seed)
+    fake.seed_instance(seed)
+    drivers = DataGenerator.generate_drivers(200)
+    for delivery in DataGenerator.iter_deliveries(drivers, DataGenerator.iter_orders(count), count):
+        shift = timedelta(days=random.random() * days)
+        delivery['pickup_time'] -= shift
+        delivery['delivery_time'] -= shift
+        yield delivery
+
+
+def storage_stats(collection):
+    """Taille des données et des index sur disque (octets)"""
+    stats = next(collection.aggregate([{'$collStats': {'storageStats': {}}}]))['storageStats']
+    return stats.get('storageSize', 0), stats.get('totalIndexSize', 0)
+
+
+def time_range_aggregation(collection, window_days, repeat):
+    """Durée médiane (ms) d'un $group par région sur les window_days derniers jours"""
+    pipeline = [
+        {'$match': {'delivery_time': {'$gte': datetime.now() - timedelta(days=window_days)}}},
+        {
+            '$group': {
+                '_id': '$region',
+                'nombre_livraisons': {'$sum': 1},
+                'revenu_total': {'$sum': '$amount'},
+                'duree_moyenne': {'$avg': '$duration_minutes'},
+            }
+        },
+    ]
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        list(collection.aggregate(pipeline))
+        durations.append((time.perf_counter() - start) * 1000)
+    return statistics.median(durations)
+
+
+def run_benchmark(count=100000, days=90, window=7, granularity='minutes', repeat=5, keep=False):
+    """Charger les deux variantes et afficher la comparaison"""
+    print_header("BENCHMARK : COLLECTION CLASSIQUE / TIME-SERIES")
+    
+    db = get_mongodb_connection()
+    if db is None:
+        print_error("Impossible de se connecter à MongoDB. Assurez-vous que Docker est lancé.")
+        return None
+    
+    results = {}
+    for label, timeseries in (('Classique', False), ('Time-series', True)):
+        bench_db = db.client[f"{db.name}_bench_{'ts' if timeseries else 'plain'}"]
+        db.client.drop_database(bench_db.name)
+        history = MongoDeliveryHistory(bench_db, timeseries=timeseries, granularity=granularity)
+        
+        # Génération (Faker) hors mesure: même graine, mêmes documents
+        deliveries = list(iter_bench_deliveries(count, days))
+        start = time.perf_counter()
+        history.import_deliveries(deliveries, refresh_rollups=False)
+        elapsed = time.perf_counter() - start
+        del deliveries
+        
+        # Index de production, hors chronomètre d'insertion
+        history.create_indexes()
+        history.rollups.ensure_indexes()
+        
+        storage, indexes = storage_stats(history.deliveries)
+        results[label] = {
+            'import_rate': count / elapsed if elapsed > 0 else 0,
+            'storage': storage,
+            'indexes': indexes,
+            'aggregation_ms': time_range_aggregation(history.deliveries, window, repeat),
+        }
+        if not keep:
+            db.client.drop_database(bench_db.name)
+    
+    plain, ts = results['Classique'], results['Time-series']
+    print_table(
+        ['', 'Classique', 'Time-series'],
+        [
+            ['Insertion (documents/s)', f"{plain['import_rate']:.0f}", f"{ts['import_rate']:.0f}"],
+            ['Données sur disque', format_bytes(plain['storage']), format_bytes(ts['storage'])],
+            ['Index', format_bytes(plain['indexes']), format_bytes(ts['indexes'])],
+            [
+                f"Agrégation {window} jours (ms, médiane)",
+                f"{plain['aggregation_ms']:.1f}",
+                f"{ts['aggregation_ms']:.1f}",
+            ],
+        ],
+        f"{count} livraisons sur {days} jours (granularité {granularity})",
+    )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark collection classique / time-series")
+    parser.add_argument('--count', type=int, default=100000, help="nombre de livraisons")
+    parser.add_argument('--days', type=int, default=90, help="période couverte par l'historique")
+    parser.add_argument('--window', type=int, default=7, help="fenêtre de l'agrégation (jours)")
+    parser.add_argument('--granularity', choices=MongoDeliveryHistory.TIMESERIES_GRANULARITIES,
+                        default='minutes')
+    parser.add_argument('--repeat', type=int, default=5, help="exécutions de l'agrégation")
+    parser.add_argument('--keep', action='store_true', help="ne pas supprimer les bases de test")
+    args = parser.parse_args()
+    
+    run_benchmark(args.count, args.days, args.window, args.granularity, args.repeat, args.keep)
@@ -2,7 +2,11 @@
 Fonctions utilitaires pour le projet de gestion de livraisons
 """
 import os
+import threading
+from itertools import islice
 import redis
+import redis.asyncio
+import redis.cluster
 from pymongo import MongoClient
 from dotenv import load_dotenv
 from colorama import Fore, Style, init
@@ -15,21 +19,151 @@ init(autoreset=True)
 load_dotenv()
 
 
-def get_redis_connection():
-    """Créer une connexion à Redis"""
+# Pool de connexions Redis partagé par tout le processus (voir get_redis_pool)
+_redis_pool = None
+_redis_pool_lock = threading.Lock()
+_redis_pool_checked = False
+
+
+def _env_flag(name, default):
+    """Lire un booléen depuis l'environnement (1/true/yes/on)"""
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _redis_pool_settings():
+    """
+    Paramètres du pool Redis lus depuis .env:
+    - REDIS_MAX_CONNECTIONS : taille maximale du pool
+    - REDIS_POOL_TIMEOUT : attente max (s) d'une connexion libre
+    - REDIS_SOCKET_KEEPALIVE : keepalive TCP des sockets
+    - REDIS_HEALTH_CHECK_INTERVAL : PING des connexions inactives depuis N s
+    - REDIS_USE_HIREDIS : auto (défaut), 1 pour forcer hiredis, 0 pour l'interdire
+    """
+    settings = {
+        'host': os.getenv('REDIS_HOST', 'localhost'),
+        'port': int(os.getenv('REDIS_PORT', 6379)),
+        'db': int(os.getenv('REDIS_DB', 0)),
+        'decode_responses': True,
+        'max_connections': int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+        'timeout': float(os.getenv('REDIS_POOL_TIMEOUT', 5)),
+        'socket_keepalive': _env_flag('REDIS_SOCKET_KEEPALIVE', True),
+        'health_check_interval': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
+    }
+    
+    use_hiredis = os.getenv('REDIS_USE_HIREDIS', 'auto').strip().lower()
+    if use_hiredis != 'auto':
+        from redis._parsers import _HiredisParser, _RESP2Parser
+        from redis.utils import HIREDIS_AVAILABLE
+        if _env_flag('REDIS_USE_HIREDIS', False):
+            if HIREDIS_AVAILABLE:
+                settings['parser_class'] = _HiredisParser
+            else:
+                print_warning("hiredis demandé mais non installé (pip install hiredis), parser Python utilisé")
+        else:
+            settings['parser_class'] = _RESP2Parser
+    
+    return settings
+
+
+def get_redis_pool():
+    """
+    Pool de connexions Redis unique du processus, créé au premier appel
+    Pool bloquant: au-delà de REDIS_MAX_CONNECTIONS, les appelants
+    attendent une connexion libre (REDIS_POOL_TIMEOUT) au lieu d'en ouvrir
+    de nouvelles sans limite.
+    """
+    global _redis_pool
+    with _redis_pool_lock:
+        if _redis_pool is None:
+            _redis_pool = redis.BlockingConnectionPool(**_redis_pool_settings())
+        return _redis_pool
+
+
+def get_redis_pool_stats():
+    """Taux d'utilisation du pool partagé (connexions créées, libres, utilisées)"""
+    pool = get_redis_pool()
+    # Attributs internes de BlockingConnectionPool: la file contient les
+    # connexions libres et des None pour les places jamais utilisées
+    with pool.pool.mutex:
+        created = len(pool._connections)
+        idle = sum(1 for connection in pool.pool.queue if connection is not None)
+    in_use = created - idle
+    return {
+        'max_connections': pool.max_connections,
+        'created': created,
+        'idle': idle,
+        'in_use': in_use,
+        'utilization': in_use / pool.max_connections if pool.max_connections else 0,
+    }
+
+
+def get_redis_connection(check=False):
+    """
+    Client Redis adossé au pool partagé du processus
+    La connexion n'est testée (PING) que jusqu'au premier succès, ou si
+    check=True: les appels suivants réutilisent des connexions déjà ouvertes.
+    """
+    global _redis_pool_checked
+    try:
+        r = redis.Redis(connection_pool=get_redis_pool())
+        if check or not _redis_pool_checked:
+            # Test de connexion
+            r.ping()
+            _redis_pool_checked = True
+            print(f"{Fore.GREEN}✓ Connexion Redis établie{Style.RESET_ALL}")
+        return r
+    except Exception as e:
+        print(f"{Fore.RED}✗ Erreur connexion Redis: {e}{Style.RESET_ALL}")
+        return None
+
+
+def get_redis_cluster_connection():
+    """
+    Créer une connexion Redis Cluster
+    REDIS_CLUSTER_NODES : nœuds de départ, ex. localhost:7000,localhost:7001
+    """
     try:
-        r = redis.Redis(
-            host=os.getenv('REDIS_HOST', 'localhost'),
-            port=int(os.getenv('REDIS_PORT', 6379)),
-            db=int(os.getenv('REDIS_DB', 0)),
-            decode_responses=True
+        nodes = []
+        for node in os.getenv('REDIS_CLUSTER_NODES', 'localhost:7000').split(','):
+            host, port = node.strip().rsplit(':', 1)
+            nodes.append(redis.cluster.ClusterNode(host, int(port)))
+        r = redis.cluster.RedisCluster(
+            startup_nodes=nodes,
+            decode_responses=True,
+            max_connections=int(os.getenv('REDIS_MAX_CONNECTIONS', 50)),
+            socket_keepalive=_env_flag('REDIS_SOCKET_KEEPALIVE', True),
+            health_check_interval=int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', 30)),
         )
         # Test de connexion
         r.ping()
-        print(f"{Fore.GREEN}✓ Connexion Redis établie{Style.RESET_ALL}")
+        print(f"{Fore.GREEN}✓ Connexion Redis Cluster établie ({len(r.get_primaries())} primaires){Style.RESET_ALL}")
         return r
     except Exception as e:
-        print(f"{Fore.RED}✗ Erreur connexion Redis: {e}{Style.RESET_ALL}")
+        print(f"{Fore.RED}✗ Erreur connexion Redis Cluster: {e}{Style.RESET_ALL}")
+        return None
+
+
+async def get_async_redis_connection():
+    """
+    Créer une connexion asyncio à Redis (redis.asyncio)
+    Mêmes réglages de pool que get_redis_connection; le pool asyncio est
+    lié à la boucle d'événements, il est donc propre à ce client.
+    """
+    try:
+        settings = _redis_pool_settings()
+        settings.pop('parser_class', None)
+        r = redis.asyncio.Redis(
+            connection_pool=redis.asyncio.BlockingConnectionPool(**settings)
+        )
+        # Test de connexion
+        await r.ping()
+        print(f"{Fore.GREEN}✓ Connexion Redis (asyncio) établie{Style.RESET_ALL}")
+        return r
+    except Exception as e:
+        print(f"{Fore.RED}✗ Erreur connexion Redis (asyncio): {e}{Style.RESET_ALL}")
         return None
 
 
@@ -110,6 +244,16 @@ def clear_mongodb(db):
         print_error(f"Erreur lors du nettoyage MongoDB: {e}")
 
 
+def iter_chunks(iterable, size):
+    """Découper un itérable en listes de taille size, sans tout matérialiser"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def format_time(minutes):
     """Formater un temps en minutes en heures:minutes"""
     if minutes < 60:
@@ -124,6 +268,15 @@ def format_currency(amount):
     return f"{amount}€"
 
 
+def format_bytes(size):
+    """Formater une taille en octets (o, Ko, Mo, Go)"""
+    for unit in ('o', 'Ko', 'Mo'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} Go"
+
+
 def wait_for_input(message="Appuyez sur Entrée pour continuer..."):
     """Attendre une entrée utilisateur"""
     input(f"\n{Fore.YELLOW}{message}{Style.RESET_ALL}")